@@ -0,0 +1,103 @@
+"""
+Benchmark of complete_average on long workflows: the step pair loop with igraph shortest
+paths it replaced, complete_average, and score_workflows_batch. The workflows are random
+trees of tools from the graph, with the lengths of the workflows in data/workflowlen.csv.
+
+Usage:
+    python benchmarks/complete_average.py [--graph tests/data] [--min-length 20] [--max-length 30]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+import igraph
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import pubmetric.network
+import pubmetric.metrics
+
+
+def complete_average_pairwise(graph: igraph.Graph, workflow: dict, factor: int = 4) -> float:
+    """The previous complete_average: one edge weight lookup and igraph path per step pair."""
+    step_names = list(workflow['steps'].keys())
+    edges = workflow['edges']
+    if not edges:
+        return 0.0
+    workflow_graph = igraph.Graph.TupleList(edges, directed=False, weights=False)
+    workflow_id_dict = pubmetric.metrics.get_node_ids(workflow_graph, key='name')
+    aggregated_weight = []
+    for i in range(len(step_names)):
+        for j in range(i + 1, len(step_names)):
+            edge = (workflow['steps'][step_names[i]], workflow['steps'][step_names[j]])
+            weight = pubmetric.metrics.get_graph_edge_weight(graph=graph, edge=edge) or 0.0
+            path = workflow_graph.get_shortest_paths(workflow_id_dict[step_names[i]],
+                                                     to=workflow_id_dict[step_names[j]],
+                                                     output="epath")
+            path_length = len(path[0])
+            aggregated_weight.append(weight / factor**(float(path_length) - 1) if path_length else 0)
+    return round(float(sum(aggregated_weight) / len(edges)), 2)
+
+
+def random_workflow(graph: igraph.Graph, nr_steps: int, rng: random.Random) -> dict:
+    """Creates a workflow of tools connected in the graph, as a random tree of nr_steps steps."""
+    pmids = graph.vs['pmid']
+    graph_edges = graph.get_edgelist()
+    steps = {}
+    for i in range(nr_steps):
+        source, target = rng.choice(graph_edges)
+        steps[f'Tool{i}_{i + 1:02d}'] = pmids[rng.choice((source, target))]
+    step_names = list(steps)
+    edges = [(step_names[rng.randrange(i)], step_names[i]) for i in range(1, nr_steps)]
+    return {'steps': steps,
+            'edges': edges,
+            'pmid_edges': [(steps[source], steps[target]) for source, target in edges]}
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument('--graph', default='tests/data',
+                                 help='Folder containing the co-citation graph.')
+    argument_parser.add_argument('--lengths', default='data/workflowlen.csv',
+                                 help='CSV file with a length column of workflow lengths.')
+    argument_parser.add_argument('--min-length', type=int, default=20)
+    argument_parser.add_argument('--max-length', type=int, default=30)
+    argument_parser.add_argument('--repeats', type=int, default=20,
+                                 help='Number of random workflows per catalogued length.')
+    arguments = argument_parser.parse_args()
+
+    graph = pubmetric.network.read_graph(arguments.graph)
+    lengths = pd.read_csv(arguments.lengths, skipinitialspace=True)['length'].dropna().astype(int)
+    lengths = lengths[(lengths >= arguments.min_length) & (lengths <= arguments.max_length)]
+    rng = random.Random(0)
+    workflows = [random_workflow(graph, length, rng)
+                 for length in lengths for _ in range(arguments.repeats)]
+    pubmetric.metrics.get_graph_index(graph) # built once, outside of the timings
+
+    implementations = {
+        'pairwise (previous)': lambda: [complete_average_pairwise(graph, workflow)
+                                        for workflow in workflows],
+        'complete_average': lambda: [pubmetric.metrics.complete_average(graph, workflow)
+                                     for workflow in workflows],
+        'score_workflows_batch': lambda: list(pubmetric.metrics.score_workflows_batch(
+            graph, workflows, metrics=('complete_average',))['complete_average'])
+    }
+
+    print(f"{len(workflows)} workflows of {arguments.min_length}-{arguments.max_length} steps "
+          f"(mean {np.mean([len(w['steps']) for w in workflows]):.1f})\n")
+    print(f"{'implementation':<25}{'total (s)':>12}{'per workflow (ms)':>20}{'equal':>8}")
+    reference = None
+    for name, implementation in implementations.items():
+        start_time = time.perf_counter()
+        scores = implementation()
+        elapsed = time.perf_counter() - start_time
+        reference = scores if reference is None else reference
+        print(f"{name:<25}{elapsed:>12.3f}{1000 * elapsed / len(workflows):>20.3f}"
+              f"{str(scores == reference):>8}")
+
+
+if __name__ == '__main__':
+    main()
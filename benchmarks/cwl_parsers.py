@@ -0,0 +1,88 @@
+"""
+Benchmark of the CWL workflow parsers: parse_cwl (cwl_utils object model),
+parse_undocumented_workflows (string splitting) and parse_cwl_lines (single pass).
+
+Usage:
+    python benchmarks/cwl_parsers.py [--directory workflows/APE] [--graph tests/data]
+    python benchmarks/cwl_parsers.py --steps 30 300 3000
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import pubmetric.network
+import pubmetric.workflow
+
+
+def time_parser(parser, graph, filenames: list) -> tuple:
+    """Parses all files without the parse cache, and returns the workflows, errors and time."""
+    workflows, errors = {}, {}
+    start_time = time.perf_counter()
+    for filename in filenames:
+        try:
+            workflows[filename] = parser(graph=graph, cwl_filename=filename, use_cache=False)
+        except Exception as e: # pylint: disable=broad-except
+            errors[filename] = f"{type(e).__name__}: {e}"
+    return workflows, errors, time.perf_counter() - start_time
+
+
+def write_chain_workflow(directory: str, nr_steps: int) -> str:
+    """Writes an APE style workflow with a chain of nr_steps steps, and returns its path."""
+    lines = ['cwlVersion: v1.2', 'class: Workflow', 'inputs:', '  input_1:', '    type: File',
+             'steps:']
+    for i in range(1, nr_steps + 1):
+        source = f'XTandem_{i - 1:02d}/XTandem_out_1' if i > 1 else 'input_1'
+        lines += [f'  XTandem_{i:02d}:',
+                  '    run: add-path-to-the-implementation/XTandem.cwl',
+                  '    in:',
+                  f'      XTandem_in_1: {source}',
+                  '    out: [XTandem_out_1]']
+    lines += ['outputs:', '  output_1:', '    type: File',
+              f'    outputSource: XTandem_{nr_steps:02d}/XTandem_out_1']
+    filename = os.path.join(directory, f'chain_{nr_steps}.cwl')
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return filename
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument('--directory', default='workflows/APE',
+                                 help='Directory of the CWL files.')
+    argument_parser.add_argument('--graph', default='tests/data',
+                                 help='Folder containing the co-citation graph.')
+    argument_parser.add_argument('--steps', type=int, nargs='+',
+                                 help='Benchmark generated chain workflows with these numbers '
+                                      'of steps instead of a directory.')
+    arguments = argument_parser.parse_args()
+
+    graph = pubmetric.network.read_graph(arguments.graph)
+    if arguments.steps:
+        arguments.directory = tempfile.mkdtemp()
+        for nr_steps in arguments.steps:
+            write_chain_workflow(arguments.directory, nr_steps)
+    filenames = sorted(glob.glob(os.path.join(arguments.directory, '*.cwl')))
+    parsers = {
+        'parse_cwl': pubmetric.workflow.parse_cwl,
+        'parse_undocumented_workflows': pubmetric.workflow.parse_undocumented_workflows,
+        'parse_cwl_lines': pubmetric.workflow.parse_cwl_lines
+    }
+
+    results = {name: time_parser(parser, graph, filenames) for name, parser in parsers.items()}
+    reference, _, _ = results['parse_cwl']
+
+    print(f"{len(filenames)} files in {arguments.directory}\n")
+    print(f"{'parser':<30}{'total (s)':>12}{'per file (ms)':>16}{'errors':>8}{'equal to parse_cwl':>20}")
+    for name, (workflows, errors, elapsed) in results.items():
+        compared = [filename for filename in workflows if filename in reference]
+        equal = sum(workflows[filename] == reference[filename] for filename in compared)
+        print(f"{name:<30}{elapsed:>12.3f}{1000 * elapsed / max(len(filenames), 1):>16.3f}"
+              f"{len(errors):>8}{f'{equal}/{len(compared)}':>20}")
+
+
+if __name__ == '__main__':
+    main()
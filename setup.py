@@ -17,6 +17,7 @@ setup(
         'pandas',
         'tqdm==4.66.2',
         'numpy',
+        'scipy',
         'matplotlib',
         'jsonpath-ng',
         'ruamel.yaml',
@@ -30,6 +31,9 @@ setup(
             'pytest',
             'pytest-datadir',
             'pytest-asyncio'
+        ],
+        'parquet': [
+            'pyarrow'
         ]
     },
     classifiers=[
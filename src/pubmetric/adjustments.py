@@ -0,0 +1,191 @@
+"""
+Composable adjustments of co-citation edge weights, applied to whole arrays of weights
+at once, e.g. Pipeline([Log(), AgeAdjust(default=10), CitationAdjust()])
+"""
+import abc
+import math
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+class Adjustment(abc.ABC):
+    """
+    A step of a Pipeline. Adjustments are called with the weights of node pairs, the igraph
+    IDs of the nodes of the pairs and the GraphIndex of the graph, and return the adjusted
+    weights.
+    """
+    @abc.abstractmethod
+    def __call__(self,
+                 weights: np.ndarray,
+                 sources: np.ndarray,
+                 targets: np.ndarray,
+                 index) -> np.ndarray:
+        """Returns the adjusted weights, an array of the same length as weights."""
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}()"
+
+
+class ValueTransform(Adjustment):
+    """
+    Applies a function to every weight. Weights are mostly co-citation counts with few
+    distinct values, so the function is evaluated once per distinct value, with the same
+    result as the scalar transform_weight.
+    """
+    function = None
+
+    def __call__(self, weights, sources, targets, index):
+        values, inverse = np.unique(weights, return_inverse=True)
+        transformed = np.array([self.function(value) for value in values.tolist()], dtype=np.float64)
+        return transformed[inverse.ravel()]
+
+
+class Log(ValueTransform):
+    """Natural logarithm of the weight + 1, as transform_weight(weight, "log")."""
+    @staticmethod
+    def function(weight: float) -> float:
+        return math.log(weight + 1)
+
+
+class Sqrt(ValueTransform):
+    """Square root of the weight, as transform_weight(weight, "sqrt")."""
+    @staticmethod
+    def function(weight: float) -> float:
+        return math.sqrt(weight)
+
+
+class NodeAdjustment(Adjustment):
+    """
+    Divides every weight by the smaller value of a node attribute of its two nodes, at
+    least 1. Nodes without a value use the default.
+    """
+    attribute = None
+
+    def __init__(self, default: Optional[float] = None):
+        """
+        :param default: Value used for nodes without a value of the attribute.
+        """
+        self.default = default
+
+    def node_values(self, index, nodes: np.ndarray) -> np.ndarray:
+        """Returns the attribute values of the nodes, with the default for missing values."""
+        values = getattr(index, self.attribute)
+        if values is None:
+            if self.default is None:
+                raise ValueError(f"The graph has no {self.attribute} and {self!r} has no default.")
+            return np.full(len(nodes), self.default, dtype=np.float64)
+        node_values = values[nodes]
+        if node_values.dtype == object: # None for nodes without a value
+            node_values = np.array([self.default if value is None else value
+                                    for value in node_values.tolist()], dtype=np.float64)
+        return node_values
+
+    def __call__(self, weights, sources, targets, index):
+        minimum = np.minimum(self.node_values(index, sources), self.node_values(index, targets))
+        return weights / np.maximum(1, minimum)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(default={self.default!r})"
+
+
+class AgeAdjust(NodeAdjustment):
+    """Divides the weights by the minimum age of the nodes, as age_adjust_weight."""
+    attribute = 'ages'
+
+    def __init__(self, default: Optional[float] = 10):
+        super().__init__(default)
+
+
+class DegreeAdjust(NodeAdjustment):
+    """Divides the weights by the minimum degree of the nodes, as degree_adjust_weight."""
+    attribute = 'degrees'
+
+
+class CitationAdjust(NodeAdjustment):
+    """Divides the weights by the minimum number of citations of the nodes, as citation_adjusted_weight."""
+    attribute = 'nr_citations'
+
+    def __init__(self, default: Optional[float] = 100):
+        super().__init__(default)
+
+
+TRANSFORMS = {'log': Log, 'sqrt': Sqrt}
+
+
+class Pipeline:
+    """
+    Sequence of adjustments applied in order to arrays of edge weights. The metric functions
+    accept a Pipeline as their adjustments argument, instead of the transform, age_adjustment
+    and degree_adjustment options.
+    """
+    def __init__(self, steps: Sequence[Adjustment] = ()):
+        """
+        :param steps: The adjustments, applied in the given order.
+        """
+        self.steps = list(steps)
+
+    @classmethod
+    def from_options(cls,
+                     transform: Optional[str] = None,
+                     age_adjustment: bool = False,
+                     degree_adjustment: bool = False) -> "Pipeline":
+        """
+        Creates the pipeline of the transform, age_adjustment and degree_adjustment options
+        of the metric functions.
+
+        :raises ValueError: If the transform is not "log" or "sqrt".
+        """
+        steps = []
+        if transform:
+            if transform not in TRANSFORMS:
+                raise ValueError("Invalid transformation option")
+            steps.append(TRANSFORMS[transform]())
+        if age_adjustment:
+            steps.append(AgeAdjust())
+        if degree_adjustment:
+            steps.append(DegreeAdjust())
+        return cls(steps)
+
+    def __call__(self,
+                 weights: np.ndarray,
+                 sources: np.ndarray,
+                 targets: np.ndarray,
+                 index) -> np.ndarray:
+        """
+        Adjusts the weights of node pairs.
+
+        :param weights: Array of the weights of the node pairs.
+        :param sources: Array of igraph IDs of the first nodes, all in the graph.
+        :param targets: Array of igraph IDs of the second nodes, all in the graph.
+        :param index: The pubmetric.metrics.GraphIndex of the graph.
+
+        :return: Array of the adjusted weights.
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        for step in self.steps:
+            weights = step(weights, sources, targets, index)
+        return weights
+
+    def __bool__(self) -> bool:
+        return bool(self.steps)
+
+    def __repr__(self) -> str:
+        return f"Pipeline({self.steps!r})"
+
+
+def as_pipeline(adjustments: Optional[Pipeline] = None,
+                transform: Optional[str] = None,
+                age_adjustment: bool = False,
+                degree_adjustment: bool = False) -> Pipeline:
+    """
+    Returns the pipeline given to a metric function, or the one of its options.
+
+    :raises ValueError: If both a pipeline and options are given.
+    """
+    if adjustments is None:
+        return Pipeline.from_options(transform, age_adjustment, degree_adjustment)
+    if transform or age_adjustment or degree_adjustment:
+        raise ValueError("Give either an adjustment pipeline or the transform, age_adjustment "
+                         "and degree_adjustment options, not both.")
+    return adjustments
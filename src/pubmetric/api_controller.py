@@ -1,5 +1,7 @@
 import os
+import asyncio
 import tempfile
+from datetime import datetime
 from contextlib import asynccontextmanager
 
 from apscheduler.jobstores.memory import MemoryJobStore
@@ -8,6 +10,9 @@ from fastapi import FastAPI, File, UploadFile
 from pydantic import BaseModel
 from typing import List, Optional
 
+import igraph
+
+import pubmetric.log
 import pubmetric.metrics
 import pubmetric.network
 import pubmetric.workflow
@@ -23,9 +28,89 @@ scheduler = AsyncIOScheduler(jobstores=jobstores, timezone='Europe/Berlin')
 
 latest_output_path = "out_20240801231111"
 
+# The periodic job creates and updates the graph with the same tools. graph_test_size
+# limits the bio.tools crawl to a number of tools, e.g. for a test deployment; None
+# creates the full graph.
+graph_topic_id = "topic_0121"
+graph_test_size: Optional[int] = None
+graph_tool_selection = None
+
+
+class GraphSnapshot:
+    """
+    A loaded graph together with the lookup indexes used for scoring, see
+    pubmetric.metrics.GraphIndex. Snapshots are never
+    modified after creation; a new graph is swapped in by replacing the current snapshot,
+    so requests that already hold the old one can finish with it.
+    """
+    def __init__(self, graph: igraph.Graph, path: str):
+        """
+        :param graph: The co-citation igraph.Graph with the attributes of add_graph_attributes.
+        :param path: The output folder the graph was loaded from.
+        """
+        self.graph = graph
+        self.path = path
+        self.index = pubmetric.metrics.GraphIndex(graph)
+        self.pmid_ages = dict(zip(graph.vs['pmid'], graph.vs['age']))
+
+    @classmethod
+    def read(cls, path: str) -> "GraphSnapshot":
+        """Reads the graph in the given output folder and builds its indexes."""
+        return cls(pubmetric.network.read_graph(path), path)
+
+    @classmethod
+    async def load(cls, path: str) -> "GraphSnapshot":
+        """
+        Reads the graph and builds its indexes in a worker thread, so the running requests
+        are not blocked.
+        """
+        return await asyncio.to_thread(cls.read, path)
+
+
+current_snapshot: Optional[GraphSnapshot] = None
+snapshot_lock: Optional[asyncio.Lock] = None # created in the event loop, see get_snapshot_lock
+
+def get_snapshot_lock() -> asyncio.Lock:
+    """
+    Returns the lock held while the first snapshot is loaded. It is created on first use,
+    from within the running event loop, as locks created at import time are bound to
+    another loop in Python 3.9.
+    """
+    global snapshot_lock
+    if snapshot_lock is None:
+        snapshot_lock = asyncio.Lock()
+    return snapshot_lock
+
+async def get_snapshot() -> GraphSnapshot:
+    """
+    Returns the current graph snapshot, loading the graph of latest_output_path if it has
+    not been loaded yet.
+
+    :return: GraphSnapshot
+    """
+    if current_snapshot is None:
+        async with get_snapshot_lock():
+            if current_snapshot is None:
+                await swap_snapshot(latest_output_path)
+    return current_snapshot
+
+async def swap_snapshot(path: str):
+    """
+    Loads the graph in the given output folder and makes it the current snapshot. The
+    latest output path is only updated once the new graph has been loaded successfully.
+
+    :param path: The output folder of the new graph.
+    """
+    global current_snapshot, latest_output_path
+    snapshot = await GraphSnapshot.load(path)
+    current_snapshot, latest_output_path = snapshot, path
+    pubmetric.log.log_with_timestamp(f"Serving graph from {path}.")
+
 
 @asynccontextmanager
 async def lifespan(application: FastAPI):
+    global snapshot_lock
+    snapshot_lock = asyncio.Lock()
     scheduler.start()
     try:
         yield
@@ -39,13 +124,18 @@ class ScoreResponse(BaseModel):
 
 class GraphRequest(BaseModel):
     topic_id: str
-    test_size: str
+    test_size: Optional[int] = None
     tool_list: Optional[list]
 
 @scheduler.scheduled_job('interval', days=30)
 async def periodic_graph_generation():
-    """Periodically generates a new citation network graph every 30 days and updates
-        the global path if the graph is successfully created. 
+    """Periodically updates the citation network graph every 30 days and updates
+        the global path if the graph is successfully created. Only the tools and
+        citations that changed since the previous graph are downloaded; if there is
+        no previous graph with stored citation lists, or if the previous graph was created
+        with another topic or test size (e.g. by recreate_graph), the graph is created from
+        scratch. The graph is always created and updated with graph_topic_id,
+        graph_test_size and graph_tool_selection.
         If the graph file is not found, it logs an error message.
 
     :return: Dict
@@ -53,13 +143,23 @@ async def periodic_graph_generation():
         or an error message if the graph file is not found.
 
     """
-    global latest_output_path
+    new_output_path = f'out/out_{datetime.now().strftime("%Y%m%d%H%M%S")}'
     try:
-        new_output_path = await pubmetric.network.create_network(topic_id="default",
-                                                                 test_size=20,
-                                                                 return_path = True) # TODO: rm test size
-        if os.path.exists(new_output_path + "/graph.pkl"):
-            latest_output_path = new_output_path
+        if (pubmetric.network.update_inputs_exist(latest_output_path)
+                and pubmetric.network.read_metadata_settings(latest_output_path)
+                    == (graph_topic_id, graph_test_size)):
+            await pubmetric.network.update_network(inpath=latest_output_path,
+                                                   outpath=new_output_path,
+                                                   topic_id=graph_topic_id,
+                                                   test_size=graph_test_size,
+                                                   tool_selection=graph_tool_selection)
+        else:
+            await pubmetric.network.create_network(topic_id=graph_topic_id,
+                                                   outpath=new_output_path,
+                                                   test_size=graph_test_size,
+                                                   tool_selection=graph_tool_selection)
+        if pubmetric.network.graph_exists(new_output_path):
+            await swap_snapshot(new_output_path)
             return {"message": f"Graph and metadata file recreated "
                     f"successfully New graph path: {latest_output_path}."}
         else:
@@ -82,7 +182,8 @@ async def score_workflow(cwl_file: UploadFile = File(None)):
         metric and age benchmarks accoring to the Workflomics JSON Schema for Benchmarks.
     """
 
-    graph = await pubmetric.network.create_network(inpath=latest_output_path, load_graph=True) 
+    snapshot = await get_snapshot() # kept for the whole request, even if a new graph is swapped in
+    graph = snapshot.graph
     with tempfile.TemporaryDirectory() as temp_dir:
 
         cwl_file_path = os.path.join(temp_dir, cwl_file.filename)
@@ -98,10 +199,12 @@ async def score_workflow(cwl_file: UploadFile = File(None)):
 
         # Metrics
         workflow_level_score =  pubmetric.metrics.workflow_average(graph=graph,
-                                                                   workflow=pmid_workflow)
+                                                                   workflow=pmid_workflow,
+                                                                   index=snapshot.index)
         workflow_desirability = pubmetric.metrics.calculate_desirability(score=workflow_level_score,
                                                                          thresholds= [0, 400])
-        tool_level_scores = pubmetric.metrics.tool_average_sum(graph, workflow)
+        tool_level_scores = pubmetric.metrics.tool_average_sum(graph, workflow,
+                                                               index=snapshot.index)
 
 
         tool_level_output = []
@@ -121,7 +224,7 @@ async def score_workflow(cwl_file: UploadFile = File(None)):
         ages_output = []
         ages = []
         for tool_name, pmid in workflow['steps'].items():
-            age = next((tool['age'] for tool in graph.vs if tool['pmid'] == pmid), None)
+            age = snapshot.pmid_ages.get(pmid)
             if not age or age > 40: # igraph requires all values of same type, hence >40 is None
                 age = "Unknown"
                 desirability = 0
@@ -179,13 +282,13 @@ async def recreate_graph(graph_request: GraphRequest): # if you want to recreate
 
 
     """
-    global latest_output_path
+    new_output_path = f'out/out_{datetime.now().strftime("%Y%m%d%H%M%S")}'
     try:
-        new_output_path = await pubmetric.network.create_network(topic_id=graph_request.topic_id,
-                                                                 test_size=20,
-                                                                 return_path=True)
-        if os.path.exists(os.path.join(new_output_path, "graph.pkl")):
-            latest_output_path = new_output_path
+        await pubmetric.network.create_network(topic_id=graph_request.topic_id,
+                                               outpath=new_output_path,
+                                               test_size=graph_request.test_size)
+        if pubmetric.network.graph_exists(new_output_path):
+            await swap_snapshot(new_output_path)
             return {"message": 
                     f"Graph and metadata file recreated successfully New graph path: {latest_output_path}."}
         else:
@@ -0,0 +1,246 @@
+"""
+Persistent on-disk cache for the responses of the data downloads
+"""
+import os
+import json
+import time
+import zlib
+import queue
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+
+DAY = 24 * 3600 # seconds
+# Citation lists change, so they are downloaded anew for every monthly graph, while a rerun
+# of an interrupted build within a week is served from the cache
+DEFAULT_TTL = 7 * DAY
+# bio.tools gains tools every month, and its pages shift as tools are added, so the tool
+# list is only reused by reruns on the same day; pages of different ages never get mixed
+# and the monthly refresh always sees the new tools. PubMed records rarely change, they
+# are kept for several graph refreshes.
+ENDPOINT_TTLS = {
+    'https://bio.tools/api/': DAY,
+    'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/': 365 * DAY,
+}
+DEFAULT_MAX_SIZE = 1024 ** 3 # bytes
+
+_CLOSE = object()
+
+
+class ResponseCache:
+    """
+    SQLite backed cache of JSON responses, keyed by a hash of the request URL and body.
+    Entries expire after a time to live that depends on the endpoint, and the least
+    recently used entries are evicted when the cache grows beyond its maximum size.
+    Writes are done by a background thread, so that storing a response never blocks the
+    event loop of the downloads; responses waiting to be written are served from memory.
+    """
+    def __init__(self,
+                 path: str,
+                 ttl: Optional[float] = DEFAULT_TTL,
+                 max_size: int = DEFAULT_MAX_SIZE,
+                 offline: bool = False,
+                 endpoint_ttls: Optional[dict] = None):
+        """
+        :param path: Path to the SQLite database file. It is created if it does not exist.
+        :param ttl: Default time to live of the entries in seconds. None means the entries
+            never expire. Default is 7 days.
+        :param max_size: Maximum total size of the stored (compressed) responses in bytes.
+            Default is 1 GB.
+        :param offline: If True, expired entries are still returned and requests missing
+            from the cache are not sent, so that the data can be rebuilt without network.
+        :param endpoint_ttls: Optional dictionary mapping URL prefixes to the time to live
+            of their entries, overriding ttl. Defaults to ENDPOINT_TTLS, a day for
+            bio.tools and a year for the NCBI E-utilities.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.endpoint_ttls = ENDPOINT_TTLS if endpoint_ttls is None else endpoint_ttls
+        self.max_size = max_size
+        self.offline = offline
+        self.connection = sqlite3.connect(path, check_same_thread=False) # only read from
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, url TEXT, created REAL, accessed REAL, size INTEGER, body BLOB)")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.connection.commit()
+        self.size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        self._lock = threading.Lock()
+        self._pending = {} # key -> (url, created, body) of the entries not written yet
+        self._queue = queue.Queue()
+        self._error = None
+        self._writer = threading.Thread(target=self._write, name=f"cache {path}", daemon=True)
+        self._writer.start()
+
+    @staticmethod
+    def key(url: str, data: Optional[dict] = None) -> str:
+        """
+        Creates the cache key of a request.
+
+        :param url: The request URL.
+        :param data: Optional form data of a POST request.
+
+        :return: SHA-256 hex digest of the URL and the sorted form data.
+        """
+        request = url if data is None else url + json.dumps(data, sort_keys=True, default=str)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def entry_ttl(self, url: str) -> Optional[float]:
+        """Returns the time to live of the entries of a URL, see endpoint_ttls."""
+        prefixes = [prefix for prefix in self.endpoint_ttls if url and url.startswith(prefix)]
+        return self.endpoint_ttls[max(prefixes, key=len)] if prefixes else self.ttl
+
+    def get(self, key: str, ttl: Optional[float] = None) -> Optional[dict]:
+        """
+        Returns a cached response.
+
+        :param key: The cache key, see ResponseCache.key.
+        :param ttl: Optional time to live in seconds overriding the one of the entry.
+
+        :return: The cached JSON response, or None if it is missing or expired.
+        """
+        with self._lock:
+            row = self._pending.get(key)
+        if row is None:
+            row = self.connection.execute("SELECT url, created, body FROM responses WHERE key = ?",
+                                          (key,)).fetchone()
+        if row is None:
+            return None
+        url, created, body = row
+        ttl = ttl if ttl is not None else self.entry_ttl(url)
+        now = time.time()
+        if ttl is not None and now - created > ttl and not self.offline:
+            return None
+        self._queue.put(('access', key, now))
+        return json.loads(zlib.decompress(body))
+
+    def set(self, key: str, value: dict, url: str = ''):
+        """
+        Stores a response, evicting the least recently used entries if the cache is full.
+        The response is written in the background, only the eviction is waited for.
+
+        :param key: The cache key, see ResponseCache.key.
+        :param value: The JSON response.
+        :param url: The request URL, which determines the time to live of the entry.
+
+        :raises Exception: The error of the background writer, if it failed.
+        """
+        if self._error:
+            raise self._error
+        body = zlib.compress(json.dumps(value).encode('utf-8'))
+        entry = (url, time.time(), body)
+        with self._lock:
+            old = self._pending.get(key)
+            if old is None:
+                old = self.connection.execute("SELECT url, created, body FROM responses "
+                                              "WHERE key = ?", (key,)).fetchone()
+            self._pending[key] = entry
+            self.size += len(body) - (len(old[2]) if old else 0)
+            full = self.size > self.max_size
+        self._queue.put(('set', key, entry))
+        if full: # waited for, which is rare as a tenth of the cache is freed at once
+            self.evict()
+
+    def _write(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        closing = False
+        while not closing:
+            operations = [self._queue.get()]
+            while True: # everything queued in the meantime is written in one transaction
+                try:
+                    operations.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            written = set()
+            try:
+                for operation in operations:
+                    if operation is _CLOSE:
+                        closing = True
+                    elif operation[0] == 'set':
+                        key, (url, created, body) = operation[1:]
+                        connection.execute(
+                            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                            (key, url, created, created, len(body), body))
+                        written.add(key)
+                    elif operation[0] == 'access':
+                        connection.execute("UPDATE responses SET accessed = ? WHERE key = ?",
+                                           (operation[2], operation[1]))
+                    else:
+                        self._evict(connection, written)
+                connection.commit()
+            except Exception as e: # pylint: disable=broad-except
+                self._error = e
+            with self._lock:
+                for operation in operations:
+                    if (operation is not _CLOSE and operation[0] == 'set'
+                            and self._pending.get(operation[1]) is operation[2]):
+                        del self._pending[operation[1]]
+            for _ in operations:
+                self._queue.task_done()
+        connection.close()
+
+    def _evict(self, connection: sqlite3.Connection, written: set):
+        now = time.time()
+        if not self.offline:
+            expired = [(key,) for key, url, created
+                       in connection.execute("SELECT key, url, created FROM responses")
+                       if self.entry_ttl(url) is not None and now - created > self.entry_ttl(url)]
+            connection.executemany("DELETE FROM responses WHERE key = ?", expired)
+        size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        removed = 0
+        if size > 0.9 * self.max_size:
+            rows = connection.execute("SELECT key, size FROM responses ORDER BY accessed")
+            evicted = []
+            for key, entry_size in rows:
+                if size - removed <= 0.9 * self.max_size:
+                    break
+                evicted.append((key,))
+                removed += entry_size
+            connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        with self._lock: # the entries not written yet are counted as well
+            self.size = size - removed + sum(len(body) for key, (_, _, body) in self._pending.items()
+                                             if key not in written)
+
+    def evict(self):
+        """
+        Removes expired entries and then the least recently used entries until the cache
+        is below 90% of its maximum size, and waits for it.
+        """
+        self._queue.put(('evict',))
+        self.flush()
+
+    def flush(self):
+        """
+        Waits until the background thread has written all stored responses.
+
+        :raises Exception: The error of the background writer, if it failed.
+        """
+        self._queue.join()
+        if self._error:
+            raise self._error
+
+    def __len__(self) -> int:
+        self.flush()
+        return self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        """
+        Writes pending changes and closes the database.
+
+        :raises Exception: The error of the background writer, if it failed.
+        """
+        if self._writer.is_alive():
+            self._queue.put(_CLOSE)
+            self._writer.join()
+        self.connection.close()
+        if self._error:
+            raise self._error
@@ -0,0 +1,146 @@
+"""
+Append-only checkpoint log of the results of long downloads, so that an interrupted run can
+be resumed
+"""
+import os
+import json
+import queue
+import threading
+from typing import Optional
+
+DEFAULT_COMPACTION_RATIO = 2.0 # compact once the log holds twice as many lines as keys
+
+_CLOSE = object()
+
+
+class CheckpointLog:
+    """
+    Log of key-value records in a JSON lines file, one [key, value] array per line. Records
+    are only ever appended, by a background thread, so that the caller never waits for the
+    disk. Opening the log replays it, the last record of a key wins, and a line cut off by a
+    crash is dropped. Logs in which most lines are overwritten records are compacted when
+    they are opened.
+    """
+    def __init__(self, path: str, compaction_ratio: Optional[float] = DEFAULT_COMPACTION_RATIO):
+        """
+        :param path: Path to the log file. It is created if it does not exist.
+        :param compaction_ratio: The log is rewritten with one line per key when opened if it
+            has more than this many lines per key. None never compacts. Default is 2.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.records, nr_lines = self.replay(path)
+        if compaction_ratio is not None and nr_lines > compaction_ratio * max(len(self.records), 1):
+            self.compact()
+
+        self._file = open(path, 'a', encoding='utf-8')
+        self._queue = queue.Queue()
+        self._error = None
+        self._writer = threading.Thread(target=self._write, name=f"checkpoint {path}", daemon=True)
+        self._writer.start()
+
+    @staticmethod
+    def replay(path: str) -> tuple:
+        """
+        Reads the records of a log. A last line without a newline, as left by a crash during
+        a write, is ignored and cut off from the file.
+
+        :param path: Path to the log file.
+
+        :return: Tuple of the dictionary of the last value of every key, and the number of
+            lines read.
+        """
+        records = {}
+        nr_lines = 0
+        if not os.path.exists(path):
+            return records, nr_lines
+        with open(path, 'rb+') as f:
+            valid_size = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                key, value = json.loads(line)
+                records[key] = value
+                valid_size += len(line)
+                nr_lines += 1
+            f.truncate(valid_size)
+        return records, nr_lines
+
+    def compact(self):
+        """Rewrites the log with one line per key, replacing the file at once."""
+        temporary_path = self.path + '.compact'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            for key, value in self.records.items():
+                f.write(json.dumps([key, value]) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.path)
+
+    def _write(self):
+        closing = False
+        while not closing:
+            records = [self._queue.get()]
+            while True: # everything queued in the meantime is written at once
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if records[-1] is _CLOSE:
+                records.pop()
+                closing = True
+            try:
+                self._file.write(''.join(json.dumps(record) + '\n' for record in records))
+                self._file.flush()
+            except Exception as e: # pylint: disable=broad-except
+                self._error = e
+                return
+
+    def append(self, key: str, value):
+        """
+        Records the value of a key. The record is written in the background.
+
+        :param key: The key, e.g. the PMID of an article.
+        :param value: JSON serialisable value.
+
+        :raises Exception: The error of the background writer, if it failed.
+        """
+        if self._error:
+            raise self._error
+        self.records[key] = value
+        self._queue.put([key, value])
+
+    def update(self, records: dict):
+        """Records the values of all keys in a dictionary, see append."""
+        for key, value in records.items():
+            self.append(key, value)
+
+    def close(self, remove: bool = False):
+        """
+        Waits for the pending records to be written and closes the log.
+
+        :param remove: Whether to delete the log file afterwards, once its records are
+            no longer needed. Default is False.
+
+        :raises Exception: The error of the background writer, if it failed.
+        """
+        if self._writer.is_alive():
+            self._queue.put(_CLOSE)
+            self._writer.join()
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+        if self._error:
+            raise self._error
+
+    def __enter__(self) -> "CheckpointLog":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.records)
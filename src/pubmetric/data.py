@@ -3,9 +3,11 @@ Module to download meta data about software in bio.tools
 """
 import os
 import json
+import math
+import warnings
 from datetime import datetime
-from collections import defaultdict, Counter
-from typing import Optional
+from collections import defaultdict, deque, Counter
+from typing import AsyncIterator, Callable, Optional, Tuple
 
 import numpy as np
 import asyncio
@@ -14,9 +16,17 @@ import requests
 from tqdm import tqdm
 from tqdm.asyncio import tqdm_asyncio
 
-from .exceptions import SchemaValidationError
+from .exceptions import SchemaValidationError, DownloadError
+from .ratelimit import HostRateLimiter, RequestStats, request_json
+from .cache import ResponseCache
+from .checkpoint import CheckpointLog
+from .eutils import EutilsClient
 import pubmetric.log
 
+EUROPEPMC_REQUESTS_PER_SECOND = 10
+BIOTOOLS_MAX_CONCURRENCY = 8
+CITATIONS_CHECKPOINT_FILENAME = 'paper_citations.jsonl'
+
 
 def download_domain_annotations(tools: list, annotations: str = "full") -> list:
     """
@@ -48,7 +58,8 @@ def download_domain_annotations(tools: list, annotations: str = "full") -> list:
 async def aggregate_requests(session: aiohttp.ClientSession,
                              url: str,
                              retries: int = 3,
-                             backoff: float = 2.0) -> dict:
+                             backoff: float = 2.0,
+                             cache: Optional[ResponseCache] = None) -> dict:
     """
     Sync requests so they are all made in a single session
 
@@ -56,208 +67,347 @@ async def aggregate_requests(session: aiohttp.ClientSession,
         Session object for package aiohttp
     :param url: str
         URL for request
+    :param cache: ResponseCache, default None
+        Cache the response is served from or stored in
 
     :return: dict
         JSON response from the request
     """
-    attempt = 0
-    while attempt < retries:
-        try:
-            async with session.get(url) as response:
-                response.raise_for_status()
-                return await response.json()
-        except aiohttp.ClientError: # as e:
-            attempt += 1
-            wait_time = backoff ** attempt
-            #might be good to print, but it does so so many times 
-            #pubmetric.log.log_with_timestamp(
-                #f"Request failed: {e}. Retrying in {wait_time:.1f} seconds...")
-            await asyncio.sleep(wait_time)
-    raise Exception(f"Failed to fetch data from {url} after {retries} attempts.")
+    return await request_json(session, url, retries=retries, backoff=backoff, cache=cache)
+
+class DoiLibrary:
+    """
+    The doi-pmid library of the DOIs resolved by earlier runs. DOIs resolved by the
+    EutilsClient are added to it and appended to a checkpoint log next to the library file,
+    from which an interrupted run resumes. The library file is written once, by save.
+    """
+    def __init__(self,
+                 outpath: str,
+                 inpath: Optional[str] = None,
+                 doi_library_filename: str = 'doi_pmid_library.json'):
+        """
+        :param outpath: Path to the directory where the library is saved.
+        :param inpath: Optional path to the directory of an existing library.
+        :param doi_library_filename: Name of the library file. Default is 'doi_pmid_library.json'.
+        """
+        if inpath and os.path.isfile(os.path.join(inpath, doi_library_filename)):
+            pubmetric.log.log_with_timestamp("Loading doi-pmid library")
+            with open(os.path.join(inpath, doi_library_filename), 'r', encoding='utf-8') as f:
+                self.pmids = json.load(f)
+        else:
+            pubmetric.log.log_with_timestamp('Creating a new doi-pmid library')
+            self.pmids = {}
+
+        self.path = os.path.join(outpath, doi_library_filename)
+        # dois resolved by an interrupted run
+        self.checkpoint = CheckpointLog(os.path.splitext(self.path)[0] + '.jsonl')
+        self.pmids.update(self.checkpoint.records)
+
+    def missing(self, dois: list) -> list:
+        """Returns the DOIs which are not in the library, without duplicates or empty DOIs."""
+        return list({doi for doi in dois if doi and doi not in self.pmids})
+
+    def _save_batch(self, doi_pmids: dict):
+        self.pmids.update(doi_pmids)
+        self.checkpoint.update(doi_pmids)
+
+    async def resolve(self, session: aiohttp.ClientSession, dois: list, client: EutilsClient):
+        """
+        Resolves the DOIs which are not in the library yet, and adds them to it.
+
+        :param session: aiohttp.ClientSession used for the requests.
+        :param dois: List of DOIs.
+        :param client: The EutilsClient the DOIs are resolved with.
+        """
+        missing_dois = self.missing(dois)
+        if missing_dois:
+            await client.dois_to_pmids(session, missing_dois, on_batch=self._save_batch)
+
+    def close(self):
+        """Waits for the checkpoint log to be written and closes it."""
+        self.checkpoint.close()
+
+    def save(self):
+        """
+        Closes the checkpoint log, writes the library file if DOIs were resolved, and
+        removes the checkpoint log.
+        """
+        self.close()
+        if self.checkpoint.records:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.pmids, f)
+        os.remove(self.checkpoint.path)
 
 async def get_pmid_from_doi(doi_tools: dict,
                             outpath: str,
                             inpath: str = None,
                             doi_library_filename: str = 'doi_pmid_library.json',
-                            save_interval: int = 10) -> dict:
+                            save_interval: Optional[int] = None,
+                            client: Optional[EutilsClient] = None) -> dict:
     """
     Given a list of dictionaries with data about (tool) publications, 
     this function uses their DOIs to retrieve their PMIDs from NCBI eutils API.
+    DOIs which are not in the library are resolved in batches by the EutilsClient, and
+    appended to a checkpoint log next to the library as they arrive, from which an
+    interrupted run resumes. The library is written once all DOIs are resolved, see DoiLibrary.
 
     :param doi_tools: list of dicts
     :param outpath: str path to the directory where you want the file to be 
     :param inpath: str path to the directory where an old file is
     :param doi_library_filename: str, default 'doi_pmid_library.json'.
         To load this is assumed to be in main directory. 
-    :param save_interval: int, default 10, Save progress after this many updates
+    :param save_interval: Deprecated and ignored, the progress is saved per batch.
+    :param client: Optional EutilsClient, to share the NCBI request quota with other downloads.
 
     :return: Updated list of dicts with PMIDs included.
 
     """
+    if save_interval is not None:
+        warnings.warn("save_interval is ignored, the resolved DOIs are saved per batch.",
+                      DeprecationWarning, stacklevel=2)
 
     # Download pmids from dois
+    doi_library = DoiLibrary(outpath=outpath, inpath=inpath,
+                             doi_library_filename=doi_library_filename)
+    missing_dois = doi_library.missing([tool.get('doi') for tool in doi_tools])
+
+    try:
+        if missing_dois:
+            pubmetric.log.log_with_timestamp(f"Downloading pmids for {len(missing_dois)} dois.")
+            client = client or EutilsClient()
+            async with aiohttp.ClientSession() as session:
+                await doi_library.resolve(session, missing_dois, client)
+    finally:
+        doi_library.close()
+    doi_library.save()
+
+    for tool in doi_tools:
+        if tool.get('doi') in doi_library.pmids:
+            tool["pmid"] = doi_library.pmids[tool['doi']]
 
-    if inpath and os.path.isfile(os.path.join(inpath, doi_library_filename)):
-        pubmetric.log.log_with_timestamp("Loading doi-pmid library")
-        with open(os.path.join(inpath, doi_library_filename), 'r', encoding='utf-8') as f:
-            doi_library = json.load(f)
-    else: 
-        pubmetric.log.log_with_timestamp('Creating a new doi-pmid library')
-        doi_library = {}
-
-
-    library_updates = 0
-    async with aiohttp.ClientSession() as session:
-        for tool in tqdm(doi_tools, desc="Downloading pmids from dois."):
-            doi = tool.get("doi")
-
-            if doi in doi_library:
-                tool["pmid"] = doi_library[doi]
-                continue
+    updated_doi_tools = [tool for tool in doi_tools if tool.get('pmid')]
+    pubmetric.log.log_with_timestamp(
+        f"Found {len(updated_doi_tools)} tools with PMIDs using their DOIs")
 
-            url = f"http://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=PubMed&retmode=json&term={doi}"
-            result = await aggregate_requests(session, url)
-            id_list = result.get('esearchresult', {}).get('idlist', [])
-            doi_pmid = next(iter(id_list), None)
+    return updated_doi_tools
 
-            if doi_pmid and doi_pmid != '39073865': # what is this cursed paper?
-                tool["pmid"] = doi_pmid
-                doi_library[doi] = doi_pmid
-                library_updates += 1
-            else:
-                continue
+class BiotoolsCrawler:
+    """
+    Crawler of the bio.tools pages of a topic. The number of tools is read from the first
+    page, after which the other pages are downloaded concurrently, at most max_concurrency
+    at a time, and handed on in page order. The tools are parsed as their pages arrive.
+    """
+    def __init__(self,
+                 topic_id: Optional[str],
+                 test_size: Optional[int] = None,
+                 max_concurrency: int = BIOTOOLS_MAX_CONCURRENCY,
+                 cache: Optional[ResponseCache] = None):
+        """
+        :param topic_id: The EDAM topic ID of the tools, e.g. "topic_0121". None crawls all
+            of bio.tools.
+        :param test_size: Optional number of tools after which the crawl stops. Tools are
+            counted per page, so a few more may be returned.
+        :param max_concurrency: Maximum number of pages downloaded at the same time.
+            Default is 8.
+        :param cache: Optional ResponseCache the pages are served from or stored in.
+        """
+        if topic_id:
+            self.base_url = f'https://bio.tools/api/t?topicID=%22{topic_id}%22&format=json&page='
+        else:
+            self.base_url = 'https://bio.tools/api/t?%22&format=json&page=' # Full bio.tools
+        self.test_size = test_size
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        # graph stats:
+        self.total_nr_tools = 0
+        self.primary_stat = 0 # tools without a primary publication
+        self.no_publication_stat = 0
+
+    async def _fetch_page(self, session: aiohttp.ClientSession, page: int) -> dict:
+        biotool_data = await aggregate_requests(session, self.base_url + str(page), cache=self.cache)
+        if 'list' not in biotool_data:
+            raise DownloadError(f'Error while fetching tool names from page {page}')
+        return biotool_data
+
+    async def pages(self, session: aiohttp.ClientSession) -> AsyncIterator[Tuple[int, dict]]:
+        """
+        Downloads the pages of the topic.
+
+        :param session: aiohttp.ClientSession used for the requests.
+
+        :raises DownloadError: If a page has no tool list.
+        :raises Exception: If a page could not be downloaded after all retries, see request_json.
+
+        :return: Asynchronous iterator of the page numbers and JSON responses, in page order.
+            Pending downloads are cancelled when the iteration is stopped early.
+        """
+        first_page = await self._fetch_page(session, 1)
+        self.total_nr_tools = int(first_page.get('count', 0))
+        yield 1, first_page
+        if not first_page.get('list') or not first_page.get('next'):
+            return
+
+        last_page = math.ceil(self.total_nr_tools / len(first_page['list']))
+        downloads = deque()
+        next_page = 2
+        try:
+            while downloads or next_page <= last_page:
+                while next_page <= last_page and len(downloads) < self.max_concurrency:
+                    downloads.append((next_page,
+                                      asyncio.ensure_future(self._fetch_page(session, next_page))))
+                    next_page += 1
+                page, download = downloads.popleft()
+                yield page, await download
+        finally:
+            for _, download in downloads:
+                if download.done() and not download.cancelled():
+                    download.exception() # retrieved, it is not raised once the crawl has stopped
+                download.cancel()
+
+    def parse_tool(self, tool: dict) -> Optional[dict]:
+        """
+        Extracts the metadata of a bio.tools tool from its primary publication, or its first
+        publication if none is marked as primary.
+
+        :param tool: The tool as listed on a bio.tools page.
+
+        :return: Dictionary of the tool metadata, with a 'pmid' key if the publication has a
+            PMID. None if the tool has no publications.
+        """
+        publications = tool.get('publication')
+        if not publications: # Graph needs tools with pmids
+            self.no_publication_stat += 1
+            return None
+        name = tool.get('name')
+        topic = tool.get('topic')
+        nr_publications = len(publications)
+        primary_publication = next((pub
+                                    for pub in publications
+                                    if 'Primary' in pub.get('type')),
+                                    None)
+        if primary_publication is None:
+            primary_publication = publications[0]
+            self.primary_stat += 1
+
+        all_publications = [pub.get('pmid') for pub in publications]
+
+        if primary_publication.get('metadata'):
+            pub_date = primary_publication['metadata'].get('date')
+            if pub_date:
+                pub_date = int(pub_date.split('-')[0])
+        else:
+            pub_date = None
+        tool_metadata = {
+            'name': name,
+            'doi': primary_publication.get('doi'), # adding doi here too
+            'topics': [t.get('term') for t in topic] if topic else None,
+            'nr_publications':  nr_publications,
+            'all_publications': all_publications,
+            'publication_date': pub_date
+        }
+        if primary_publication.get('pmid'):
+            tool_metadata['pmid'] = str(primary_publication['pmid'])
+        return tool_metadata
 
-            if library_updates >= save_interval:
-                with open(os.path.join(outpath, doi_library_filename), 'w', encoding='utf-8') as f:
-                    json.dump(doi_library, f)
-                library_updates = 0  # Reset update counter
+    async def tools(self, session: aiohttp.ClientSession) -> AsyncIterator[dict]:
+        """
+        Downloads and parses the tools of the topic, see parse_tool. The crawl stops after
+        the page on which the test_size is reached. A page that can not be downloaded ends
+        the crawl with an error, so that an incomplete tool list is never taken for the
+        complete one.
 
-    if library_updates > 0:
-        with open(os.path.join(outpath, doi_library_filename), 'w', encoding='utf-8') as f:
-            json.dump(doi_library, f)
+        :param session: aiohttp.ClientSession used for the requests.
 
-    updated_doi_tools = [tool for tool in doi_tools if tool.get('pmid')]
-    pubmetric.log.log_with_timestamp(
-        f"Found {len(updated_doi_tools)} tools with PMIDs using their DOIs")
+        :raises DownloadError: If a page has no tool list.
+        :raises Exception: If a page could not be downloaded after all retries, see request_json.
 
-    return updated_doi_tools
+        :return: Asynchronous iterator of the metadata of the tools with publications, as
+            their pages arrive.
+        """
+        nr_tools = 0
+        pages = self.pages(session)
+        try:
+            async for _, biotool_data in pages:
+                for tool in biotool_data['list']:
+                    tool_metadata = self.parse_tool(tool)
+                    if tool_metadata:
+                        nr_tools += 1
+                        yield tool_metadata
+                if self.test_size and nr_tools >= self.test_size: # this is not exaxt
+                                                                   #since dois might not give pmid
+                    break
+        finally:
+            await pages.aclose()
 
-async def get_pmids(topic_id: Optional[str], test_size: Optional[int]) -> tuple:
+async def get_pmids(topic_id: Optional[str],
+                    test_size: Optional[int],
+                    cache: Optional[ResponseCache] = None,
+                    max_concurrency: int = BIOTOOLS_MAX_CONCURRENCY) -> tuple:
     """ 
     Downloads all (or a specified amount) of the bio.tools tools for a specific
-    topic and returns metadata about the tools.
+    topic and returns metadata about the tools. The pages are downloaded concurrently,
+    see BiotoolsCrawler.
 
     :param topic_id: str
         The ID to which the tools downloaded belong,
         e.g., "Proteomics" or "DNA" as defined by EDAM ontology. 
     :param test_size: int, default None
         Determines the number of tools downloaded
+    :param cache: ResponseCache, default None
+        Cache the bio.tools pages are served from or stored in
+    :param max_concurrency: int, default 8
+        Maximum number of pages downloaded at the same time
 
     :return: tuple
         Tuple containing a list of tools (dictionaries) with PMIDs,
         a list of tools without PMIDs, and the total number of tools.
+
+    :raises DownloadError: If a page has no tool list.
+    :raises Exception: If a page could not be downloaded after all retries.
     """
     pmid_tools = []
     doi_tools = [] # collect tools without pmid
 
-    if topic_id:
-        base_url = f'https://bio.tools/api/t?topicID=%22{topic_id}%22&format=json&page='
-    else:
-        base_url = 'https://bio.tools/api/t?%22&format=json&page=' # Full bio.tools
-
-    page = 1
-    # graph stats:
-    primary_stat = 0
-    no_publication_stat = 0
-
+    crawler = BiotoolsCrawler(topic_id, test_size=test_size, max_concurrency=max_concurrency,
+                              cache=cache)
     async with aiohttp.ClientSession() as session:
-        while page:
-            # Sends request for tools on the page, 
-            # await further requests and return resonse in json format
-            biotools_url = base_url + str(page)
-            biotool_data = await aggregate_requests(session, biotools_url)
-
-            if 'list' in biotool_data: 
-                biotools_list = biotool_data['list']
-                
-                for tool in biotools_list:
-                    publications = tool.get('publication')
-                    if not publications: # Graph needs tools with pmids
-                        no_publication_stat += 1
-                        continue
-                    name = tool.get('name')
-                    topic = tool.get('topic')
-                    nr_publications = len(publications)
-                    primary_publication = next((pub 
-                                                for pub in publications 
-                                                if 'Primary' in pub.get('type')), 
-                                                None)
-                    if primary_publication is None:
-                        primary_publication = publications[0]
-                        primary_stat +=1
-
-                    all_publications = [pub.get('pmid') for pub in publications]
-
-                    if primary_publication.get('metadata'):
-                        pub_date = primary_publication['metadata'].get('date')
-                        if pub_date:
-                            pub_date = int(pub_date.split('-')[0])
-                    else: 
-                        pub_date = None
-                    if primary_publication.get('pmid'):
-                        pmid_tools.append({
-                            'name': name,
-                            'doi': primary_publication.get('doi'), # adding doi here too 
-                            'topics': [t.get('term') for t in topic] if topic else None,
-                            'nr_publications':  nr_publications,
-                            'all_publications': all_publications,
-                            'publication_date': pub_date,
-                            'pmid': str(primary_publication['pmid'])
-
-                        })
-                    else:
-                        
-                        doi_tools.append({
-                            'name': name,
-                            'doi': primary_publication.get('doi'),
-                            'topics': [t.get('term') for t in topic] if topic else None,
-                            'nr_publications':  nr_publications,
-                            'all_publications': all_publications,
-                            'publication_date': pub_date
-                        })
-
-                if test_size and len(pmid_tools) + len(doi_tools) >= test_size: # this is not exaxt 
-                                                                    #since dois might not give pmid
-                    break
-
-                page = biotool_data.get('next')
-                if page: # else page will be None and loop will stop
-                    page = page.split('=')[-1] # only want the page number
+        async for tool in crawler.tools(session):
+            if 'pmid' in tool:
+                pmid_tools.append(tool)
             else:
-                pubmetric.log.log_with_timestamp(
-                    f'Error while fetching tool names from page {page}')
-                break
+                doi_tools.append(tool)
+
     pubmetric.log.log_with_timestamp(
-        f"Primary publications count: {primary_stat}," 
-        f"missing publication count: {no_publication_stat}")
-    total_nr_tools = int(biotool_data['count']) if biotool_data and 'count' in biotool_data else 0
+        f"Primary publications count: {crawler.primary_stat}," 
+        f"missing publication count: {crawler.no_publication_stat}")
+
+    return (pmid_tools, doi_tools, crawler.total_nr_tools)
+
+async def fetch_publication_dates(session: aiohttp.ClientSession,
+                                  pmids: list,
+                                  client: Optional[EutilsClient] = None) -> dict:
+    """
+    Fetches the document summaries, including publication dates, for a list of PMIDs
+    from NCBI, in batches.
 
-    return (pmid_tools, doi_tools, total_nr_tools)
+    :param session: aiohttp.ClientSession used for the requests.
+    :param pmids: List of PMIDs.
+    :param client: Optional EutilsClient, to share the NCBI request quota with other downloads.
 
-async def fetch_publication_dates(session: aiohttp.ClientSession, pmids: list):
-    """Fetches publication dates for a list of PMIDs from NCBI."""
-    pmid_str = ','.join(pmids)
-    url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?db=pubmed&id={pmid_str}&retmode=json"
-    async with session.get(url) as response:
-        return await response.json()
+    :return: Dictionary in the esummary response format, with the summaries under 'result'.
+    """
+    client = client or EutilsClient()
+    return {'result': await client.esummary(session, pmids)}
 
-async def process_publication_dates(tool_metadata: list) -> list:
+async def process_publication_dates(tool_metadata: list,
+                                    client: Optional[EutilsClient] = None) -> list:
     """
     Downloads the publication date from NCBI using the PMID of the file
     and updates the metadat file.
 
     :param tool_metadata: list
         List of dictionaries containing tool metadata.
+    :param client: Optional EutilsClient, to share the NCBI request quota with other downloads.
 
     :return: list
         Updated list of tool metadata with publication dates included.
@@ -277,7 +427,7 @@ async def process_publication_dates(tool_metadata: list) -> list:
         return tool_metadata
 
     async with aiohttp.ClientSession() as session:
-        data = await fetch_publication_dates(session, pmids)
+        data = await fetch_publication_dates(session, pmids, client=client)
 
     results = data.get('result', {})
     tools_without_pubdate = 0
@@ -299,7 +449,8 @@ async def get_tool_metadata(outpath: str,
                             topic_id: str ,
                             inpath: Optional[str] = None,
                             test_size: Optional[int] = None,
-                            random_seed: int = 42) -> dict:
+                            random_seed: int = 42,
+                            cache: Optional[ResponseCache] = None) -> dict:
     """
     Fetches metadata about tools from bio.tools, belonging to a given topic_id
     and returns as a dictionary.
@@ -314,6 +465,8 @@ async def get_tool_metadata(outpath: str,
     :param test_size: int, default None
         Determines the size of the test sample - the number of tools included
         in the final dictionary.
+    :param cache: ResponseCache, default None
+        Cache the downloads are served from or stored in.
 
     :return: dict
         Dictionary containing metadata about the tools.
@@ -354,7 +507,8 @@ async def get_tool_metadata(outpath: str,
     get_pmids_time = datetime.now()
 
     pmid_tools, doi_tools, tot_nr_tools = await get_pmids(topic_id=topic_id,
-                                                          test_size=test_size)
+                                                          test_size=test_size,
+                                                          cache=cache)
 
     pubmetric.log.step_timer(get_pmids_time, "Downloading pmids")
 
@@ -363,7 +517,9 @@ async def get_tool_metadata(outpath: str,
 
     # Update list of doi_tools to include pmid
     get_pmid_from_doi_time = datetime.now()
-    doi_tools = await get_pmid_from_doi(outpath=outpath, inpath=inpath, doi_tools=doi_tools)
+    eutils_client = EutilsClient(cache=cache)
+    doi_tools = await get_pmid_from_doi(outpath=outpath, inpath=inpath, doi_tools=doi_tools,
+                                        client=eutils_client)
 
     pubmetric.log.step_timer(get_pmid_from_doi_time, "Downloading pmids from doi's")
     metadata_file["pmid_from_doi"] = len(doi_tools)
@@ -371,7 +527,7 @@ async def get_tool_metadata(outpath: str,
     all_tools = pmid_tools + doi_tools
 
     publication_dates_time = datetime.now()
-    all_tools_with_age = await process_publication_dates(all_tools)
+    all_tools_with_age = await process_publication_dates(all_tools, client=eutils_client)
     pubmetric.log.step_timer(publication_dates_time, "Downloading publication dates")
 
     metadata_file["tools"] = all_tools_with_age
@@ -381,120 +537,347 @@ async def get_tool_metadata(outpath: str,
 
     return metadata_file
 
+async def update_tool_metadata(old_metadata_file: dict,
+                               outpath: str,
+                               topic_id: Optional[str],
+                               inpath: Optional[str] = None,
+                               test_size: Optional[int] = None,
+                               cache: Optional[ResponseCache] = None) -> dict:
+    """
+    Downloads the current list of tools in bio.tools belonging to a given topic_id, reusing
+    the PMIDs resolved from DOIs and the publication dates of the tools that are already in
+    an older metadata file, so that these are only downloaded for new tools.
+
+    :param old_metadata_file: Previously created metadata dictionary with a 'tools' key.
+    :param outpath: Path to directory where the updated doi-pmid library is placed.
+    :param topic_id: The ID to which the tools downloaded belong.
+    :param inpath: Optional path to the directory of an existing doi-pmid library.
+    :param test_size: Optional number of tools after which the bio.tools crawl stops, as in
+        get_pmids. Should be the test size the old metadata file was created with.
+    :param cache: Optional ResponseCache the downloads are served from or stored in.
+
+    :return: Dictionary containing metadata about the tools, in the format of get_tool_metadata.
+    """
+    metadata_file = {
+        "creation_date": str(datetime.now()),
+        "topic": topic_id
+    }
+
+    pmid_tools, doi_tools, tot_nr_tools = await get_pmids(topic_id=topic_id,
+                                                          test_size=test_size,
+                                                          cache=cache)
+    metadata_file['total_nr_tools'] = tot_nr_tools
+    metadata_file['biotools_wo_pmid'] = len(doi_tools)
+
+    known_doi_pmids = {tool['doi']: tool['pmid']
+                       for tool in old_metadata_file['tools']
+                       if tool.get('doi') and tool.get('pmid')}
+    known_dates = {tool['pmid']: tool.get('publication_date')
+                   for tool in old_metadata_file['tools']}
+
+    unresolved_tools = []
+    for tool in doi_tools:
+        if tool.get('doi') in known_doi_pmids:
+            tool['pmid'] = known_doi_pmids[tool['doi']]
+        else:
+            unresolved_tools.append(tool)
+
+    eutils_client = EutilsClient(cache=cache)
+    if unresolved_tools:
+        await get_pmid_from_doi(outpath=outpath, inpath=inpath, doi_tools=unresolved_tools,
+                                client=eutils_client)
+    doi_tools = [tool for tool in doi_tools if tool.get('pmid')]
+    metadata_file["pmid_from_doi"] = len(doi_tools)
+
+    all_tools = pmid_tools + doi_tools
+    for tool in all_tools:
+        if not tool.get('publication_date') and known_dates.get(tool['pmid']):
+            tool['publication_date'] = known_dates[tool['pmid']]
+    metadata_file["tools"] = await process_publication_dates(all_tools, client=eutils_client)
+
+    pubmetric.log.log_with_timestamp(
+        f'Found {len(all_tools)} out of a total of {tot_nr_tools} tools with PMIDS, '
+        f'{len(unresolved_tools)} DOIs needed to be resolved.')
+
+    return metadata_file
+
 async def fetch_citations(article_id: str,
                           session: aiohttp.ClientSession,
                           source: str = 'MED',
                           batch_size: int = 1000,
-                          page: int = 1) -> list:
+                          page: int = 1,
+                          limiter: Optional[HostRateLimiter] = None,
+                          stats: Optional[RequestStats] = None,
+                          cache: Optional[ResponseCache] = None) -> list:
     """
-    Recursively fetches all citation PMIDs for a given article ID, handling pagination.
+    Fetches all citation PMIDs for a given article ID, handling pagination. Once the first
+    page is downloaded the number of pages is known from its hitCount, and the remaining
+    pages are fetched concurrently.
     
     :param article_id: PubMed ID for the article.
     :param session: An aiohttp.ClientSession object used for making HTTP requests.
     :param source: The source from which citations are fetched. Default is 'MED'.
     :param batch_size: Number of citations to fetch per request. Default is 1000.
-    :param page: The page number for pagination. Defaults to 1.
+    :param page: The first page to fetch. Defaults to 1.
+    :param limiter: Optional HostRateLimiter shared by all requests.
+    :param stats: Optional RequestStats object in which the requests are recorded.
+    :param cache: Optional ResponseCache the pages are served from or stored in.
+
+    :raises CacheMissError: If the cache is offline and a page is not cached.
+    :raises Exception: If a page still cannot be downloaded after all attempts, so that an
+        incomplete list is never returned.
     
-    :return: A list of citation PMIDs.
-    """
-    url = f'https://www.ebi.ac.uk/europepmc/webservices/rest/{source}/{article_id}/citations?page={page}&pageSize={batch_size}&format=json'
-    async with session.get(url) as response:
-        if response.ok:
-            result = await response.json()
-            citations = result.get('citationList', {}).get('citation', [])
-            citation_ids = [citation['id'] for citation in citations]
-            total_hits = result.get('hitCount')
-
-            if len(citation_ids) < (total_hits - batch_size*( page-1 )):
-                next_page_citations = await fetch_citations(article_id=article_id,
-                                                            session=session,
-                                                            source=source,
-                                                            batch_size=batch_size,
-                                                            page=page + 1)
-                return citation_ids + next_page_citations
-            return citation_ids
-        else:
-            pubmetric.log.log_with_timestamp(f'Something went wrong with request {url}')
-            return []
-
-async def fetch_citations_batch(article_ids:list, session: aiohttp.ClientSession, source: str = 'MED', batch_size: int = 1000) -> dict:
+    :return: A list of citation PMIDs. Empty if EuropePMC rejects the article with a client
+        error (e.g. 404 for an unknown PMID), which is logged.
+    """
+    async def fetch_page(page_nr: int) -> dict:
+        url = (f'https://www.ebi.ac.uk/europepmc/webservices/rest/{source}/{article_id}'
+               f'/citations?page={page_nr}&pageSize={batch_size}&format=json')
+        return await request_json(session, url, limiter=limiter, stats=stats, cache=cache)
+
+    try:
+        result = await fetch_page(page)
+    except aiohttp.ClientResponseError as e: # client errors are not retried, see request_json
+        # a malformed or withdrawn PMID is rejected every time, it has no citations to count
+        pubmetric.log.log_with_timestamp(
+            f'No citations for {article_id}, EuropePMC answered with status {e.status}.')
+        return []
+    citation_ids = [citation['id']
+                    for citation in result.get('citationList', {}).get('citation', [])]
+
+    total_hits = result.get('hitCount') or 0
+    last_page = math.ceil(total_hits / batch_size)
+    other_pages = await asyncio.gather(*(fetch_page(page_nr)
+                                         for page_nr in range(page + 1, last_page + 1)))
+    for other_page in other_pages:
+        citation_ids += [citation['id']
+                         for citation in other_page.get('citationList', {}).get('citation', [])]
+    return citation_ids
+
+async def fetch_citations_batch(article_ids: list,
+                                session: aiohttp.ClientSession,
+                                source: str = 'MED',
+                                batch_size: int = 1000,
+                                max_concurrency: int = 20,
+                                limiter: Optional[HostRateLimiter] = None,
+                                stats: Optional[RequestStats] = None,
+                                cache: Optional[ResponseCache] = None,
+                                on_result: Optional[Callable[[str, list], None]] = None) -> dict:
     """
-    Asynchronously fetches all citation PMIDs for a batch of article PMIDs from EuropePMC,
-    handling pagination recursively.
+    Asynchronously fetches all citation PMIDs for a batch of article PMIDs from EuropePMC.
+    A fixed number of workers take the articles from a shared queue, so that at most
+    max_concurrency articles are downloaded at the same time.
 
     :param article_ids: List of article PMIDs for which citations are to be fetched.
     :param session: An aiohttp.ClientSession object used for making HTTP requests.
     :param source: The source from which citations are fetched. Default is 'MED'.
     :param batch_size: Number of citations to fetch per request. Default is 1000.
+    :param max_concurrency: Maximum number of articles downloaded concurrently. Default is 20.
+    :param limiter: Optional HostRateLimiter shared by all requests.
+    :param stats: Optional RequestStats object in which the requests are recorded.
+    :param cache: Optional ResponseCache the pages are served from or stored in.
+    :param on_result: Optional function called with the PMID and the citations of every
+        article as soon as they are downloaded, e.g. CheckpointLog.append. It is not called
+        for articles whose citations could not be downloaded.
     
     :return: A dictionary where each key is an article PMID and the value is a list of citation
-             PMIDs for that article. If an error occurs while fetching citations for an article,
-             the value for that article is an empty list.
+             PMIDs for that article. Articles whose citations could not be downloaded
+             completely are logged and left out, so that they can be downloaded again.
     """
+    queue = asyncio.Queue()
+    for article_id in article_ids:
+        queue.put_nowait(article_id)
+
     results = {}
-    for article_id in tqdm_asyncio(article_ids, desc="Fetching Citations", unit="article"):
-        try:
-            citations = await fetch_citations(article_id, session, source, batch_size)
-            results[article_id] = citations
-        except Exception as e:
-            pubmetric.log.log_with_timestamp(
-                f"Failed to fetch citations for {article_id}: {str(e)}")
-            results[article_id] = []  # TODO do I want to continue processing other articles even if one fails?
+    progress = tqdm(total=len(article_ids), desc="Fetching Citations", unit="article")
+
+    async def worker():
+        while not queue.empty():
+            article_id = queue.get_nowait()
+            try:
+                results[article_id] = await fetch_citations(article_id, session, source,
+                                                            batch_size, limiter=limiter,
+                                                            stats=stats, cache=cache)
+            except Exception as e: # pylint: disable=broad-except
+                pubmetric.log.log_with_timestamp(
+                    f"Failed to fetch citations for {article_id}: {str(e)}")
+            else:
+                if on_result:
+                    on_result(article_id, results[article_id])
+            progress.update(1)
+
+    await asyncio.gather(*(worker() for _ in range(min(max_concurrency, len(article_ids)))))
+    progress.close()
 
     return results
 
+async def fetch_citation_counts(article_ids: list,
+                                session: aiohttp.ClientSession,
+                                source: str = 'MED',
+                                max_concurrency: int = 20,
+                                limiter: Optional[HostRateLimiter] = None,
+                                stats: Optional[RequestStats] = None) -> dict:
+    """
+    Fetches the current number of citations (hitCount) of articles from EuropePMC, by
+    requesting a single citation per article.
+
+    :param article_ids: List of article PMIDs.
+    :param session: An aiohttp.ClientSession object used for making HTTP requests.
+    :param source: The source from which citations are fetched. Default is 'MED'.
+    :param max_concurrency: Maximum number of concurrent requests. Default is 20.
+    :param limiter: Optional HostRateLimiter shared by all requests.
+    :param stats: Optional RequestStats object in which the requests are recorded.
+
+    :return: Dictionary mapping the article PMIDs to their number of citations. Articles for
+        which the request failed are left out.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch_count(article_id: str):
+        url = (f'https://www.ebi.ac.uk/europepmc/webservices/rest/{source}/{article_id}'
+               f'/citations?page=1&pageSize=1&format=json')
+        async with semaphore:
+            try:
+                result = await request_json(session, url, limiter=limiter, stats=stats)
+            except Exception: # pylint: disable=broad-except
+                pubmetric.log.log_with_timestamp(f'Something went wrong with request {url}')
+                return article_id, None
+        return article_id, result.get('hitCount') or 0
+
+    counts = await tqdm_asyncio.gather(*(fetch_count(article_id) for article_id in article_ids),
+                                       desc="Fetching citation counts", unit="article")
+    return {article_id: count for article_id, count in counts if count is not None}
+
 async def process_citation_data(metadata_file: list,
                                 inpath: Optional[str]='', # default main dir temporarily
                                 outpath: Optional[str]='',
                                 threshold: int = 20,
-                                batch_size: int = 1000) -> dict:
+                                batch_size: Optional[int] = None,
+                                max_concurrency: int = 20,
+                                requests_per_second: float = EUROPEPMC_REQUESTS_PER_SECOND,
+                                stats: Optional[RequestStats] = None,
+                                cache: Optional[ResponseCache] = None,
+                                citations_filename: Optional[str] = None) -> dict:
     """
     Processes citation data by fetching citations for tools listed in the metadata file
     and filtering them based on a citation threshold.
 
     :param metadata_file: A list of dictionaries containing metadata for tools, with each
         dictionary including a 'pmid' key for the tool's PMIDs.
-    :param inpath: Optional path to the directory where the 'paper_citations.json' file is
-        located. If the file exists, it will be loaded for initial data.
-    :param outpath: Optional path to the directory where the updated 'paper_citations.json'
-        file will be saved.
+    :param inpath: Optional path to the directory of the checkpoint of an interrupted run,
+        see read_citation_checkpoint. The tools in it are not downloaded again.
+    :param outpath: Optional path to the directory where the checkpoint log
+        'paper_citations.jsonl' is kept while downloading. The citations of every tool are
+        appended to it as soon as they are downloaded, and it is removed on completion.
     :param threshold: The maximum number of citations a paper can have to be considered
         relevant. Citations exceeding this threshold are excluded. Default is 20.
-    :param batch_size: Number of tools to process per batch when fetching citations. Default is 1000.
+    :param batch_size: Deprecated and ignored, the progress is saved per tool.
+    :param max_concurrency: Maximum number of tools for which citations are downloaded
+        concurrently. Default is 20.
+    :param requests_per_second: Maximum request rate towards EuropePMC. Default is 10.
+    :param stats: Optional RequestStats object in which the requests are recorded, to inspect
+        throughput and latency afterwards. The summary is logged in either case.
+    :param cache: Optional ResponseCache the citation pages are served from or stored in.
+    :param citations_filename: Optional name of a file in outpath in which the citation lists
+        of the tools are kept, e.g. for incremental updates of the graph.
+
+    :raises DownloadError: If the citations of some tools could not be downloaded. The
+        checkpoint log is kept, so that a run with outpath as inpath only downloads those.
 
     :return: A dictionary where each key is a citation PMID, and the value is a set of PMIDs
         of papers that cite it. Citations with counts exceeding the threshold or referencing
         only one paper are removed.
     """
+    if batch_size is not None:
+        warnings.warn("batch_size is ignored, the citations are saved per tool.",
+                      DeprecationWarning, stacklevel=2)
+
+    checkpoint = CheckpointLog(os.path.join(outpath, CITATIONS_CHECKPOINT_FILENAME))
+    checkpoint.update({pmid: citations
+                       for pmid, citations in read_citation_checkpoint(inpath).items()
+                       if pmid not in checkpoint.records})
+    pending_tools = [tool['pmid']
+                     for tool in metadata_file['tools']
+                     if tool['pmid'] not in checkpoint.records]
+
+    limiter = HostRateLimiter(default_rate=requests_per_second)
+    stats = stats or RequestStats()
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60),
+                                         connector=aiohttp.TCPConnector(limit=max_concurrency)
+                                         ) as session:
+            # Saving data incrementally, the citations of every tool as soon as they arrive
+            await fetch_citations_batch(pending_tools, session,
+                                        max_concurrency=max_concurrency,
+                                        limiter=limiter, stats=stats,
+                                        cache=cache, on_result=checkpoint.append)
+    finally:
+        checkpoint.close()
+    saved_data = checkpoint.records
+    pubmetric.log.log_with_timestamp(f"EuropePMC request statistics: {stats.summary()}")
+    failed_tools = [pmid for pmid in pending_tools if pmid not in saved_data]
+    if failed_tools:
+        raise DownloadError(f"The citations of {len(failed_tools)} tools could not be "
+                            f"downloaded, the others are saved in {checkpoint.path}.")
+
+    if citations_filename:
+        with open(os.path.join(outpath, citations_filename), 'w', encoding='utf-8') as f:
+            json.dump({tool['pmid']: saved_data.get(tool['pmid'], [])
+                       for tool in metadata_file['tools']}, f)
+
+    paper_citations = build_paper_citations(metadata_file=metadata_file,
+                                            tool_citations=saved_data,
+                                            threshold=threshold)
+
+    # rm files after completion
+    for filename in (CITATIONS_CHECKPOINT_FILENAME, 'paper_citations.json'):
+        if os.path.exists(os.path.join(outpath, filename)):
+            os.remove(os.path.join(outpath, filename))
+
+    return paper_citations
+
+def read_citation_checkpoint(path: Optional[str]) -> dict:
+    """
+    Reads the citation lists saved in a directory by an interrupted process_citation_data,
+    from the checkpoint log 'paper_citations.jsonl', or the 'paper_citations.json' written
+    by earlier versions.
 
-    citation_counts = Counter()
-    paper_citations = defaultdict(set)
+    :param path: Path to the directory, or None.
 
-    if os.path.exists(os.path.join(inpath, 'paper_citations.json')):
-        with open(os.path.join(inpath, 'paper_citations.json'), 'r', encoding='utf-8') as f:
+    :return: Dictionary mapping tool PMIDs to the PMIDs citing them, empty if nothing was saved.
+    """
+    saved_data = {}
+    if path is None:
+        return saved_data
+    if os.path.exists(os.path.join(path, 'paper_citations.json')):
+        with open(os.path.join(path, 'paper_citations.json'), 'r', encoding='utf-8') as f:
             saved_data = json.load(f)
-    else:
-        saved_data = {}
-    pending_tools = [tool['pmid']
-                     for tool in metadata_file['tools']
-                     if tool['pmid'] not in saved_data]
-    
-    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
-        while pending_tools:
-            current_batch = pending_tools[:batch_size]
-            pending_tools = pending_tools[batch_size:]
+    if os.path.exists(os.path.join(path, CITATIONS_CHECKPOINT_FILENAME)):
+        records, _ = CheckpointLog.replay(os.path.join(path, CITATIONS_CHECKPOINT_FILENAME))
+        saved_data.update(records)
+    return saved_data
+
+def build_paper_citations(metadata_file: dict, tool_citations: dict, threshold: int = 20) -> dict:
+    """
+    Inverts the citation lists of the tools into the papers citing them, and sets the
+    number of citations of every tool in the metadata file.
 
-            batch_results = await fetch_citations_batch(current_batch, session)
+    :param metadata_file: Dictionary containing metadata with a 'tools' key, where each
+        tool includes a 'pmid' key.
+    :param tool_citations: Dictionary mapping tool PMIDs to the list of PMIDs citing them.
+    :param threshold: The maximum number of tools a citing paper can cite to be kept.
+        Default is 20.
 
-            # Saving data incrementally
-            saved_data.update(batch_results)
-            with open(os.path.join(outpath, 'paper_citations.json'), 'w', encoding='utf-8') as f:
-                json.dump(saved_data, f)
-            await asyncio.sleep(60)
+    :return: A dictionary where each key is a citation PMID, and the value is a set of PMIDs
+        of papers that cite it. Citations with counts exceeding the threshold or referencing
+        only one paper are removed.
+    """
+    citation_counts = Counter()
+    paper_citations = defaultdict(set)
 
     for tool in tqdm(metadata_file['tools'], desc="Processing citations", unit="tool"):
         paper_pmid = tool['pmid']
-        citations = saved_data.get(paper_pmid, [])
+        citations = tool_citations.get(paper_pmid, [])
         tool['nr_citations'] = len(citations)
         if citations:
             for citation_pmid in citations:
@@ -510,7 +893,224 @@ async def process_citation_data(metadata_file: list,
         f"Number of citations removed due to exceeding threshold {threshold} "
         f"or referencing only one paper: {removed_citations}")
 
-    if os.path.exists(os.path.join(outpath, 'paper_citations.json')): # rm file after completion
-        os.remove(os.path.join(outpath, 'paper_citations.json'))
-
     return paper_citations
+
+_END = None # marks the end of the input of a pipeline stage
+
+async def _take_batch(stage_queue: asyncio.Queue, batch_size: int) -> Tuple[list, bool]:
+    """
+    Waits for an item of a pipeline stage queue and takes the items queued behind it, at
+    most batch_size in total. Returns the items and whether the end of the input was reached.
+    The end marker is put back for the other workers of the stage.
+    """
+    items = [await stage_queue.get()]
+    while len(items) < batch_size and not stage_queue.empty() and items[-1] is not _END:
+        items.append(stage_queue.get_nowait())
+    if items[-1] is _END:
+        await stage_queue.put(_END)
+        return items[:-1], True
+    return items, False
+
+async def _gather_stages(*coroutines) -> list:
+    """
+    Runs the coroutines concurrently, like asyncio.gather. If one of them fails or the
+    caller is cancelled, the others are cancelled and awaited before the error is raised,
+    so that none of them is still running once the caller cleans up.
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+async def _run_workers(worker: Callable, nr_workers: int):
+    await _gather_stages(*(worker() for _ in range(nr_workers)))
+
+async def stream_tool_data(outpath: str,
+                           topic_id: Optional[str],
+                           inpath: Optional[str] = None,
+                           test_size: Optional[int] = None,
+                           tool_filter: Optional[Callable[[dict], bool]] = None,
+                           on_citations: Optional[Callable[[dict, list], None]] = None,
+                           queue_size: int = 1000,
+                           eutils_concurrency: int = 2,
+                           citation_concurrency: int = 20,
+                           requests_per_second: float = EUROPEPMC_REQUESTS_PER_SECOND,
+                           cache: Optional[ResponseCache] = None) -> Tuple[dict, dict]:
+    """
+    Downloads the tool metadata and the citations of the tools of a topic, like
+    get_tool_metadata followed by process_citation_data, but as a pipeline of stages
+    connected by bounded queues: every tool is passed on to DOI resolution, the publication
+    date lookup and the citation download as soon as its bio.tools page arrives. DOIs and
+    publication dates are requested in batches of the tools waiting in their queue. A full
+    queue holds up the stage before it.
+
+    :param outpath: Path to the directory where the doi-pmid library and the citation
+        checkpoint log are kept, see DoiLibrary and process_citation_data.
+    :param topic_id: The ID to which the tools downloaded belong, None for all of bio.tools.
+    :param inpath: Optional path to the directory of an existing doi-pmid library or the
+        citation checkpoint of an interrupted run.
+    :param test_size: Optional number of tools after which the bio.tools crawl stops.
+    :param tool_filter: Optional function selecting the tools that are kept, by their
+        bio.tools metadata.
+    :param on_citations: Optional function called with the metadata and the citations of
+        every tool as soon as they are downloaded, e.g. CocitationCounter.add_tool.
+    :param queue_size: Maximum number of tools waiting for a stage. Default is 1000.
+    :param eutils_concurrency: Number of concurrent DOI and of concurrent publication date
+        batches. Default is 2, the NCBI request rate is limited by the EutilsClient.
+    :param citation_concurrency: Maximum number of tools for which citations are downloaded
+        concurrently. Default is 20.
+    :param requests_per_second: Maximum request rate towards EuropePMC. Default is 10.
+    :param cache: Optional ResponseCache the downloads are served from or stored in.
+
+    :raises DownloadError: If the citations of some tools could not be downloaded. The
+        checkpoint log is kept, so that a run with outpath as inpath only downloads those.
+
+    :return: Tuple of the metadata dictionary, in the format of get_tool_metadata with the
+        'nr_citations' of every tool, and the dictionary mapping the tool PMIDs to the PMIDs
+        citing them.
+    """
+    metadata_file = {
+        "creation_date": str(datetime.now()),
+        "topic": topic_id
+    }
+    crawler = BiotoolsCrawler(topic_id, test_size=test_size, cache=cache)
+    eutils_client = EutilsClient(cache=cache)
+    doi_library = DoiLibrary(outpath=outpath, inpath=inpath)
+    checkpoint = CheckpointLog(os.path.join(outpath, CITATIONS_CHECKPOINT_FILENAME))
+    checkpoint.update({pmid: citations
+                       for pmid, citations in read_citation_checkpoint(inpath).items()
+                       if pmid not in checkpoint.records})
+    limiter = HostRateLimiter(default_rate=requests_per_second)
+    stats = RequestStats()
+
+    pmid_tools = []
+    doi_tools = [] # collect tools without pmid
+    doi_queue, date_queue, citation_queue = (asyncio.Queue(maxsize=queue_size) for _ in range(3))
+    citation_downloads = {} # pmid -> download, shared by the tools with the same pmid
+    failed_tools = set()
+    tools_without_pubdate = 0
+    progress = tqdm(desc="Fetching Citations", unit="tool")
+
+    async def crawl(session: aiohttp.ClientSession):
+        async for tool in crawler.tools(session):
+            if tool_filter and not tool_filter(tool):
+                continue
+            if 'pmid' in tool:
+                pmid_tools.append(tool)
+                await date_queue.put(tool)
+            else:
+                doi_tools.append(tool)
+                await doi_queue.put(tool)
+        await doi_queue.put(_END)
+
+    async def resolve_dois(session: aiohttp.ClientSession):
+        ended = False
+        while not ended:
+            tools, ended = await _take_batch(doi_queue, eutils_client.batch_size)
+            await doi_library.resolve(session, [tool.get('doi') for tool in tools], eutils_client)
+            for tool in tools:
+                if tool.get('doi') in doi_library.pmids:
+                    tool['pmid'] = doi_library.pmids[tool['doi']]
+                    await date_queue.put(tool)
+
+    async def look_up_dates(session: aiohttp.ClientSession):
+        nonlocal tools_without_pubdate
+        ended = False
+        while not ended:
+            tools, ended = await _take_batch(date_queue, eutils_client.batch_size)
+            undated_tools = [tool for tool in tools
+                             if not tool.get('publication_date')
+                             or tool['publication_date'] == 'null']
+            if undated_tools:
+                summaries = await eutils_client.esummary(
+                    session, list({tool['pmid'] for tool in undated_tools}))
+                for tool in undated_tools:
+                    pub_date = summaries.get(tool['pmid'], {}).get('pubdate', None)
+                    if pub_date:
+                        tool['publication_date'] = int(str(pub_date).split()[0])
+                    else:
+                        tools_without_pubdate += 1
+            for tool in tools:
+                await citation_queue.put(tool)
+
+    async def download_citations(session: aiohttp.ClientSession):
+        while True:
+            tool = await citation_queue.get()
+            if tool is _END:
+                await citation_queue.put(_END)
+                return
+            pmid = tool['pmid']
+            if pmid not in checkpoint.records:
+                if pmid not in citation_downloads:
+                    citation_downloads[pmid] = asyncio.ensure_future(
+                        fetch_citations(pmid, session, limiter=limiter, stats=stats, cache=cache))
+                try:
+                    citations = await citation_downloads[pmid]
+                except Exception as e: # pylint: disable=broad-except
+                    pubmetric.log.log_with_timestamp(
+                        f"Failed to fetch citations for {pmid}: {str(e)}")
+                    failed_tools.add(pmid) # not checkpointed, so a rerun downloads it again
+                    progress.update(1)
+                    continue
+                if pmid not in checkpoint.records:
+                    checkpoint.append(pmid, citations)
+            citations = checkpoint.records[pmid]
+            tool['nr_citations'] = len(citations)
+            if on_citations:
+                on_citations(tool, citations)
+            progress.update(1)
+
+    async def crawl_and_resolve(session: aiohttp.ClientSession):
+        await _gather_stages(crawl(session),
+                             _run_workers(lambda: resolve_dois(session), eutils_concurrency))
+        await date_queue.put(_END)
+
+    async def date_stage(session: aiohttp.ClientSession):
+        await _run_workers(lambda: look_up_dates(session), eutils_concurrency)
+        await citation_queue.put(_END)
+
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
+            try:
+                await _gather_stages(crawl_and_resolve(session),
+                                     date_stage(session),
+                                     _run_workers(lambda: download_citations(session),
+                                                  citation_concurrency))
+            finally: # downloads no worker waits for anymore, before the session closes
+                for download in citation_downloads.values():
+                    download.cancel()
+                await asyncio.gather(*citation_downloads.values(), return_exceptions=True)
+    finally:
+        progress.close()
+        doi_library.close()
+        checkpoint.close()
+    doi_library.save()
+
+    pubmetric.log.log_with_timestamp(
+        f"Primary publications count: {crawler.primary_stat}," 
+        f"missing publication count: {crawler.no_publication_stat}")
+    pubmetric.log.log_with_timestamp(
+        f"Nr of tools for which publication date could not be found: {tools_without_pubdate}")
+    pubmetric.log.log_with_timestamp(f"EuropePMC request statistics: {stats.summary()}")
+    if failed_tools:
+        raise DownloadError(f"The citations of {len(failed_tools)} tools could not be "
+                            f"downloaded, the others are saved in {checkpoint.path}.")
+
+    doi_tools_with_pmid = [tool for tool in doi_tools if tool.get('pmid')]
+    metadata_file['total_nr_tools'] = crawler.total_nr_tools
+    metadata_file['biotools_wo_pmid'] = len(doi_tools)
+    metadata_file["pmid_from_doi"] = len(doi_tools_with_pmid)
+    metadata_file["tools"] = pmid_tools + doi_tools_with_pmid
+    tool_citations = {tool['pmid']: checkpoint.records.get(tool['pmid'], [])
+                      for tool in metadata_file["tools"]}
+    os.remove(checkpoint.path)
+
+    pubmetric.log.log_with_timestamp(
+        f'Found {len(metadata_file["tools"])} out of a total of {crawler.total_nr_tools} '
+        f'tools with PMIDS.')
+
+    return metadata_file, tool_citations
@@ -0,0 +1,181 @@
+"""
+Batched client for the NCBI E-utilities, used to resolve DOIs to PMIDs and to
+download publication summaries
+"""
+import os
+import asyncio
+from typing import Callable, Optional
+
+import aiohttp
+
+from .ratelimit import HostRateLimiter, RequestStats, request_json
+from .cache import ResponseCache
+from .exceptions import CacheMissError
+
+EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+EUTILS_HOST = "eutils.ncbi.nlm.nih.gov"
+
+# Requests per second allowed by NCBI without and with an API key
+REQUESTS_PER_SECOND = 3
+REQUESTS_PER_SECOND_API_KEY = 10
+
+
+async def _gather_batches(batches: list, on_batch: Optional[Callable[[dict], None]]) -> dict:
+    """
+    Runs the batch coroutines concurrently and merges their dictionaries, passing every
+    result to on_batch as it completes. If a batch fails, the others are cancelled.
+    """
+    results = {}
+    tasks = [asyncio.ensure_future(batch) for batch in batches]
+    try:
+        for task in asyncio.as_completed(tasks):
+            batch_results = await task
+            results.update(batch_results)
+            if on_batch:
+                on_batch(batch_results)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception() # retrieved, so a second failure is not reported as unhandled
+    return results
+
+
+class EutilsClient:
+    """
+    Client for the esearch and esummary E-utilities. Identifiers are sent in batches
+    as POST requests, so there is no limit on the URL length, and the batches are run
+    concurrently within the NCBI request quota.
+    """
+    def __init__(self,
+                 api_key: Optional[str] = None,
+                 email: Optional[str] = None,
+                 batch_size: int = 200,
+                 retries: int = 3,
+                 requests_per_second: Optional[float] = None,
+                 cache: Optional[ResponseCache] = None):
+        """
+        :param api_key: NCBI API key, which raises the quota from 3 to 10 requests per
+            second. Defaults to the NCBI_API_KEY environment variable.
+        :param email: Optional contact email sent along with the requests, as asked by NCBI.
+        :param batch_size: Maximum number of identifiers per request. Default is 200.
+        :param retries: Maximum number of attempts of a request, and number of times
+            identifiers missing from a response are requested again. Default is 3.
+        :param requests_per_second: Overrides the request rate given by the API key tier.
+        :param cache: Optional ResponseCache the responses are served from or stored in.
+            The API key and email are not part of the cache key.
+        """
+        self.api_key = api_key or os.environ.get('NCBI_API_KEY')
+        self.email = email
+        self.batch_size = batch_size
+        self.retries = retries
+        if requests_per_second is None:
+            requests_per_second = (REQUESTS_PER_SECOND_API_KEY if self.api_key
+                                   else REQUESTS_PER_SECOND)
+        self.limiter = HostRateLimiter(host_rates={EUTILS_HOST: requests_per_second})
+        self.stats = RequestStats()
+        self.cache = cache
+
+    def _batches(self, ids: list) -> list:
+        return [ids[i:i + self.batch_size] for i in range(0, len(ids), self.batch_size)]
+
+    async def _post(self, session: aiohttp.ClientSession, endpoint: str, params: dict) -> dict:
+        url = EUTILS_URL + endpoint
+        params = {**params, 'retmode': 'json', 'tool': 'pubmetric'}
+        if self.cache: # cached without the credentials, so they can change
+            cache_key = self.cache.key(url, params)
+            cached_result = self.cache.get(cache_key)
+            if cached_result is not None:
+                return cached_result
+            if self.cache.offline:
+                raise CacheMissError(f"{endpoint} request is not in the response cache.")
+
+        request_params = dict(params)
+        if self.api_key:
+            request_params['api_key'] = self.api_key
+        if self.email:
+            request_params['email'] = self.email
+        result = await request_json(session, url, data=request_params,
+                                    limiter=self.limiter, stats=self.stats,
+                                    retries=self.retries)
+        if self.cache:
+            self.cache.set(cache_key, result, url=url)
+        return result
+
+    async def _esummary_batch(self, session: aiohttp.ClientSession, pmids: list) -> dict:
+        summaries = {}
+        missing = list(pmids)
+        for _ in range(self.retries):
+            result = (await self._post(session, 'esummary.fcgi',
+                                       {'db': 'pubmed', 'id': ','.join(missing)})
+                      ).get('result', {})
+            summaries.update({uid: result[uid] for uid in result.get('uids', [])})
+            missing = [pmid for pmid in missing if pmid not in summaries]
+            if not missing:
+                break
+        return summaries
+
+    async def esummary(self,
+                       session: aiohttp.ClientSession,
+                       pmids: list,
+                       on_batch: Optional[Callable[[dict], None]] = None) -> dict:
+        """
+        Downloads the PubMed document summaries of the given PMIDs.
+
+        :param session: aiohttp.ClientSession used for the requests.
+        :param pmids: List of PMIDs.
+        :param on_batch: Optional function called with the summaries of every batch as
+            soon as it is downloaded.
+
+        :raises CacheMissError: If the cache is offline and a batch is not cached.
+        :raises Exception: If a request still fails after all attempts. The summaries of
+            the batches completed before were passed to on_batch.
+
+        :return: Dictionary mapping the PMIDs to their document summaries. PMIDs missing
+            from the responses are left out.
+        """
+        return await _gather_batches([self._esummary_batch(session, [str(pmid) for pmid in batch])
+                                      for batch in self._batches(list(pmids))], on_batch)
+
+    async def _dois_to_pmids_batch(self, session: aiohttp.ClientSession, dois: list) -> dict:
+        term = ' OR '.join(f'"{doi}"[doi]' for doi in dois)
+        result = await self._post(session, 'esearch.fcgi',
+                                  {'db': 'pubmed', 'term': term, 'retmax': 2 * len(dois)})
+        id_list = result.get('esearchresult', {}).get('idlist', [])
+        if not id_list:
+            return {}
+
+        # The search does not say which id belongs to which DOI, the summaries do
+        summaries = await self._esummary_batch(session, id_list)
+        requested = {doi.lower(): doi for doi in dois}
+        doi_pmids = {}
+        for pmid, summary in summaries.items():
+            for article_id in summary.get('articleids', []):
+                if article_id.get('idtype') == 'doi':
+                    doi = requested.get(article_id.get('value', '').lower())
+                    if doi and doi not in doi_pmids:
+                        doi_pmids[doi] = pmid
+        return doi_pmids
+
+    async def dois_to_pmids(self,
+                            session: aiohttp.ClientSession,
+                            dois: list,
+                            on_batch: Optional[Callable[[dict], None]] = None) -> dict:
+        """
+        Resolves DOIs to PMIDs.
+
+        :param session: aiohttp.ClientSession used for the requests.
+        :param dois: List of DOIs.
+        :param on_batch: Optional function called with the DOI to PMID mapping of every
+            batch as soon as it is resolved.
+
+        :raises CacheMissError: If the cache is offline and a batch is not cached.
+        :raises Exception: If a request still fails after all attempts. The mappings of
+            the batches completed before were passed to on_batch.
+
+        :return: Dictionary mapping the DOIs to their PMIDs. DOIs which are not in PubMed
+            are left out.
+        """
+        return await _gather_batches([self._dois_to_pmids_batch(session, batch)
+                                      for batch in self._batches(list(dois))], on_batch)
@@ -1,5 +1,5 @@
 """
-Defining own exceptions for schema validation errors. 
+Defining own exceptions for schema validation errors, the response cache and graph updates.
 
 """
 class SchemaValidationError(Exception):
@@ -9,3 +9,27 @@ class SchemaValidationError(Exception):
     def __init__(self, message="The schema of the contents of the file is incorrect."):
         self.message = message
         super().__init__(self.message)
+
+class CacheMissError(Exception):
+    """
+    Exception raised when a request is not in the response cache while working offline.
+    """
+    def __init__(self, message="The request is not in the response cache."):
+        self.message = message
+        super().__init__(self.message)
+
+class GraphVerificationError(Exception):
+    """
+    Exception raised when an updated graph differs from a full rebuild.
+    """
+    def __init__(self, message="The updated graph differs from a full rebuild."):
+        self.message = message
+        super().__init__(self.message)
+
+class DownloadError(Exception):
+    """
+    Exception raised when a download returns an incomplete or malformed response.
+    """
+    def __init__(self, message="The download returned an incomplete response."):
+        self.message = message
+        super().__init__(self.message)
@@ -1,5 +1,12 @@
 """ Logging methods"""
+import sys
 from datetime import datetime
+from typing import Optional
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
 
 def log_with_timestamp(message: str):
     """
@@ -20,3 +27,32 @@ def step_timer(start_time: datetime, step_name: str):
     """
     elapsed_time = datetime.now() - start_time
     log_with_timestamp(f"{step_name} took {elapsed_time}")
+
+
+def peak_memory_mb() -> Optional[float]:
+    """
+    Returns the peak resident memory, in MB, of the current process plus that of its
+    largest terminated child process (e.g. a multiprocessing worker).
+
+    :return: Peak memory in MB, or None if it can not be measured on this platform.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return (own + children) / unit
+
+
+def step_report(start_time: datetime, step_name: str):
+    """
+    Logs the elapsed time and the peak memory use after a specific step.
+
+    :param start_time: The start time of the step to be measured.
+    :param step_name: A descriptive name for the step, used in the log message.
+    """
+    elapsed_time = datetime.now() - start_time
+    peak_memory = peak_memory_mb()
+    memory_message = f", peak memory {peak_memory:.1f} MB" if peak_memory is not None else ""
+    log_with_timestamp(f"{step_name} took {elapsed_time}{memory_message}")
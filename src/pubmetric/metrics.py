@@ -1,14 +1,353 @@
 """Various for the calculation of tool-level and workflow-level metric scores, their transformation, aggregation and the addition of optional attributes"""
 import math
+import warnings
 import statistics
+import weakref
+import functools
+import collections
 from typing import Union, Optional, Tuple
 
 import igraph
 import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from .adjustments import Pipeline, as_pipeline
 
 
 # General functions for interation with graph
 
+class GraphIndex:
+    """
+    Lookup tables of a graph for the metric calculations: the igraph IDs of the nodes, the
+    weight of every node pair connected by an edge, and the degree, age and number of
+    citations of the nodes. Building it costs one pass over the vertices and edges, after
+    which every edge weight lookup is a dictionary access.
+    """
+    def __init__(self, graph: igraph.Graph, key: str = 'pmid'):
+        """
+        :param graph: igraph.Graph with weighted edges.
+        :param key: The vertex attribute identifying the nodes. Default is 'pmid'.
+        """
+        self.key = key
+        self.vcount = graph.vcount()
+        self.ecount = graph.ecount()
+        self.ids = {value: index for index, value in enumerate(graph.vs[key])}
+
+        edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+        pair_keys = (np.minimum(edges[:, 0], edges[:, 1]) * self.vcount
+                     + np.maximum(edges[:, 0], edges[:, 1]))
+        weights = graph.es['weight'] if 'weight' in graph.es.attributes() else [1] * self.ecount
+        # reversed, so that the first of several parallel edges is kept, as in graph.es.find
+        self.weights = dict(zip(pair_keys[::-1].tolist(), weights[::-1]))
+
+        self.degrees = np.array(graph.degree(), dtype=np.int64)
+        attributes = graph.vs.attributes()
+        self.ages = np.array(graph.vs['age']) if 'age' in attributes else None
+        self.nr_citations = (np.array(graph.vs['nr_citations'])
+                             if 'nr_citations' in attributes else None)
+        self._adjacency = None
+
+    @property
+    def adjacency(self) -> scipy.sparse.csr_matrix:
+        """Symmetric sparse adjacency matrix of the edge weights, built on first use."""
+        if self._adjacency is None:
+            pair_keys = np.fromiter(self.weights.keys(), dtype=np.int64, count=len(self.weights))
+            weights = np.fromiter(self.weights.values(), dtype=np.float64,
+                                  count=len(self.weights))
+            rows, cols = np.divmod(pair_keys, max(self.vcount, 1))
+            self._adjacency = scipy.sparse.csr_matrix(
+                (np.concatenate([weights, weights[rows != cols]]),
+                 (np.concatenate([rows, cols[rows != cols]]),
+                  np.concatenate([cols, rows[rows != cols]]))),
+                shape=(self.vcount, self.vcount))
+        return self._adjacency
+
+    def node_ids(self, nodes: list) -> np.ndarray:
+        """Returns the igraph IDs of the nodes as an array, with -1 for nodes not in the graph."""
+        return np.fromiter((self.ids.get(node, -1) for node in nodes), dtype=np.int64,
+                           count=len(nodes))
+
+    def edge_weights(self,
+                     sources: np.ndarray,
+                     targets: np.ndarray,
+                     transform: Optional[str] = None,
+                     age_adjustment: bool = False,
+                     degree_adjustment: bool = False,
+                     adjustments: Optional[Pipeline] = None) -> np.ndarray:
+        """
+        Looks up and adjusts the weights of many node pairs at once, giving the same values
+        as get_graph_edge_weight(...) or 0.0 for every pair.
+
+        :param sources: Array of igraph IDs of the first nodes, -1 for nodes not in the graph.
+        :param targets: Array of igraph IDs of the second nodes, -1 for nodes not in the graph.
+        :param transform: Optional transformation of the weights, see transform_weight.
+        :param age_adjustment: Whether to divide the weights by the minimum age of the nodes.
+        :param degree_adjustment: Whether to divide the weights by the minimum degree of the nodes.
+        :param adjustments: Optional pubmetric.adjustments.Pipeline applied to the weights
+            instead of the transform, age_adjustment and degree_adjustment options.
+
+        :return: Array of weights, 0.0 for pairs with a node not in the graph.
+        """
+        pipeline = as_pipeline(adjustments, transform, age_adjustment, degree_adjustment)
+        found = (sources >= 0) & (targets >= 0)
+        weights = np.zeros(len(sources), dtype=np.float64)
+        if not found.any():
+            return weights
+        found_sources, found_targets = sources[found], targets[found]
+        if len(found_sources) <= 256: # the dictionary is faster than sparse indexing for a few pairs
+            pair_keys = (np.minimum(found_sources, found_targets) * self.vcount
+                         + np.maximum(found_sources, found_targets))
+            found_weights = np.array([self.weights.get(pair_key, 0.0) for pair_key in pair_keys.tolist()],
+                                     dtype=np.float64)
+        else:
+            found_weights = np.asarray(self.adjacency[found_sources, found_targets],
+                                       dtype=np.float64).ravel()
+        weights[found] = pipeline(found_weights, found_sources, found_targets, self)
+        return weights
+
+    def adjust_weights(self,
+                       weights: np.ndarray,
+                       sources: np.ndarray,
+                       targets: np.ndarray,
+                       transform: Optional[str] = None,
+                       age_adjustment: bool = False,
+                       degree_adjustment: bool = False,
+                       adjustments: Optional[Pipeline] = None) -> np.ndarray:
+        """
+        Transforms and adjusts looked up weights, like get_graph_edge_weight.
+
+        :param weights: Array of the weights of the node pairs.
+        :param sources: Array of igraph IDs of the first nodes, all in the graph.
+        :param targets: Array of igraph IDs of the second nodes, all in the graph.
+        :param transform: Optional transformation of the weights, see transform_weight.
+        :param age_adjustment: Whether to divide the weights by the minimum age of the nodes.
+        :param degree_adjustment: Whether to divide the weights by the minimum degree of the nodes.
+        :param adjustments: Optional pubmetric.adjustments.Pipeline applied to the weights
+            instead of the transform, age_adjustment and degree_adjustment options.
+
+        :return: Array of the adjusted weights.
+        """
+        pipeline = as_pipeline(adjustments, transform, age_adjustment, degree_adjustment)
+        return pipeline(weights, sources, targets, self)
+
+    def is_current(self, graph: igraph.Graph) -> bool:
+        """Checks that the graph has not gained or lost nodes or edges since indexing."""
+        return graph.vcount() == self.vcount and graph.ecount() == self.ecount
+
+    def edge_weight(self, source, target) -> Union[float, None]:
+        """
+        Looks up the weight of the edge between two nodes.
+
+        :param source: Identifier of the first node.
+        :param target: Identifier of the second node.
+
+        :return: The edge weight, None if either node is not in the graph, or 0.0 if the
+            nodes are not connected.
+        """
+        source_id = self.ids.get(source)
+        target_id = self.ids.get(target)
+        if source_id is None or target_id is None:
+            return None
+        if source_id > target_id:
+            source_id, target_id = target_id, source_id
+        return self.weights.get(source_id * self.vcount + target_id, 0.0)
+
+    def degree(self, node) -> int:
+        """Returns the degree of a node."""
+        return self.degrees[self.ids[node]]
+
+    def age(self, node, default=None):
+        """Returns the age of a node, or the default if it is not in the graph."""
+        node_id = self.ids.get(node)
+        return self.ages[node_id] if node_id is not None else default
+
+    def citations(self, node, default=None):
+        """Returns the number of citations of a node, or the default if it is not in the graph."""
+        node_id = self.ids.get(node)
+        return self.nr_citations[node_id] if node_id is not None else default
+
+
+_graph_caches = {} # id of the graph -> cache dictionary, dropped when the graph is collected
+
+def graph_cache(graph: igraph.Graph) -> dict:
+    """
+    Returns a dictionary for lookup tables derived from a graph, such as its GraphIndex,
+    which lives as long as the graph.
+
+    :param graph: igraph.Graph
+
+    :return: The cache dictionary of the graph.
+    """
+    cache = _graph_caches.get(id(graph))
+    if cache is None: # igraph graphs are not hashable, so they are tracked by id
+        cache = _graph_caches[id(graph)] = {}
+        weakref.finalize(graph, _graph_caches.pop, id(graph), None)
+    return cache
+
+def get_graph_index(graph: igraph.Graph, key: str = 'pmid') -> GraphIndex:
+    """
+    Returns the GraphIndex of a graph, building it on first use. Indexes are cached per
+    graph and rebuilt if nodes or edges were added or removed; create a new GraphIndex
+    yourself if attributes of an existing graph are changed in place.
+
+    :param graph: igraph.Graph with weighted edges.
+    :param key: The vertex attribute identifying the nodes. Default is 'pmid'.
+
+    :return: The GraphIndex of the graph.
+    """
+    cache = graph_cache(graph)
+    index = cache.get(('graph_index', key))
+    if index is None or not index.is_current(graph):
+        index = cache[('graph_index', key)] = GraphIndex(graph, key=key)
+    return index
+
+DISTANCE_CACHE_BYTES = 32 * 1024 ** 2 # rows kept per DistanceIndex computing them on demand
+
+class DistanceIndex:
+    """
+    Number of edges on the shortest path between every pair of nodes, as found by
+    graph.get_shortest_paths: with weights, the path of least total inverted weight.
+    Every row costs one Dijkstra (or breadth-first) search from its source. Rows are
+    computed on demand and the most recently used ones are kept, up to max_bytes, unless
+    all rows are precomputed with dense=True. Pairs without a path have 0 edges.
+    """
+    def __init__(self,
+                 graph: igraph.Graph,
+                 weighted: bool = True,
+                 dense: bool = False,
+                 max_rows: Optional[int] = None,
+                 hops: Optional[np.ndarray] = None,
+                 max_bytes: int = DISTANCE_CACHE_BYTES):
+        """
+        :param graph: igraph.Graph with weighted edges, and inverted weights if weighted.
+        :param weighted: Whether the paths minimise the sum of the inverted edge weights
+            (True) or the number of edges (False). Default is True.
+        :param dense: Whether to compute all rows at once, one search per vertex of the
+            graph, e.g. to save them with network.write_distance_index. Default is False.
+        :param max_rows: Optional maximum number of rows kept if the rows are computed on
+            demand, in addition to max_bytes.
+        :param hops: Optional precomputed vcount x vcount matrix, see DistanceIndex.save.
+        :param max_bytes: Maximum size of the rows kept if the rows are computed on demand.
+            At least one row is kept. Default is 32 MB.
+        """
+        self.weighted = weighted
+        self.vcount = graph.vcount()
+        self.ecount = graph.ecount()
+        self.dtype = np.int16 if self.vcount < np.iinfo(np.int16).max else np.int32
+        row_bytes = max(1, self.vcount * np.dtype(self.dtype).itemsize)
+        self.max_rows = max(1, min(max_rows or math.inf, max_bytes // row_bytes))
+        self._graph = weakref.ref(graph) # not kept alive by its own cached index
+        self._weights = None
+        self._rows = collections.OrderedDict()
+        if weighted:
+            if 'inverted_weight' in graph.es.attributes():
+                self._weights = graph.es['inverted_weight']
+            else:
+                with np.errstate(divide='ignore'):
+                    self._weights = (1.0 / np.asarray(graph.es['weight'], dtype=np.float64)).tolist()
+
+        if hops is not None:
+            if hops.shape != (self.vcount, self.vcount):
+                raise ValueError(f"Distance matrix of shape {hops.shape} does not match the graph.")
+            self.hops = hops
+        elif dense:
+            self.hops = self._compute_rows(None)
+        else:
+            self.hops = None
+
+    def _compute_rows(self, source: Optional[int]) -> np.ndarray:
+        """Computes the row of a source vertex, or the full matrix if the source is None."""
+        graph = self._graph()
+        if graph is None:
+            raise ReferenceError("The graph of the distance index no longer exists.")
+        sources = range(self.vcount) if source is None else [source]
+        if not self.weighted:
+            hops = np.array(graph.distances(source=source),
+                            dtype=np.float64).reshape(len(sources), self.vcount)
+            hops[np.isinf(hops)] = 0
+            hops = hops.astype(self.dtype)
+        else:
+            hops = np.empty((len(sources), self.vcount), dtype=self.dtype)
+            with warnings.catch_warnings(): # unreachable vertices are warned about
+                warnings.simplefilter('ignore', RuntimeWarning)
+                for i, vertex in enumerate(sources):
+                    paths = graph.get_shortest_paths(vertex, to=None, weights=self._weights,
+                                                     output="epath")
+                    hops[i] = np.fromiter(map(len, paths), dtype=self.dtype, count=self.vcount)
+        return hops if source is None else hops[0]
+
+    def row(self, source: int) -> np.ndarray:
+        """Returns the number of edges on the shortest paths from a vertex to every vertex."""
+        if self.hops is not None:
+            return self.hops[source]
+        row = self._rows.get(source)
+        if row is None:
+            row = self._rows[source] = self._compute_rows(source)
+            if len(self._rows) > self.max_rows:
+                self._rows.popitem(last=False)
+        else:
+            self._rows.move_to_end(source)
+        return row
+
+    def path_length(self, source: int, target: int) -> int:
+        """
+        Returns the number of edges on the shortest path between two vertices.
+
+        :param source: igraph ID of the first vertex.
+        :param target: igraph ID of the second vertex.
+
+        :return: The number of edges, 0 if there is no path.
+        """
+        return int(self.row(source)[target])
+
+    def is_current(self, graph: igraph.Graph) -> bool:
+        """Checks that the graph has not gained or lost nodes or edges since indexing."""
+        return graph.vcount() == self.vcount and graph.ecount() == self.ecount
+
+    def save(self, filename: str):
+        """
+        Saves the distance matrix as a NumPy array, computing the missing rows.
+
+        :param filename: Path of the .npy file.
+        """
+        hops = self.hops if self.hops is not None else self._compute_rows(None)
+        np.save(filename, hops)
+
+    @classmethod
+    def load(cls, filename: str, graph: igraph.Graph, weighted: bool = True) -> "DistanceIndex":
+        """
+        Loads a distance matrix saved with DistanceIndex.save, memory-mapped.
+
+        :param filename: Path of the .npy file.
+        :param graph: The graph the distances were computed for.
+        :param weighted: Whether the distances are weighted. Default is True.
+
+        :raises ValueError: If the matrix does not match the size of the graph.
+
+        :return: DistanceIndex
+        """
+        return cls(graph, weighted=weighted, hops=np.load(filename, mmap_mode='r'))
+
+def get_distance_index(graph: igraph.Graph, weighted: bool = True, dense: bool = False) -> DistanceIndex:
+    """
+    Returns the DistanceIndex of a graph, building it on first use. Indexes are cached per
+    graph and rebuilt if nodes or edges were added or removed.
+
+    :param graph: igraph.Graph with weighted edges.
+    :param weighted: Whether the paths are weighted. Default is True.
+    :param dense: Whether all rows are precomputed, see DistanceIndex. A cached index
+        with rows computed on demand is replaced by a dense one. Default is False.
+
+    :return: The DistanceIndex of the graph.
+    """
+    cache = graph_cache(graph)
+    index = cache.get(('distance_index', weighted))
+    if index is None or not index.is_current(graph) or (dense and index.hops is None):
+        index = cache[('distance_index', weighted)] = DistanceIndex(graph, weighted=weighted,
+                                                                    dense=dense)
+    return index
+
 def get_node_ids(graph: igraph.Graph, key:str= "pmid") -> dict:
     """"
     Maps node names to their igraph IDs.
@@ -32,19 +371,20 @@ def get_node_ids(graph: igraph.Graph, key:str= "pmid") -> dict:
 
 def get_graph_edge_weight(graph: igraph.Graph,
                         edge: tuple,
-                        id_dict: dict,
+                        id_dict: Optional[dict] = None,
                         key: str = 'pmid',
                         transform: Optional[str] = None,
                         age_adjustment: bool = False,
-                        degree_adjustment: bool = False) -> Union[float, None]:
+                        degree_adjustment: bool = False,
+                        index: Optional[GraphIndex] = None,
+                        adjustments: Optional[Pipeline] = None) -> Union[float, None]:
     """
     Retrieves and optionally adjusts the weight of an edge between two nodes in a graph.
 
     :param graph: igraph.Graph object representing the graph with weighted edges.
     :param edge: Tuple containing the identifiers (e.g., node names or PMIDs) of
         the two nodes forming the edge.
-    :param id_dict: Dictionary mapping node identifiers to their corresponding
-        indices in the graph.
+    :param id_dict: Deprecated and ignored, the node indices are taken from the graph index.
     :param key: String specifying the attribute key used to identify nodes in
         the graph. Default is 'pmid'.
     :param transform: Optional string specifying a transformation to apply to
@@ -53,35 +393,51 @@ def get_graph_edge_weight(graph: igraph.Graph,
         on the age of the nodes. Default is False.
     :param degree_adjustment: Boolean indicating whether to adjust the weight
         based on the degree of the nodes. Default is False.
+    :param index: Optional GraphIndex of the graph. By default the cached index of the
+        graph is used, see get_graph_index.
+    :param adjustments: Optional pubmetric.adjustments.Pipeline applied to the weight instead
+        of the transform, age_adjustment and degree_adjustment options.
 
     :return: Float representing the (possibly adjusted and transformed) weight of
         the edge in the graph.
         Returns None if the nodes do not exist in the graph. Returns 0.0 if the
         edge does not exist in the graph.
-
-    :raises KeyError: If node identifiers in the edge are not found in the id_dict.
-    :raises ValueError: If the edge cannot be found in the graph.
     """
-
-
-    if edge[0] not in graph.vs[key] or edge[1] not in graph.vs[key]:
-        return None # If either node is not in the graph, the weight is None
-    try:
-        source = edge[0]
-        target = edge[1]
-        weight = graph.es.find(_between=((id_dict[source],), (id_dict[target],)))['weight']
-    except (KeyError, ValueError):
-        weight = 0.0  # If nodes are in the graph but not connected, the weight between them is 0
-
+    if id_dict is not None:
+        warnings.warn("id_dict is ignored, the node indices are taken from the graph index.",
+                      DeprecationWarning, stacklevel=2)
+    if index is None:
+        index = get_graph_index(graph, key=key)
+
+    # None if either node is not in the graph, 0.0 if they are in the graph but not connected
+    weight = index.edge_weight(edge[0], edge[1])
+    if weight is None:
+        return None
+
+    if adjustments is not None:
+        return float(index.adjust_weights(np.array([weight], dtype=np.float64),
+                                          index.node_ids([edge[0]]), index.node_ids([edge[1]]),
+                                          transform, age_adjustment, degree_adjustment,
+                                          adjustments)[0])
+    return _adjust_edge_weight(graph, edge, weight, transform, age_adjustment, degree_adjustment, index)
+
+def _adjust_edge_weight(graph: igraph.Graph,
+                        edge: tuple,
+                        weight: float,
+                        transform: Optional[str],
+                        age_adjustment: bool,
+                        degree_adjustment: bool,
+                        index: GraphIndex) -> float:
+    """Transforms and adjusts the looked up weight of an edge, see get_graph_edge_weight."""
     # Transform
     if transform:
         weight = transform_weight(weight=weight, transform = transform)
 
     # Adjust
     if age_adjustment:
-        weight = age_adjust_weight(edge=edge, weight=weight, graph=graph)
+        weight = age_adjust_weight(edge=edge, weight=weight, graph=graph, index=index)
     if degree_adjustment:
-        weight = degree_adjust_weight(edge=edge, weight=weight, graph=graph, id_dict=id_dict)
+        weight = degree_adjust_weight(edge=edge, weight=weight, graph=graph, index=index)
 
     return float(weight)
 
@@ -133,7 +489,9 @@ def tool_average_sum(graph: igraph.Graph,
                      transform: Optional[str] = None,
                      age_adjustment: bool = False,
                      degree_adjustment: bool = False,
-                     workflow_lvl_metric:str="workflow_average") -> float:
+                     workflow_lvl_metric:str="workflow_average",
+                     index: Optional[GraphIndex] = None,
+                     adjustments: Optional[Pipeline] = None) -> float:
     """
     Calculates the sum or average of edge weights per tool within a workflow.
 
@@ -147,6 +505,13 @@ def tool_average_sum(graph: igraph.Graph,
         age of the nodes. Default is False.
     :param degree_adjustment: Boolean indicating whether to adjust edge weights based on
         the degree of the nodes. Default is False.
+    :param workflow_lvl_metric: The workflow-level metric, "workflow_average" or
+        "complete_average", whose desirability the step scores are multiplied with. The
+        workflow_average is computed from the unadjusted weights of the workflow edges.
+    :param index: Optional GraphIndex of the graph. By default the cached index of the
+        graph is used, see get_graph_index.
+    :param adjustments: Optional pubmetric.adjustments.Pipeline applied to the edge weights
+        instead of the transform, age_adjustment and degree_adjustment options.
 
     :return: Dictionary where keys are workflow steps and values are the aggregated metric
         scores for each step.
@@ -154,68 +519,71 @@ def tool_average_sum(graph: igraph.Graph,
     :raises ValueError: If the workflow is empty or if an invalid aggregation method is provided.
     """
 
-    if workflow_lvl_metric == 'workflow_average':
-        workflow_score = workflow_average(graph=graph, workflow=workflow)
-    else:
-        workflow_score = complete_average(graph=graph, workflow=workflow)
-
-    workflow_desirability = calculate_desirability(score=workflow_score, thresholds=[0, 400])
+    if index is None:
+        index = get_graph_index(graph)
 
     steps = list(workflow['steps'].keys())
     edges = workflow['edges']
 
     if not edges: # If it is an empty workflow
         return {}
+
+    # Every edge is resolved and weighed once, the unadjusted weights give the workflow_average
+    raw_weights = []
+    edge_weights = []
+    for source, target in edges:
+        edge = (workflow['steps'][source], workflow['steps'][target])
+        weight = index.edge_weight(edge[0], edge[1])
+        if weight is None:
+            raw_weights.append(0.0)
+            edge_weights.append(0.0)
+            continue
+        raw_weights.append(float(weight))
+        if adjustments is None:
+            edge_weights.append(_adjust_edge_weight(graph, edge, weight, transform, age_adjustment,
+                                                    degree_adjustment, index) or 0.0)
+    if adjustments is not None: # the pipeline adjusts all weights of the workflow at once
+        sources = index.node_ids([workflow['steps'][source] for source, _ in edges])
+        targets = index.node_ids([workflow['steps'][target] for _, target in edges])
+        edge_weights = index.edge_weights(sources, targets, transform, age_adjustment,
+                                          degree_adjustment, adjustments).tolist()
+
+    if workflow_lvl_metric == 'workflow_average':
+        workflow_score = round(float(sum(raw_weights)/len(edges)), 2)
+    else:
+        workflow_score = complete_average(graph=graph, workflow=workflow, index=index)
+
+    workflow_desirability = calculate_desirability(score=workflow_score, thresholds=[0, 400])
+
     if len(edges) == 1:
         return {steps[0]: 1*workflow_desirability, steps[1]:1*workflow_desirability}
 
-    id_dict = get_node_ids(graph)
+    # Sums and counts of the weights of the edges of every step, in edge order
+    step_sums = dict.fromkeys(steps, 0)
+    step_counts = dict.fromkeys(steps, 0)
+    for (source, target), weight in zip(edges, edge_weights):
+        for step in dict.fromkeys((source, target)):
+            step_sums[step] += weight
+            step_counts[step] += 1
+
+    if aggregation_method == "product" and any(step_counts.values()):
+        return 0.0  # returned as soon as a step has weights
 
     step_scores = {}
     for step in steps:
-        score = []
-        for edge in edges:
-            if step in edge:
-                pmid_source = next(
-                    pmid
-                    for step_id, pmid in workflow['steps'].items()
-                    if step_id == edge[0]
-                )
-
-                pmid_target = next(
-                    pmid
-                    for step_id, pmid in workflow['steps'].items()
-                    if step_id == edge[1]
-                )
-                edge = (pmid_source, pmid_target)
-                weight = get_graph_edge_weight(
-                            graph=graph,
-                            edge=edge,
-                            id_dict=id_dict,
-                            transform=transform,
-                            age_adjustment=age_adjustment,
-                            degree_adjustment=degree_adjustment
-                        ) or 0.0
-
-                score.append(weight)
-        if score:
-            if aggregation_method == "sum":
-                step_scores[step] = round(float(sum(score)/len(score))*workflow_desirability, 2)
-            if aggregation_method == "product":
-                nonzero_scores = [w for w in score if w!=0]  #only use nonzero weights
-                if nonzero_scores:
-                    step_scores[step] = round(
-                        float(np.prod(nonzero_scores) / len(score)) * workflow_desirability,
-                        2
-                    )
-                return 0.0  # If there are no weights
+        if step_counts[step]:
+            step_scores[step] = round(float(step_sums[step]/step_counts[step])*workflow_desirability, 2)
         else:
             step_scores[step] = 0
 
     return step_scores
 
 # Workflow level metrics
-def shortest_path(graph: igraph.Graph, workflow: list, weighted: bool = True) -> dict:
+def shortest_path(graph: igraph.Graph,
+                  workflow: list,
+                  weighted: bool = True,
+                  index: Optional[GraphIndex] = None,
+                  distance_index: Optional[DistanceIndex] = None) -> dict:
     """
     Computes shortest paths between each pair of nodes that have an edge in the workflow.
 
@@ -223,13 +591,18 @@ def shortest_path(graph: igraph.Graph, workflow: list, weighted: bool = True) ->
     :param workflow: List of edges (tuples of tool PmIDs) representing the workflow.
     :param weighted: Boolean indicating whether to compute weighted shortest paths
         (True) or unweighted (False).
+    :param index: Optional GraphIndex of the graph. By default the cached index of the
+        graph is used, see get_graph_index.
+    :param distance_index: Optional DistanceIndex of the graph, which must match weighted.
+        By default the cached index of the graph is used, see get_distance_index.
 
     :return: Dictionary where keys are node pairs and values are shortest path distances.
     """
     if not workflow:
         return 0
 
-    id_dict = get_node_ids(graph)
+    id_dict = (index or get_graph_index(graph)).ids
+    distance_index = distance_index or get_distance_index(graph, weighted=weighted)
 
     distances = []
 
@@ -243,14 +616,7 @@ def shortest_path(graph: igraph.Graph, workflow: list, weighted: bool = True) ->
             distances.append(10)
             continue
 
-        if weighted:
-            path_length = graph.get_shortest_paths(u_index,
-                                                   to=v_index,
-                                                   weights=graph.es["inverted_weight"],
-                                                   output="epath") or 10
-        else:
-            path_length = graph.get_shortest_paths(u_index, to=v_index, output="epath")
-        distances.append(len(path_length[0]))
+        distances.append(distance_index.path_length(u_index, v_index))
 
     avg_distance = sum(distances)/len(workflow)
     return 1/avg_distance if avg_distance != 0 else 0
@@ -260,7 +626,9 @@ def workflow_average(graph: igraph.Graph,
                      aggregation_method: str = "sum",
                      transform: Optional[str] = None,
                      age_adjustment: bool = False,
-                     degree_adjustment: bool = False) -> float:
+                     degree_adjustment: bool = False,
+                     index: Optional[GraphIndex] = None,
+                     adjustments: Optional[Pipeline] = None) -> float:
     """
     Calculates the sum or average of edge weights within a workflow.
 
@@ -275,6 +643,10 @@ def workflow_average(graph: igraph.Graph,
         the nodes. Default is False.
     :param degree_adjustment: Boolean indicating whether to adjust edge weights based on the degree
         of the nodes. Default is False.
+    :param index: Optional GraphIndex of the graph. By default the cached index of the
+        graph is used, see get_graph_index.
+    :param adjustments: Optional pubmetric.adjustments.Pipeline applied to the edge weights
+        instead of the transform, age_adjustment and degree_adjustment options.
 
     :return: Float value representing the average or aggregated sum of edge weights within the
         workflow. 
@@ -287,20 +659,26 @@ def workflow_average(graph: igraph.Graph,
     if isinstance(workflow, dict):
         workflow = workflow['pmid_edges']
 
-    # Get a mapping to the igraph ids
-    id_dict = get_node_ids(graph)
+    if index is None:
+        index = get_graph_index(graph)
 
-    aggregated_weight = []
-    for edge in workflow:
-        weight = get_graph_edge_weight(
-                    graph=graph,
-                    edge=edge,
-                    id_dict=id_dict,
-                    transform=transform,
-                    age_adjustment=age_adjustment,
-                    degree_adjustment=degree_adjustment
-                ) or 0.0  
-        aggregated_weight.append(weight)
+    if adjustments is not None: # the pipeline adjusts all weights of the workflow at once
+        aggregated_weight = index.edge_weights(index.node_ids([edge[0] for edge in workflow]),
+                                               index.node_ids([edge[1] for edge in workflow]),
+                                               transform, age_adjustment, degree_adjustment,
+                                               adjustments).tolist()
+    else:
+        aggregated_weight = []
+        for edge in workflow:
+            weight = get_graph_edge_weight(
+                        graph=graph,
+                        edge=edge,
+                        transform=transform,
+                        age_adjustment=age_adjustment,
+                        degree_adjustment=degree_adjustment,
+                        index=index
+                    ) or 0.0
+            aggregated_weight.append(weight)
 
     if aggregation_method == "sum":
         return round(float(sum(aggregated_weight)/len(workflow)), 2)
@@ -317,7 +695,9 @@ def complete_average(graph: igraph.Graph,
                     aggregation_method: str = "sum",
                     transform: Optional[str] = None,
                     age_adjustment: bool = False,
-                    degree_adjustment: bool = False) -> float:
+                    degree_adjustment: bool = False,
+                    index: Optional[GraphIndex] = None,
+                    adjustments: Optional[Pipeline] = None) -> float:
     # obs the repeated workflows will have a disadvantage because there is no edge between them which defaults to 0. This must be adjusted for in the devision of edges! TODO
     """
     Calculates the sum of the edge weights between all possible pairs of tools in a workflow.
@@ -334,6 +714,10 @@ def complete_average(graph: igraph.Graph,
         the nodes. Default is False.
     :param degree_adjustment: Boolean indicating whether to adjust edge weights based on the degree
         of the nodes. Default is False.
+    :param index: Optional GraphIndex of the graph. By default the cached index of the
+        graph is used, see get_graph_index.
+    :param adjustments: Optional pubmetric.adjustments.Pipeline applied to the edge weights
+        instead of the transform, age_adjustment and degree_adjustment options.
 
     :return: Float value representing the average or aggregated sum of edge weights within the
         workflow. 
@@ -343,46 +727,34 @@ def complete_average(graph: igraph.Graph,
     if isinstance(workflow, dict):
         step_names = list(workflow['steps'].keys())
         edges = workflow['edges']
+        pmids = [workflow['steps'][step] for step in step_names]
     elif isinstance(workflow, list):
         step_names = list(set(element for tup in workflow for element in tup))
         edges = workflow
+        pmids = step_names
 
-    nr_steps = len(step_names)
     nr_edges = len(edges)
     if nr_edges <1: # if there is only one tool there can be no edges
         return 0.0
-    workflow_graph =  igraph.Graph.TupleList(edges, directed=False, weights=False)
-    workflow_id_dict = get_node_ids(workflow_graph, key='name')
-    full_graph_id_dict = get_node_ids(graph)
-    
-    aggregated_weight = []
-    for i in range( nr_steps ):
-        for j in range(i + 1, nr_steps ):
-            if isinstance(workflow, dict):
-                edge = (workflow['steps'][step_names[i]], workflow['steps'][step_names[j]])
-            else:
-                edge = (step_names[i], step_names[j])
-            weight = get_graph_edge_weight(
-                graph=graph,
-                edge=edge,
-                id_dict=full_graph_id_dict,
-                transform=transform,
-                age_adjustment=age_adjustment,
-                degree_adjustment=degree_adjustment
-            ) or 0.0
-            u_index = workflow_id_dict.get(step_names[i], None)
-            v_index = workflow_id_dict.get(step_names[j], None)
-            
-            path = workflow_graph.get_shortest_paths(u_index, to=v_index, output="epath") or None # if there is none then sth is wrong
-            path_length= len(path[0])
-            normalised_weight = weight / factor**(float(path_length)-1) if path_length else 0
-            aggregated_weight.append(normalised_weight)
+    if index is None:
+        index = get_graph_index(graph)
+
+    # all pairs of steps, their weights gathered at once and normalised by their distance in the workflow
+    first, second = pair_positions(len(step_names))
+    step_ids = index.node_ids(pmids)
+    weights = index.edge_weights(step_ids[first], step_ids[second],
+                                 transform=transform,
+                                 age_adjustment=age_adjustment,
+                                 degree_adjustment=degree_adjustment,
+                                 adjustments=adjustments)
+    path_lengths = _hop_distances(step_names, edges)[first, second]
+    aggregated_weight = _normalise_by_path_length(weights, path_lengths, factor)
 
     if aggregation_method == "sum":
-        return round(float(sum(aggregated_weight)/nr_edges), 2)
+        return round(float(sum(aggregated_weight.tolist())/nr_edges), 2)
     if aggregation_method == "product":
-        nonzero_weights = [w for w in aggregated_weight if w!=0]  #only use nonzero weights
-        if nonzero_weights:
+        nonzero_weights = aggregated_weight[aggregated_weight != 0]  #only use nonzero weights
+        if len(nonzero_weights):
             score =  np.prod(nonzero_weights) /nr_edges
             return round(float(score), 2)
         return 0.0  # If there are no weights
@@ -405,18 +777,30 @@ def transform_weight(weight: int, transform: str) -> float:
     else:
         raise ValueError("Invalid transformation option")
 
-def degree_adjust_weight(edge: tuple, weight, graph: igraph.Graph, id_dict: dict) -> float:
+def degree_adjust_weight(edge: tuple,
+                         weight,
+                         graph: igraph.Graph,
+                         id_dict: Optional[dict] = None,
+                         index: Optional[GraphIndex] = None) -> float:
     """
     Adjusts the weight of an edge based on the average degree of its connected nodes.
 
     :param edge: Tuple representing the edge (source, target).
     :param weight: Float value of the initial weight of the edge.
     :param graph: An igraph.Graph object representing the graph.
-    :param id_dict: Dictionary mapping node identifiers to their indices in the graph.
+    :param id_dict: Optional dictionary mapping node identifiers to their indices in the graph.
+        By default the node indices are taken from the graph index.
+    :param index: Optional GraphIndex of the graph. By default the cached index of the
+        graph is used, see get_graph_index.
     :return: Weight adjusted by the average degree of the connected nodes.
     """
-    source_degree = graph.vs[id_dict[edge[0]]].degree()
-    target_degree = graph.vs[id_dict[edge[1]]].degree()
+    if id_dict is not None:
+        source_degree = graph.vs[id_dict[edge[0]]].degree()
+        target_degree = graph.vs[id_dict[edge[1]]].degree()
+    else:
+        index = index or get_graph_index(graph)
+        source_degree = index.degree(edge[0])
+        target_degree = index.degree(edge[1])
 
     min_degree = max(1, min([source_degree, target_degree]))
     return weight / min_degree
@@ -425,7 +809,8 @@ def age_adjust_weight(edge: tuple,
                       weight: float,
                       graph: igraph.Graph,
                       default_age = 10,
-                      key: str = 'pmid') -> float:
+                      key: str = 'pmid',
+                      index: Optional[GraphIndex] = None) -> float:
     """
     Adjusts the weight of an edge based on the age of its connected nodes.
 
@@ -436,11 +821,13 @@ def age_adjust_weight(edge: tuple,
         is not found. Default is 10.
     :param key: String specifying the attribute key to look up node age in the graph.
         Default is 'pmid'.
+    :param index: Optional GraphIndex of the graph. By default the cached index of the
+        graph is used, see get_graph_index.
     :return: Weight adjusted by the minimum age of the connected nodes.
     """
-
-    source_age = next((vs['age'] for vs in graph.vs if vs[key] == edge[0]), default_age)
-    target_age = next((vs['age'] for vs in graph.vs if vs[key] == edge[1]), default_age)
+    index = index or get_graph_index(graph, key=key)
+    source_age = index.age(edge[0], default_age)
+    target_age = index.age(edge[1], default_age)
     min_age = max(1, min([source_age, target_age]))
     return weight / min_age
 
@@ -448,7 +835,8 @@ def citation_adjusted_weight(edge: tuple,
                             weight: float,
                             graph: igraph.Graph,
                             default_nr_citations = 100,
-                            key: str = 'pmid') -> float:
+                            key: str = 'pmid',
+                            index: Optional[GraphIndex] = None) -> float:
     """
     Adjusts the weight of an edge based on the number of citations of its connected nodes.
 
@@ -459,17 +847,13 @@ def citation_adjusted_weight(edge: tuple,
         to use if node citation count is not found. Default is 100.
     :param key: String specifying the attribute key to look up node citation count in the
         graph. Default is 'pmid'.
+    :param index: Optional GraphIndex of the graph. By default the cached index of the
+        graph is used, see get_graph_index.
     :return: Weight adjusted by the minimum citation count of the connected nodes.
     """
-
-    source_citations = next((vs['nr_citations']
-                             for vs in graph.vs
-                             if vs[key] == edge[0]),
-                             default_nr_citations)
-    target_citations = next((vs['nr_citations']
-                             for vs in graph.vs
-                             if vs[key] == edge[1]),
-                             default_nr_citations)
+    index = index or get_graph_index(graph, key=key)
+    source_citations = index.citations(edge[0], default_nr_citations)
+    target_citations = index.citations(edge[1], default_nr_citations)
 
     min_citations = max(1, min([source_citations, target_citations]))
 
@@ -477,7 +861,8 @@ def citation_adjusted_weight(edge: tuple,
 
 def median_citations(graph: igraph.Graph,
                      workflow:Union[dict,list],
-                     default_nr_citations: int = 0) -> int:
+                     default_nr_citations: int = 0,
+                     index: Optional[GraphIndex] = None) -> int:
     """
     Simply returns the median number citations of all of the primary publications 
         of tools in the workflow.
@@ -486,6 +871,8 @@ def median_citations(graph: igraph.Graph,
     :param workflow: List of edges (tuples of tool PmIDs) representing the workflow.
     :param default_nr_citations: An int representing the value one would like to use 
         for tools that dont have a recorded citation number. 
+    :param index: Optional GraphIndex of the graph. By default the cached index of the
+        graph is used, see get_graph_index.
 
     :return: Integer value of the median number of citations.
     
@@ -502,14 +889,284 @@ def median_citations(graph: igraph.Graph,
     if len(pmids)==0:
         return 0
 
+    index = index or get_graph_index(graph)
     for pmid in pmids:
-        citation_number = next((vs['nr_citations']
-                                for vs in graph.vs
-                                if vs['pmid'] == pmid),
-                                default_nr_citations)
+        citation_number = index.citations(pmid, default_nr_citations)
         if citation_number:
             total_citations.append(citation_number)
 
     if total_citations:
         return statistics.median(total_citations)
     return None
+
+
+# Batch scoring
+
+@functools.lru_cache(maxsize=128)
+def pair_positions(length: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Positions (i, j), i < j, of all pairs of a sequence of the given length. Also used to
+    count the co-citations of a citing paper, see pubmetric.network.process_chunk.
+    """
+    return np.triu_indices(length, k=1)
+
+def _hop_distances(step_names: list, edges: list) -> np.ndarray:
+    """
+    Number of edges on the shortest path between every pair of steps in a workflow,
+    treating the edges as undirected. Unreachable pairs are 0, like the empty path
+    found by igraph. All steps are searched from at once, one matrix product per level
+    of the breadth-first search.
+    """
+    step_ids = {step: i for i, step in enumerate(step_names)}
+    nr_steps = len(step_names)
+    adjacency = np.zeros((nr_steps, nr_steps), dtype=np.float32) # float, so the product uses BLAS
+    if edges:
+        sources = [step_ids[source] for source, _ in edges]
+        targets = [step_ids[target] for _, target in edges]
+        adjacency[sources, targets] = 1
+        adjacency[targets, sources] = 1
+
+    distances = np.zeros((nr_steps, nr_steps), dtype=np.int64)
+    reached = np.eye(nr_steps, dtype=bool)
+    frontier = reached
+    distance = 0
+    while frontier.any():
+        distance += 1
+        frontier = (frontier.astype(np.float32) @ adjacency > 0) & ~reached
+        distances[frontier] = distance
+        reached = reached | frontier
+    return distances
+
+def _normalise_by_path_length(weights: np.ndarray, path_lengths: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Divides the weights of the step pairs of complete_average by factor**(path length - 1),
+    setting the weights of pairs that are not connected in the workflow to 0.
+    """
+    path_lengths = path_lengths.astype(np.float64)
+    connected = path_lengths > 0
+    normalised = np.zeros(len(weights), dtype=np.float64)
+    normalised[connected] = weights[connected] / float(factor) ** (path_lengths[connected] - 1)
+    return normalised
+
+def _aggregate(values: np.ndarray,
+               owners: np.ndarray,
+               divisors: list,
+               aggregation_method: str) -> list:
+    """
+    Aggregates the values of every workflow like the per-workflow metrics: the sum or the
+    product of the nonzero values, divided by the divisor of the workflow and rounded.
+    Workflows with a divisor of 0 score 0.0.
+    """
+    if aggregation_method == "sum":
+        # bincount adds the values in order, like the built-in sum
+        totals = np.bincount(owners, weights=values, minlength=len(divisors))
+        return [round(float(total / divisor), 2) if divisor else 0.0
+                for total, divisor in zip(totals, divisors)]
+    if aggregation_method == "product":
+        bounds = np.searchsorted(owners, np.arange(len(divisors) + 1))
+        scores = []
+        for i, divisor in enumerate(divisors):
+            workflow_values = values[bounds[i]:bounds[i + 1]]
+            nonzero_values = workflow_values[workflow_values != 0]
+            scores.append(round(float(np.prod(nonzero_values) / divisor), 2)
+                          if divisor and len(nonzero_values) else 0.0)
+        return scores
+    raise ValueError(f"Invalid aggregation method: {aggregation_method}")
+
+def _batch_workflow_average(index: GraphIndex,
+                            workflows: list,
+                            aggregation_method: str = "sum",
+                            adjustments: Optional[Pipeline] = None) -> list:
+    """workflow_average for a list of workflows, with all edge weights gathered at once."""
+    pmid_edges = [workflow['pmid_edges'] if isinstance(workflow, dict) else workflow
+                  for workflow in workflows]
+    owners = np.repeat(np.arange(len(workflows)), [len(edges) for edges in pmid_edges])
+    sources = index.node_ids([edge[0] for edges in pmid_edges for edge in edges])
+    targets = index.node_ids([edge[1] for edges in pmid_edges for edge in edges])
+    weights = index.edge_weights(sources, targets, adjustments=adjustments)
+    return _aggregate(weights, owners, [len(edges) for edges in pmid_edges], aggregation_method)
+
+def _batch_complete_average(index: GraphIndex,
+                            workflows: list,
+                            factor: int = 4,
+                            aggregation_method: str = "sum",
+                            adjustments: Optional[Pipeline] = None) -> list:
+    """complete_average for a list of workflows, with all pair weights gathered at once."""
+    step_pmids = []
+    step_pairs = ([], [])
+    normalisations = []
+    owners = []
+    nr_edges = []
+    for i, workflow in enumerate(workflows):
+        if isinstance(workflow, dict):
+            step_names = list(workflow['steps'].keys())
+            edges = workflow['edges']
+            pmids = [workflow['steps'][step] for step in step_names]
+        else:
+            step_names = list(set(element for tup in workflow for element in tup))
+            edges = workflow
+            pmids = step_names
+        nr_edges.append(len(edges))
+        if not edges:
+            continue
+        distances = _hop_distances(step_names, edges)
+        first, second = pair_positions(len(step_names))
+        step_pairs[0].append(first + len(step_pmids))
+        step_pairs[1].append(second + len(step_pmids))
+        step_pmids.extend(pmids)
+        normalisations.append(distances[first, second])
+        owners.append(np.full(len(first), i))
+
+    if not owners:
+        return [0.0] * len(workflows)
+    step_ids = index.node_ids(step_pmids)
+    weights = index.edge_weights(step_ids[np.concatenate(step_pairs[0])],
+                                 step_ids[np.concatenate(step_pairs[1])],
+                                 adjustments=adjustments)
+    weights = _normalise_by_path_length(weights, np.concatenate(normalisations), factor)
+    return _aggregate(weights, np.concatenate(owners), nr_edges, aggregation_method)
+
+def _batch_tool_average_sum(index: GraphIndex,
+                            workflows: list,
+                            workflow_scores: Optional[list] = None,
+                            aggregation_method: str = "sum",
+                            adjustments: Optional[Pipeline] = None) -> list:
+    """
+    tool_average_sum for a list of workflows. Every workflow edge is resolved and weighed
+    once, and the weights are summed per step through an incidence array of (step, edge)
+    entries. If no workflow-level scores are given, the workflow_average of every workflow
+    is computed from the same, unadjusted, weights.
+    """
+    step_owners, edge_owners, edge_workflows = [], [], []
+    edge_pmids = ([], [])
+    for i, workflow in enumerate(workflows):
+        step_ids = {step: j for j, step in enumerate(workflow['steps'])}
+        for source, target in workflow['edges']:
+            edge_pmids[0].append(workflow['steps'][source])
+            edge_pmids[1].append(workflow['steps'][target])
+            edge_workflows.append(i)
+            # in edge order per step, so the sums are added in the same order as a loop over the edges
+            for step in dict.fromkeys((source, target)):
+                step_owners.append((i, step_ids[step]))
+                edge_owners.append(len(edge_pmids[0]) - 1)
+
+    sources, targets = index.node_ids(edge_pmids[0]), index.node_ids(edge_pmids[1])
+    weights = index.edge_weights(sources, targets)
+    if workflow_scores is None:
+        workflow_scores = _aggregate(weights, np.array(edge_workflows, dtype=np.int64),
+                                     [len(workflow['edges']) for workflow in workflows], "sum")
+    if adjustments:
+        found = (sources >= 0) & (targets >= 0)
+        weights = weights.copy()
+        weights[found] = adjustments(weights[found], sources[found], targets[found], index)
+
+    step_offsets = np.cumsum([0] + [len(workflow['steps']) for workflow in workflows])
+    flat_steps = np.array([step_offsets[i] + j for i, j in step_owners], dtype=np.int64)
+    step_weights = weights[np.array(edge_owners, dtype=np.int64)]
+    totals = np.bincount(flat_steps, weights=step_weights, minlength=step_offsets[-1])
+    counts = np.bincount(flat_steps, minlength=step_offsets[-1])
+
+    all_step_scores = []
+    for i, (workflow, workflow_score) in enumerate(zip(workflows, workflow_scores)):
+        workflow_desirability = calculate_desirability(score=workflow_score, thresholds=[0, 400])
+        steps = list(workflow['steps'].keys())
+        edges = workflow['edges']
+        step_counts = counts[step_offsets[i]:step_offsets[i + 1]]
+        if not edges:
+            all_step_scores.append({})
+        elif len(edges) == 1:
+            all_step_scores.append({steps[0]: 1*workflow_desirability,
+                                    steps[1]: 1*workflow_desirability})
+        elif aggregation_method == "product" and step_counts.any():
+            all_step_scores.append(0.0) # returned as soon as a step has weights
+        else:
+            all_step_scores.append({
+                step: round(float(totals[step_offsets[i] + j] / counts[step_offsets[i] + j])
+                            * workflow_desirability, 2)
+                      if counts[step_offsets[i] + j] else 0
+                for j, step in enumerate(steps)})
+    return all_step_scores
+
+def score_workflows_batch(graph: igraph.Graph,
+                          workflows: Union[list, dict],
+                          metrics: Tuple[str, ...] = ("workflow_average",
+                                                      "complete_average",
+                                                      "tool_average_sum"),
+                          aggregation_method: str = "sum",
+                          transform: Optional[str] = None,
+                          age_adjustment: bool = False,
+                          degree_adjustment: bool = False,
+                          factor: int = 4,
+                          workflow_lvl_metric: str = "workflow_average",
+                          index: Optional[GraphIndex] = None,
+                          adjustments: Optional[Pipeline] = None) -> pd.DataFrame:
+    """
+    Scores many workflows at once. The PMID pairs of all workflows are resolved to igraph IDs
+    in one pass, and their weights are gathered and adjusted as arrays, instead of one edge
+    at a time. The scores are the same as those of the per-workflow metric functions.
+
+    :param graph: igraph.Graph object representing a co-citation graph.
+    :param workflows: List of workflows, or dictionary mapping workflow names to workflows.
+        Workflows are lists of edges (tuples of tool PMIDs) or dictionaries with 'steps',
+        'edges' and 'pmid_edges' keys, as created by pubmetric.workflow.parse_cwl.
+    :param metrics: The metrics to calculate, any of "workflow_average", "complete_average"
+        and "tool_average_sum". Default is all three.
+    :param aggregation_method: String specifying the method for aggregating edge weights.
+        Options are "sum" or "product". Default is "sum".
+    :param transform: Optional string specifying a transformation to apply to edge weights
+        (e.g., "log" or "sqrt"). Default is None.
+    :param age_adjustment: Boolean indicating whether to adjust edge weights based on the age of
+        the nodes. Default is False.
+    :param degree_adjustment: Boolean indicating whether to adjust edge weights based on the degree
+        of the nodes. Default is False.
+    :param factor: The factor of complete_average. Default is 4.
+    :param workflow_lvl_metric: The workflow-level metric used for the desirability factor of
+        tool_average_sum. Default is "workflow_average".
+    :param index: Optional GraphIndex of the graph. By default the cached index of the
+        graph is used, see get_graph_index.
+    :param adjustments: Optional pubmetric.adjustments.Pipeline applied to the edge weights
+        instead of the transform, age_adjustment and degree_adjustment options.
+
+    :raises ValueError: If an unknown metric or aggregation method is given, or both an
+        adjustment pipeline and adjustment options.
+    :raises TypeError: If tool_average_sum is requested for workflows that are not dictionaries.
+
+    :return: DataFrame with one row per workflow, indexed by the workflow names or positions,
+        and one column per metric. The tool_average_sum column holds the dictionaries of the
+        tool-level scores. Workflows without edges score 0.0.
+    """
+    unknown_metrics = set(metrics) - {"workflow_average", "complete_average", "tool_average_sum"}
+    if unknown_metrics:
+        raise ValueError(f"Unknown metrics: {sorted(unknown_metrics)}")
+    if aggregation_method not in ("sum", "product"):
+        raise ValueError(f"Invalid aggregation method: {aggregation_method}")
+
+    names = list(workflows.keys()) if isinstance(workflows, dict) else range(len(workflows))
+    workflows = list(workflows.values()) if isinstance(workflows, dict) else list(workflows)
+    if index is None:
+        index = get_graph_index(graph)
+    adjustments = as_pipeline(adjustments, transform, age_adjustment, degree_adjustment)
+
+    scores = {}
+    if "workflow_average" in metrics:
+        scores["workflow_average"] = _batch_workflow_average(index, workflows,
+                                                             aggregation_method, adjustments)
+    if "complete_average" in metrics:
+        scores["complete_average"] = _batch_complete_average(index, workflows, factor,
+                                                             aggregation_method, adjustments)
+    if "tool_average_sum" in metrics:
+        if not all(isinstance(workflow, dict) for workflow in workflows):
+            raise TypeError("tool_average_sum requires workflow dictionaries.")
+        # tool_average_sum weighs by the unadjusted workflow-level metric, the workflow_average
+        # is computed from the weights of the tool-level scores
+        if workflow_lvl_metric == "workflow_average":
+            workflow_scores = None
+        else:
+            workflow_scores = (scores["complete_average"]
+                               if "complete_average" in scores and aggregation_method == "sum"
+                               and not adjustments and factor == 4
+                               else _batch_complete_average(index, workflows))
+        scores["tool_average_sum"] = _batch_tool_average_sum(index, workflows, workflow_scores,
+                                                             aggregation_method, adjustments)
+
+    return pd.DataFrame({metric: scores[metric] for metric in metrics}, index=names)
@@ -2,50 +2,109 @@
 Bibliographic graph creation
 """
 import os
+import re
 import sys
+import copy
 import math
 import json
+import glob
 import pickle
-from datetime import datetime
+from datetime import datetime, timedelta
 from collections import defaultdict
-from typing import Optional, Union
+from typing import Optional, Tuple, Union
 import itertools
 from multiprocessing import Pool
 
+import aiohttp
 import igraph
+import numpy as np
+import scipy.sparse
 from tqdm import tqdm
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.getcwd(), 'src'))) #TODO this should not be necessary
 import pubmetric.data
 import pubmetric.log
+import pubmetric.metrics
+from pubmetric.cache import ResponseCache
+from pubmetric.metrics import pair_positions
+from pubmetric.ratelimit import HostRateLimiter
+from pubmetric.exceptions import GraphVerificationError, DownloadError
 
-def add_graph_attributes(graph: igraph.Graph, metadata_file: dict):
+CITATIONS_FILENAME = 'tool_citations.json'
+GRAPH_DIRNAME = 'graph'
+GRAPH_FORMAT_VERSION = 1
+
+def inverted_weights(graph: igraph.Graph) -> list:
+    """
+    Computes the inverse of the edge weights, used as distances in weighted shortest paths.
+
+    :param graph: igraph.Graph with a 'weight' edge attribute.
+
+    :return: List of 1/weight per edge, inf for edges of weight 0.
+    """
+    weights = np.asarray(graph.es['weight'], dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        return (1.0 / weights).tolist()
+
+# Attributes derived from the graph itself, which can be added when needed
+COMPUTED_ATTRIBUTES = {
+    'inverted_weight': ('edge', inverted_weights),
+    'degree': ('vertex', lambda graph: graph.degree()) # for compatibility with cytoscape, and to
+                                                       # retain full graph stats even if a
+                                                       # subgraph is extracted
+}
+
+def ensure_attributes(graph: igraph.Graph, attributes: Optional[list] = None) -> igraph.Graph:
+    """
+    Adds the computed attributes (see COMPUTED_ATTRIBUTES) that the graph does not have yet.
+
+    :param graph: The co-citation igraph.Graph.
+    :param attributes: Optional list of the computed attributes to add. Default is all of them.
+
+    :return: The graph, updated in place.
+    """
+    for attribute in attributes or COMPUTED_ATTRIBUTES:
+        kind, compute = COMPUTED_ATTRIBUTES[attribute]
+        sequence = graph.vs if kind == 'vertex' else graph.es
+        if attribute not in sequence.attributes():
+            sequence[attribute] = compute(graph)
+    return graph
+
+def add_graph_attributes(graph: igraph.Graph, metadata_file: dict, lazy: bool = False):
     """
-    Adds attributes to the vertices and edges of the graph using metadata.
+    Adds attributes to the vertices and edges of the graph using metadata. The metadata of
+    the tools is looked up by PMID in a dictionary, and every attribute is assigned as a
+    whole column.
 
     :param graph: The co-citation igraph.Graph to be updated.
     :param metadata_file: Dictionary containing metadata with a 'tools' key. # TODO ref the schema  
+    :param lazy: If True, the attributes computed from the graph itself (inverted_weight and
+        degree) are not added; use ensure_attributes to add them when they are needed.
+
+    :raises KeyError: If a vertex has no metadata.
 
     :return: The updated co-citaiton igraph.Graph with added vertex and edge attributes.
     """
+    tools = {}
+    for tool in metadata_file['tools']:
+        tools.setdefault(tool['pmid'], tool) # the first tool with a PMID, as in the metadata order
 
-    for edge in graph.es:
-        current_weight = edge["weight"]
-        inverted_weight = 1.0 / current_weight if current_weight != 0 else float('inf')
-        edge["inverted_weight"] = inverted_weight
+    pmids = graph.vs['name'] if graph.vcount() else []
+    try:
+        vertex_tools = [tools[pmid] for pmid in pmids]
+    except KeyError as e:
+        raise KeyError(f"No metadata for vertex with PMID {e.args[0]}.") from e
 
-    for vertex in graph.vs:
-        pmid = vertex["name"]
-        tool_metadata = next((tmd for tmd in metadata_file['tools'] if tmd['pmid'] == pmid))
+    current_year = datetime.now().year
+    graph.vs['pmid'] = pmids
+    graph.vs['name'] = [tool['name'] for tool in vertex_tools] # changing name to name
+    # igraph requires that all arguments are of same type so we use 50 as none
+    graph.vs['age'] = [current_year - int(tool.get('publication_date') or 50)
+                       for tool in vertex_tools]
+    graph.vs['nr_citations'] = [tool['nr_citations'] for tool in vertex_tools]
 
-        vertex['pmid'] = pmid
-        vertex["name"] = tool_metadata['name']  # changing name to name
-        vertex["age"] = datetime.now().year - int(tool_metadata.get('publication_date')
-                                                  or 50) # igraph requires that all arguments are of same type so we use 50 as none 
-        vertex["nr_citations"] = tool_metadata['nr_citations']
-        vertex['degree'] = vertex.degree()  # for compatibility with cytoscape,
-                                            # and to retain full graph stats even 
-                                            # if a subgraph is extracted
+    if not lazy:
+        ensure_attributes(graph)
     return graph
 
 def create_small_cocitation_graph(paper_citations: dict) -> igraph.Graph:
@@ -74,63 +133,153 @@ def create_small_cocitation_graph(paper_citations: dict) -> igraph.Graph:
 
     return cocitation_graph
 
+def graph_from_index_pairs(sources: np.ndarray,
+                           targets: np.ndarray,
+                           weights: np.ndarray,
+                           names: np.ndarray) -> igraph.Graph:
+    """
+    Creates a weighted co-citation graph from integer edge arrays.
+
+    Only the vertices that take part in at least one edge are included, like in the
+    graphs created by igraph.Graph.TupleList.
+
+    :param sources: Array of integer ids of the first endpoint of every edge.
+    :param targets: Array of integer ids of the second endpoint of every edge.
+    :param weights: Array of co-citation counts, one per edge.
+    :param names: Array mapping the integer ids to the vertex names (PMIDs).
+
+    :return: An igraph Graph object representing the co-citation network.
+    """
+    used_ids, edge_ids = np.unique(np.concatenate((sources, targets)), return_inverse=True)
+    edges = edge_ids.reshape(2, -1).T
+
+    cocitation_graph = igraph.Graph(n=len(used_ids), edges=edges, directed=False)
+    cocitation_graph.vs["name"] = np.asarray(names)[used_ids].tolist()
+    cocitation_graph.es["weight"] = np.asarray(weights).tolist()
+
+    return cocitation_graph
+
+def create_sparse_cocitation_graph(paper_citations: dict) -> igraph.Graph:
+    """
+    Creates a co-citation graph using sparse matrix multiplication. The PMIDs of the
+    cited papers are mapped to integer ids and the citing paper x cited paper incidence
+    matrix A is assembled, so that the co-citation counts are given by the upper
+    triangle of A^T A.
+
+    :param paper_citations: Dictionary where keys are citation identifiers (PMIDs) and 
+        values are sets of papers (bio.tools tools) (PMIDs).
+
+    :return: An igraph Graph object representing the co-citation network.
+    """
+    citation_lists = [list(citations) for citations in paper_citations.values()]
+    row_lengths = np.fromiter((len(citations) for citations in citation_lists),
+                              dtype=np.int64, count=len(citation_lists))
+    if row_lengths.sum() == 0:
+        return igraph.Graph.TupleList([], directed=False, weights=True)
+
+    cited_pmids = np.fromiter(itertools.chain.from_iterable(citation_lists),
+                              dtype=object, count=int(row_lengths.sum()))
+    names, columns = np.unique(cited_pmids.astype(str), return_inverse=True)
+    rows = np.repeat(np.arange(len(citation_lists)), row_lengths)
+
+    # Duplicate entries are summed, which matches counting pairs with itertools.combinations
+    incidence = scipy.sparse.csr_matrix(
+        (np.ones(len(columns), dtype=np.int64), (rows, columns)),
+        shape=(len(citation_lists), len(names)))
+    cocitation_counts = scipy.sparse.triu(incidence.T @ incidence, k=1).tocoo()
+
+    return graph_from_index_pairs(sources=cocitation_counts.row,
+                                  targets=cocitation_counts.col,
+                                  weights=cocitation_counts.data,
+                                  names=names)
+
 def create_cocitation_graph(paper_citations: dict,
-                            num_processes: int = 2,
-                            num_chunks: int = 10) -> igraph.Graph:
+                            num_processes: Optional[int] = None,
+                            num_chunks: Optional[int] = None) -> igraph.Graph:
     """
     Creates a co-citation graph from a dictionary of paper citations by using MapReduce
-    logic (splitting the data into chunks and temporarily saving them for parallel and
-    sequential processing).
+    logic. The PMIDs are mapped to integer ids and the citations are split into chunks
+    which are counted in parallel by a single worker pool. Each worker returns sorted
+    arrays of integer pair keys and counts, which are merged with a vectorised sort and sum.
+    The time and peak memory use of each stage are logged.
 
     :param paper_citations: Dictionary where keys are citation identifiers (PMIDs) and
         values are sets of papers cited by the key paper.
-    :param num_processes: Number of parallel processes to use for processing each chunk.
-        Default is 2.
-    :param num_chunks: Number of chunks to divide the data into for sequential processing.
-        Default is 10.
+    :param num_processes: Number of worker processes used to count the chunks.
+        Defaults to the number of CPUs, os.cpu_count().
+    :param num_chunks: Number of chunks to divide the data into. Defaults to four chunks
+        per process, so that the workers stay busy when chunks differ in size.
 
-    :raises IOError: If there is an issue with reading or writing the chunk files.
     :raises ValueError: If the number of chunks or processes is less than 1.
 
     :return: An igraph Graph object representing the co-citation network.
-    """    
-    # Splitting the paper_citations dictionary into smaller chunks for sequential processing
+    """
+    if num_processes is None:
+        num_processes = os.cpu_count() or 1
+    if num_chunks is None:
+        num_chunks = 4 * num_processes
+    if num_processes < 1 or num_chunks < 1:
+        raise ValueError("The number of processes and chunks must be at least 1.")
+
     pubmetric.log.log_with_timestamp(
         f"Processing {len(paper_citations)} citations using {num_chunks} chunks "
-        f"with {num_processes} parallel process(es) each."
+        f"with {num_processes} parallel process(es)."
     )
-    chunk_size = math.ceil(len(paper_citations) / num_chunks)
-    paper_citations_items = list(paper_citations.items())
-    chunks =    [dict(paper_citations_items[i:i + chunk_size])
-                for i in range(0, len(paper_citations_items), chunk_size)]
-
-    all_partial_counts = []
-    for i, chunk in tqdm(enumerate(chunks), total=num_chunks, desc="Processing chunks"):
-        chunk_file = f"chunk_{i}.pkl"
-        with Pool(processes=num_processes) as pool:
-            partial_counts = pool.map(process_chunk, [chunk])
-
-        # Saving partial counts to disk so memory does not run out
-        with open(chunk_file, 'wb') as f:
-            pickle.dump(partial_counts, f)
-        all_partial_counts.append(chunk_file)
-
-    # Combining all partial counts
-    cocitation_counts = defaultdict(int)
 
-    for chunk_file in all_partial_counts:
-        with open(chunk_file, 'rb') as f:
-            partial_counts = pickle.load(f)
-        cocitation_counts = combine_counts([cocitation_counts] + partial_counts)
-        os.remove(chunk_file)  # Remving chunk files
+    # Map: PMIDs to integer ids, split into chunks
+    encoding_start_time = datetime.now()
+    pmid_ids = {}
+    id_lists = [np.fromiter((pmid_ids.setdefault(pmid, len(pmid_ids)) for pmid in citations),
+                            dtype=np.int64)
+                for citations in paper_citations.values()]
+    names = np.array(list(pmid_ids.keys()), dtype=object)
 
-    edges = [(pair[0], pair[1], count) for pair, count in cocitation_counts.items()]
+    chunk_size = max(1, math.ceil(len(id_lists) / num_chunks))
+    chunks = [id_lists[i:i + chunk_size] for i in range(0, len(id_lists), chunk_size)]
+    pubmetric.log.step_report(encoding_start_time, "Encoding citations")
 
-    # Create the co-citation graph
-    cocitation_graph = igraph.Graph.TupleList(edges, directed=False, weights=True)
+    # Count: all chunks are dispatched to one persistent pool
+    counting_start_time = datetime.now()
+    with Pool(processes=num_processes) as pool:
+        partial_counts = list(tqdm(pool.imap_unordered(process_chunk, chunks),
+                                   total=len(chunks), desc="Processing chunks"))
+    pubmetric.log.step_report(counting_start_time, "Counting co-citations")
+
+    # Reduce: merge of the sorted partial counts
+    merge_start_time = datetime.now()
+    pair_keys, counts = merge_pair_counts(partial_counts)
+    pubmetric.log.step_report(merge_start_time, "Merging co-citation counts")
+
+    graph_start_time = datetime.now()
+    cocitation_graph = graph_from_index_pairs(sources=pair_keys >> 32,
+                                              targets=pair_keys & 0xFFFFFFFF,
+                                              weights=counts,
+                                              names=names)
+    pubmetric.log.step_report(graph_start_time, "Building graph from co-citation counts")
 
     return cocitation_graph
 
+def merge_pair_counts(partial_counts: list) -> tuple:
+    """
+    Combines sorted partial co-citation counts by concatenating them, sorting the pair
+    keys and summing the counts of pairs that occur in several chunks, all in NumPy.
+
+    :param partial_counts: List of (pair_keys, counts) array tuples as returned by
+        process_chunk, where the pair keys of each tuple are sorted and unique.
+
+    :return: Tuple of two int64 arrays; the sorted, unique pair keys and their total counts.
+    """
+    if not partial_counts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    keys = np.concatenate([np.asarray(keys, dtype=np.int64) for keys, _ in partial_counts])
+    counts = np.concatenate([np.asarray(counts, dtype=np.int64) for _, counts in partial_counts])
+    if not len(keys):
+        return keys, counts
+    order = np.argsort(keys, kind='stable') # merges the sorted runs
+    keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.add.reduceat(counts[order], starts)
+
 def combine_counts(counts_list: list):
     """
     Combines multiple dictionaries of co-citation counts into a single dictionary 
@@ -148,23 +297,728 @@ def combine_counts(counts_list: list):
             combined_counts[pair] += count
     return combined_counts
 
-def process_chunk(chunk: dict):
+def process_chunk(chunk: list) -> tuple:
     """
     Processes a chunk of paper citations to count co-citations between papers.
 
-    :param chunk: Dictionary where keys are citation identifiers (PMIDs) and values
-        are sets of papers cited by the key paper within this chunk.
+    :param chunk: List of integer id arrays, one per citing paper, holding the ids of
+        the papers it cites.
     
-    :return: A defaultdict object where each key is a co-citation pair (sorted tuple)
-        and the value is the count of co-citations for that pair within the chunk.
+    :return: Tuple of two int64 arrays; the sorted, unique pair keys and their counts within
+        the chunk. A pair of ids (a, b), a < b, is encoded as the key (a << 32) | b.
     """
-    cocitation_counts = defaultdict(int)
-    for citations in chunk.values():
-        for paper1, paper2 in itertools.combinations(citations, 2):
-            if paper1 != paper2:
-                pair = tuple(sorted((paper1, paper2)))
-                cocitation_counts[pair] += 1
-    return cocitation_counts
+    pair_keys = []
+    for citations in chunk:
+        first, second = pair_positions(len(citations))
+        paper1, paper2 = citations[first], citations[second]
+        not_self = paper1 != paper2  # To avoid self-pairs
+        paper1, paper2 = paper1[not_self], paper2[not_self]
+        pair_keys.append((np.minimum(paper1, paper2) << 32) | np.maximum(paper1, paper2))
+
+    if not pair_keys:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    keys, counts = np.unique(np.concatenate(pair_keys), return_counts=True)
+    return keys, counts.astype(np.int64)
+
+def build_cocitation_graph(paper_citations: dict,
+                           method: str = "auto",
+                           num_processes: Optional[int] = None,
+                           num_chunks: Optional[int] = None) -> igraph.Graph:
+    """
+    Creates a co-citation graph using the specified builder.
+
+    :param paper_citations: Dictionary where keys are citation identifiers (PMIDs) and
+        values are sets of papers cited by the key paper.
+    :param method: String specifying the builder. Options are "small" (pairwise counting),
+        "mapreduce" (chunked counting, see create_cocitation_graph), "sparse" (sparse matrix
+        multiplication) and "auto", which uses "mapreduce" for more than 20 000 citations and
+        "small" otherwise. Default is "auto".
+    :param num_processes: Number of worker processes of the "mapreduce" builder, see
+        create_cocitation_graph. Defaults to the number of CPUs.
+    :param num_chunks: Number of chunks of the "mapreduce" builder. Defaults to four per process.
+
+    :raises ValueError: If an invalid method is provided.
+
+    :return: An igraph Graph object representing the co-citation network.
+    """
+    if method == "auto":
+        method = "mapreduce" if len(paper_citations) > 20_000 else "small"
+
+    if method == "small":
+        return create_small_cocitation_graph(paper_citations)
+    elif method == "mapreduce":
+        return create_cocitation_graph(paper_citations, num_processes=num_processes,
+                                       num_chunks=num_chunks)
+    elif method == "sparse":
+        return create_sparse_cocitation_graph(paper_citations)
+    else:
+        raise ValueError(f"Invalid co-citation method: {method}")
+
+def select_tools(tools: list, tool_selection: Union[list, set, str]) -> list:
+    """
+    Selects a subsection of the tools in a metadata file.
+
+    :param tools: List of tool metadata dictionaries.
+    :param tool_selection: "full" or "workflomics" to select the tools in the respective
+        domain annotations, or a list or set of tool names.
+
+    :raises ValueError: If no tools are selected.
+    :raises TypeError: If tool_selection is of an invalid type.
+
+    :return: List of the selected tool metadata dictionaries.
+    """
+    if tool_selection == "full":
+        selected_tools = pubmetric.data.download_domain_annotations(annotations="full",
+                                                                    tools=tools)
+        if not selected_tools:
+            raise ValueError("No tools were downloaded; please check the download source.")
+    elif tool_selection == "workflomics":
+        selected_tools = pubmetric.data.download_domain_annotations(annotations="workflomics",
+                                                                    tools=tools)
+        if not selected_tools:
+            raise ValueError("No tools were downloaded; please check the download source.")
+    elif isinstance(tool_selection, (list, set)):
+        selected_tools = [tool for tool in tools if tool['name'] in tool_selection]
+        if not selected_tools:
+            raise ValueError(
+                "No matching tools found; check the tool names in tool_selection.")
+    else:
+        raise TypeError(
+            "Invalid type for tool_selection. Expected str, list, or set.")
+
+    pubmetric.log.log_with_timestamp("Selecting specified subsection of tools")
+    pubmetric.log.log_with_timestamp(f"Number of selected tools: {len(selected_tools)}")
+    return selected_tools
+
+def _encode_attribute(value):
+    """Makes a graph-level attribute JSON serialisable."""
+    if isinstance(value, datetime):
+        return {'datetime': value.isoformat()}
+    if isinstance(value, timedelta):
+        return {'timedelta': value.total_seconds()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def _decode_attribute(value):
+    """Inverse of _encode_attribute."""
+    if isinstance(value, dict) and len(value) == 1:
+        if 'datetime' in value:
+            return datetime.fromisoformat(value['datetime'])
+        if 'timedelta' in value:
+            return timedelta(seconds=value['timedelta'])
+    return value
+
+def _attribute_column(values: list, name: str) -> np.ndarray:
+    """Converts a vertex or edge attribute to a fixed width array that can be memory-mapped."""
+    column = np.asarray(values)
+    if column.dtype.kind in 'iu':
+        column = column.astype(np.int32 if np.abs(column).max(initial=0) < 2**31 else np.int64)
+    elif column.dtype.kind == 'f':
+        column_32 = column.astype(np.float32)
+        if np.array_equal(column_32, column):
+            column = column_32
+    elif column.dtype.kind not in 'bU':
+        raise TypeError(f"Attribute {name} of type {column.dtype} can not be saved.")
+    return column
+
+def read_graph_columns(inpath: str, mmap: bool = True) -> Tuple[dict, dict]:
+    """
+    Reads the header and the columns of a graph saved by write_graph, without creating
+    the igraph.Graph.
+
+    :param inpath: Path to the folder containing the graph.
+    :param mmap: If True, the columns are memory-mapped read-only instead of read into
+        memory, so they are only read when used and shared between processes.
+
+    :raises FileNotFoundError: If the graph folder is not found.
+
+    :return: The header, with the graph-level attributes under 'attributes', and a dictionary
+        mapping the column names (sources, targets, vertex/<attribute> and edge/<attribute>)
+        to arrays.
+    """
+    graph_dir = os.path.join(inpath, GRAPH_DIRNAME)
+    header_path = os.path.join(graph_dir, 'header.json')
+    if not os.path.isfile(header_path):
+        raise FileNotFoundError(f"File not found: {header_path}.")
+    with open(header_path, 'r', encoding='utf-8') as f:
+        header = json.load(f)
+    header['attributes'] = {name: _decode_attribute(value)
+                            for name, value in header['attributes'].items()}
+
+    mmap_mode = 'r' if mmap else None
+    columns = {name: np.load(os.path.join(graph_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+               for name in ['sources', 'targets']}
+    for kind in ['vertex', 'edge']:
+        for attribute in header[f'{kind}_attributes']:
+            columns[f'{kind}/{attribute}'] = np.load(
+                os.path.join(graph_dir, kind, f'{attribute}.npy'), mmap_mode=mmap_mode)
+    return header, columns
+
+def read_graph(inpath: str) -> igraph.Graph:
+    """
+    Loads a graph saved by write_graph. Graphs saved as graph.pkl by earlier versions are
+    loaded as well.
+
+    :param inpath: Path to the folder containing the graph.
+
+    :raises FileNotFoundError: If the graph file is not found.
+
+    :return: The co-citation igraph.Graph.
+    """
+    pickle_path = os.path.join(inpath, 'graph.pkl')
+    if not os.path.isdir(os.path.join(inpath, GRAPH_DIRNAME)) and os.path.isfile(pickle_path):
+        pubmetric.log.log_with_timestamp(f"Loading graph from {pickle_path}.")
+        with open(pickle_path, 'rb') as f:
+            graph = pickle.load(f)
+        pubmetric.log.log_with_timestamp(f"Graph loaded from {pickle_path}.")
+        return graph
+
+    graph_dir = os.path.join(inpath, GRAPH_DIRNAME)
+    pubmetric.log.log_with_timestamp(f"Loading graph from {graph_dir}.")
+    header, columns = read_graph_columns(inpath)
+    graph = igraph.Graph(n=header['vcount'],
+                         edges=np.column_stack([columns['sources'], columns['targets']]),
+                         directed=header['directed'])
+    for name, value in header['attributes'].items():
+        graph[name] = value
+    for attribute in header['vertex_attributes']:
+        graph.vs[attribute] = columns[f'vertex/{attribute}'].tolist()
+    for attribute in header['edge_attributes']:
+        graph.es[attribute] = columns[f'edge/{attribute}'].tolist()
+    if 'weight' in header['edge_attributes']: # derived, so it is not stored
+        ensure_attributes(graph, ['inverted_weight'])
+    pubmetric.log.log_with_timestamp(f"Graph loaded from {graph_dir}.")
+    return graph
+
+def write_graph(graph: igraph.Graph, outpath: str):
+    """
+    Saves a graph in the output folder, as a folder of NumPy arrays with a JSON header: the
+    int32 source and target vertex of every edge, one array per vertex and edge attribute,
+    and the graph-level attributes in the header. The arrays can be memory-mapped on load,
+    see read_graph_columns.
+
+    :param graph: The co-citation igraph.Graph.
+    :param outpath: Path to the output folder.
+
+    :raises TypeError: If an attribute is not numerical, boolean or a string.
+    """
+    pubmetric.log.log_with_timestamp("Saving graph.")
+    graph_dir = os.path.join(outpath, GRAPH_DIRNAME)
+    for kind in ['vertex', 'edge']:
+        os.makedirs(os.path.join(graph_dir, kind), exist_ok=True)
+
+    # The header of a previous graph in the folder is removed before any column is
+    # overwritten, so an interrupted overwrite is not loaded as a mix of both graphs
+    if os.path.isfile(os.path.join(graph_dir, 'header.json')):
+        os.remove(os.path.join(graph_dir, 'header.json'))
+    for weighted in [True, False]: # distances of a previous graph in the folder are stale
+        if os.path.isfile(distance_index_path(outpath, weighted)):
+            os.remove(distance_index_path(outpath, weighted))
+
+    edges = np.array(graph.get_edgelist(), dtype=np.int32).reshape(-1, 2)
+    np.save(os.path.join(graph_dir, 'sources.npy'), edges[:, 0])
+    np.save(os.path.join(graph_dir, 'targets.npy'), edges[:, 1])
+    vertex_attributes = graph.vs.attributes()
+    edge_attributes = [attribute for attribute in graph.es.attributes()
+                       if attribute != 'inverted_weight']
+    for attribute in vertex_attributes:
+        np.save(os.path.join(graph_dir, 'vertex', f'{attribute}.npy'),
+                _attribute_column(graph.vs[attribute], attribute))
+    for attribute in edge_attributes:
+        np.save(os.path.join(graph_dir, 'edge', f'{attribute}.npy'),
+                _attribute_column(graph.es[attribute], attribute))
+
+    header = {
+        'format_version': GRAPH_FORMAT_VERSION,
+        'vcount': graph.vcount(),
+        'ecount': graph.ecount(),
+        'directed': graph.is_directed(),
+        'vertex_attributes': vertex_attributes,
+        'edge_attributes': edge_attributes,
+        'attributes': {name: _encode_attribute(graph[name]) for name in graph.attributes()}
+    }
+    # The header is written last, so an interrupted save is not mistaken for a graph
+    with open(os.path.join(graph_dir, 'header.json'), 'w', encoding='utf-8') as f:
+        json.dump(header, f)
+
+def graph_exists(path: str) -> bool:
+    """
+    Checks if a folder contains a graph that can be loaded with read_graph.
+
+    :param path: Path to the folder.
+
+    :return: True if the folder contains a graph.
+    """
+    return (os.path.isfile(os.path.join(path, GRAPH_DIRNAME, 'header.json'))
+            or os.path.isfile(os.path.join(path, 'graph.pkl')))
+
+def metadata_filename(test_size: Optional[int] = None) -> str:
+    """Returns the name of the metadata file create_network saves for a test size."""
+    return f'tool_metadata_test{test_size}.json' if test_size else 'tool_metadata.json'
+
+def find_metadata_file(path: str) -> Optional[str]:
+    """
+    Finds the metadata file saved by create_network or update_network in a folder.
+
+    :param path: Path to the folder.
+
+    :return: Path to tool_metadata.json, or else to the metadata file of a test run, or
+        None if the folder contains neither.
+    """
+    full_path = os.path.join(path, metadata_filename())
+    if os.path.isfile(full_path):
+        return full_path
+    test_paths = sorted(glob.glob(os.path.join(path, metadata_filename('*'))))
+    return test_paths[0] if test_paths else None
+
+def read_metadata_settings(path: str) -> Tuple[Optional[str], Optional[int]]:
+    """
+    Reads the topic and the test size a graph in a folder was created with, from its
+    metadata file, see find_metadata_file.
+
+    :param path: Path to the folder.
+
+    :raises FileNotFoundError: If the folder contains no metadata file.
+
+    :return: Tuple of the topic ID and the test size, None for a full graph.
+    """
+    metadata_path = find_metadata_file(path)
+    if metadata_path is None:
+        raise FileNotFoundError(f"No metadata file found in {path}.")
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        topic_id = json.load(f).get('topic')
+    test_size = re.fullmatch(r'tool_metadata_test(\d+)\.json', os.path.basename(metadata_path))
+    return topic_id, int(test_size.group(1)) if test_size else None
+
+def update_inputs_exist(path: str) -> bool:
+    """
+    Checks if a folder contains everything update_network needs: the metadata file, the
+    tool citations file and the graph.
+
+    :param path: Path to the folder.
+
+    :return: True if the graph in the folder can be updated.
+    """
+    return (find_metadata_file(path) is not None
+            and os.path.isfile(os.path.join(path, CITATIONS_FILENAME))
+            and graph_exists(path))
+
+def distance_index_path(path: str, weighted: bool = True) -> str:
+    """Returns the path of the saved DistanceIndex of the graph in a folder."""
+    return os.path.join(path, GRAPH_DIRNAME, f"hops_{'weighted' if weighted else 'unweighted'}.npy")
+
+def write_distance_index(graph: igraph.Graph,
+                         outpath: str,
+                         weighted: bool = True) -> pubmetric.metrics.DistanceIndex:
+    """
+    Computes the shortest path lengths between all tools of a graph and saves them next to
+    the graph, see pubmetric.metrics.DistanceIndex. The matrix has vcount x vcount entries,
+    so this is meant for topic-sized graphs.
+
+    :param graph: The co-citation igraph.Graph, as saved in the output folder.
+    :param outpath: Path to the output folder of the graph.
+    :param weighted: Whether the paths are weighted by the inverted edge weights. Default is True.
+
+    :return: The DistanceIndex.
+    """
+    pubmetric.log.log_with_timestamp("Computing shortest path lengths.")
+    distance_index = pubmetric.metrics.DistanceIndex(graph, weighted=weighted, dense=True)
+    os.makedirs(os.path.join(outpath, GRAPH_DIRNAME), exist_ok=True)
+    distance_index.save(distance_index_path(outpath, weighted))
+    return distance_index
+
+def read_distance_index(graph: igraph.Graph,
+                        inpath: str,
+                        weighted: bool = True) -> Optional[pubmetric.metrics.DistanceIndex]:
+    """
+    Loads the shortest path lengths saved by write_distance_index, memory-mapped.
+
+    :param graph: The co-citation igraph.Graph loaded from the same folder.
+    :param inpath: Path to the folder containing the graph.
+    :param weighted: Whether to load the weighted path lengths. Default is True.
+
+    :return: The DistanceIndex, or None if it was not saved or does not match the graph.
+    """
+    path = distance_index_path(inpath, weighted)
+    if not os.path.isfile(path):
+        return None
+    try:
+        return pubmetric.metrics.DistanceIndex.load(path, graph, weighted=weighted)
+    except ValueError as e:
+        pubmetric.log.log_with_timestamp(f"Ignoring saved distances: {e}")
+        return None
+
+def graph_edge_weights(graph: igraph.Graph, key: str = 'pmid') -> dict:
+    """
+    Collects the edge weights of a co-citation graph.
+
+    :param graph: The co-citation igraph.Graph.
+    :param key: The vertex attribute identifying the tools. Default is 'pmid'.
+
+    :return: Dictionary mapping sorted tuples of vertex identifiers to edge weights.
+    """
+    ids = graph.vs[key]
+    return {tuple(sorted((ids[source], ids[target]))): weight
+            for (source, target), weight in zip(graph.get_edgelist(), graph.es['weight'])}
+
+def graph_from_edge_weights(edge_weights: dict) -> igraph.Graph:
+    """
+    Creates a co-citation graph from a dictionary of edge weights.
+
+    :param edge_weights: Dictionary mapping tuples of PMIDs to co-citation counts.
+
+    :return: An igraph Graph object representing the co-citation network.
+    """
+    pmid_ids = {}
+    pairs = np.array([(pmid_ids.setdefault(pmid1, len(pmid_ids)),
+                       pmid_ids.setdefault(pmid2, len(pmid_ids)))
+                      for pmid1, pmid2 in edge_weights], dtype=np.int64).reshape(-1, 2)
+    return graph_from_index_pairs(sources=pairs[:, 0],
+                                  targets=pairs[:, 1],
+                                  weights=np.fromiter(edge_weights.values(), dtype=np.int64,
+                                                      count=len(edge_weights)),
+                                  names=np.array(list(pmid_ids), dtype=object))
+
+def _cited_papers(metadata_file: dict, tool_citations: dict, citations: set) -> dict:
+    """
+    Collects, for the given citing papers, the number of tool citations they make and the
+    set of tools they cite, in the same way as pubmetric.data.build_paper_citations.
+    """
+    cited_papers = defaultdict(lambda: [0, set()])
+    for tool in metadata_file['tools']:
+        paper_pmid = tool['pmid']
+        for citation_pmid in tool_citations.get(paper_pmid, []):
+            if citation_pmid in citations and citation_pmid != paper_pmid:
+                cited_papers[citation_pmid][0] += 1
+                cited_papers[citation_pmid][1].add(paper_pmid)
+    return cited_papers
+
+def apply_citation_deltas(edge_weights: dict,
+                          old_metadata_file: dict,
+                          old_tool_citations: dict,
+                          new_metadata_file: dict,
+                          new_tool_citations: dict,
+                          changed_tools: set,
+                          threshold: int = 20) -> dict:
+    """
+    Updates co-citation edge weights for changes in the citation lists of some tools. Only
+    the papers citing the changed tools are recounted; their old co-citation pairs are
+    subtracted and their new ones added.
+
+    :param edge_weights: Dictionary mapping sorted tuples of PMIDs to co-citation counts, for
+        the old metadata and citations. It is updated in place.
+    :param old_metadata_file: The metadata the edge weights were created from.
+    :param old_tool_citations: The tool citation lists the edge weights were created from.
+    :param new_metadata_file: The updated metadata.
+    :param new_tool_citations: The updated tool citation lists.
+    :param changed_tools: Set of PMIDs of the tools that were added, removed or whose citation
+        lists changed.
+    :param threshold: The maximum number of tools a citing paper can cite to be kept.
+        Default is 20.
+
+    :return: The updated edge weights, without edges whose weight dropped to 0.
+    """
+    affected_citations = set()
+    for pmid in changed_tools:
+        affected_citations.update(old_tool_citations.get(pmid, []))
+        affected_citations.update(new_tool_citations.get(pmid, []))
+
+    old_cited_papers = _cited_papers(old_metadata_file, old_tool_citations, affected_citations)
+    new_cited_papers = _cited_papers(new_metadata_file, new_tool_citations, affected_citations)
+
+    for cited_papers, delta in ((old_cited_papers, -1), (new_cited_papers, 1)):
+        for count, papers in cited_papers.values():
+            if 1 < count <= threshold:
+                for pair in itertools.combinations(sorted(papers), 2):
+                    edge_weights[pair] = edge_weights.get(pair, 0) + delta
+
+    pubmetric.log.log_with_timestamp(
+        f"Recounted {len(affected_citations)} citing papers of {len(changed_tools)} changed tools.")
+    return {pair: weight for pair, weight in edge_weights.items() if weight > 0}
+
+class CocitationCounter:
+    """
+    Co-citation edge weights counted as the citation lists of the tools arrive, equal to those
+    of build_cocitation_graph(pubmetric.data.build_paper_citations(...)) once all tools are
+    added, in any order. The pairs of the tools cited by a citing paper are counted while it
+    cites at most threshold tools, and subtracted again once it cites more.
+    """
+    def __init__(self, threshold: int = 20):
+        """
+        :param threshold: The maximum number of tools a citing paper can cite to be kept.
+            Default is 20.
+        """
+        self.threshold = threshold
+        self.cited_papers = {} # citing paper -> [number of tool citations, set of cited tools]
+        self.weights = defaultdict(int)
+
+    def add_tool(self, tool: dict, citations: list):
+        """
+        Counts the co-citations of a tool with the tools added before it.
+
+        :param tool: Metadata dictionary of the tool, with a 'pmid' key.
+        :param citations: List of PMIDs citing the tool.
+        """
+        paper_pmid = tool['pmid']
+        for citation_pmid in citations:
+            if citation_pmid == paper_pmid:
+                continue
+            cited = self.cited_papers.setdefault(citation_pmid, [0, set()])
+            cited[0] += 1
+            count, papers = cited
+            if papers is None: # cites too many tools to be kept
+                continue
+            if count > self.threshold:
+                if count - 1 > 1:
+                    for pair in itertools.combinations(sorted(papers), 2):
+                        self.weights[pair] -= 1
+                cited[1] = None
+            elif paper_pmid not in papers:
+                for other_pmid in papers:
+                    self.weights[tuple(sorted((paper_pmid, other_pmid)))] += 1
+                papers.add(paper_pmid)
+
+    def edge_weights(self) -> dict:
+        """Returns the dictionary mapping sorted tuples of PMIDs to co-citation counts."""
+        return {pair: weight for pair, weight in self.weights.items() if weight > 0}
+
+    def graph(self) -> igraph.Graph:
+        """Creates the co-citation graph of the counted edge weights, see graph_from_edge_weights."""
+        return graph_from_edge_weights(self.edge_weights())
+
+def verify_network(graph: igraph.Graph,
+                   metadata_file: dict,
+                   tool_citations: dict,
+                   threshold: int = 20):
+    """
+    Verifies that a graph has the same edges and weights as a full rebuild from the given
+    metadata and tool citation lists.
+
+    :param graph: The co-citation igraph.Graph, with 'pmid' vertex attributes.
+    :param metadata_file: Dictionary containing metadata with a 'tools' key.
+    :param tool_citations: Dictionary mapping tool PMIDs to the list of PMIDs citing them.
+    :param threshold: The maximum number of tools a citing paper can cite to be kept.
+        Default is 20.
+
+    :raises GraphVerificationError: If the graph differs from the full rebuild.
+    """
+    paper_citations = pubmetric.data.build_paper_citations(
+                        metadata_file=copy.deepcopy(metadata_file),
+                        tool_citations=tool_citations,
+                        threshold=threshold)
+    rebuilt_weights = graph_edge_weights(create_sparse_cocitation_graph(paper_citations),
+                                         key='name')
+    weights = graph_edge_weights(graph)
+    if weights != rebuilt_weights:
+        differing_edges = set(weights.items()) ^ set(rebuilt_weights.items())
+        raise GraphVerificationError(
+            f"The graph differs from a full rebuild in {len(differing_edges)} edge weights.")
+    pubmetric.log.log_with_timestamp("Graph verified against a full rebuild.")
+
+async def update_network(inpath: str,
+                         outpath: Optional[str] = None,
+                         topic_id: Optional[str] = "topic_0121",
+                         test_size: Optional[int] = None,
+                         tool_selection: Union[list, str, None] = None,
+                         threshold: int = 20,
+                         verify: bool = False,
+                         save_files: bool = True,
+                         cache_path: Optional[str] = None,
+                         save_distances: bool = False) -> igraph.Graph:
+    """
+    Updates a graph created by create_network instead of recreating it. The current tool
+    list of bio.tools is compared to the stored metadata, and citations are only downloaded
+    for new tools and for tools whose number of citations in EuropePMC changed. The
+    co-citation weights are then updated for the citing papers of those tools only.
+
+    :param inpath: Path to the folder of the previous graph, containing the metadata file,
+        the tool citations file and the graph, see update_inputs_exist.
+    :param outpath: Path to the output directory of the updated graph. If not provided, a
+        timestamped directory will be created in the current working directory.
+    :param topic_id: The ID to which the downloaded tools belong.
+    :param test_size: Optional number of tools after which the bio.tools crawl stops, as in
+        create_network. Should be the same as for the previous graph, otherwise all tools
+        beyond the test size are counted as new.
+    :param tool_selection: Optional selection of tools, as in create_network. Should be the
+        same as for the previous graph.
+    :param threshold: The maximum number of tools a citing paper can cite to be kept.
+        Default is 20.
+    :param verify: If True, the updated graph is compared to a full rebuild from the updated
+        citation lists.
+    :param save_files: Determines if the updated metadata, citations and graph are saved.
+    :param cache_path: Optional path to a ResponseCache database used for the bio.tools and
+        NCBI downloads. Citations are always downloaded anew, and bio.tools pages are only
+        reused on the day they were downloaded (see pubmetric.cache.ENDPOINT_TTLS), so the
+        update sees the tools added since the previous graph.
+    :param save_distances: If True, the shortest path lengths between all tools are saved
+        next to the graph, see write_distance_index. Requires save_files. Default is False.
+
+    :raises FileNotFoundError: If the metadata, tool citations or graph file is not found.
+    :raises DownloadError: If the citations of a new or updated tool could not be downloaded.
+    :raises GraphVerificationError: If verify is True and the graph differs from a full rebuild.
+
+    :return: The updated co-citation graph.
+    """
+    start_time = datetime.now()
+
+    metadata_path = find_metadata_file(inpath)
+    if metadata_path is None:
+        raise FileNotFoundError(f"No metadata file found in {inpath}.")
+    citations_path = os.path.join(inpath, CITATIONS_FILENAME)
+    if not os.path.isfile(citations_path):
+        raise FileNotFoundError(f"File not found: {citations_path}.")
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        old_metadata_file = json.load(f)
+    with open(citations_path, 'r', encoding='utf-8') as f:
+        old_tool_citations = json.load(f)
+    edge_weights = graph_edge_weights(read_graph(inpath))
+
+    if not outpath:
+        outpath = f'out/out_{datetime.now().strftime("%Y%m%d%H%M%S")}'
+    os.makedirs(outpath, exist_ok=True)
+    cache = ResponseCache(cache_path) if cache_path else None
+
+    # Diff the tool list
+    metadata_start_time = datetime.now()
+    metadata_file = await pubmetric.data.update_tool_metadata(old_metadata_file=old_metadata_file,
+                                                              outpath=outpath,
+                                                              topic_id=topic_id,
+                                                              inpath=inpath,
+                                                              test_size=test_size,
+                                                              cache=cache)
+    if cache:
+        cache.close()
+    if tool_selection:
+        metadata_file['tools'] = select_tools(tools=metadata_file['tools'],
+                                              tool_selection=tool_selection)
+    pubmetric.log.step_timer(metadata_start_time, "Updating metadata")
+
+    old_pmids = {tool['pmid'] for tool in old_metadata_file['tools']}
+    new_pmids = {tool['pmid'] for tool in metadata_file['tools']}
+    added_tools = new_pmids - old_pmids
+    removed_tools = old_pmids - new_pmids
+
+    # Only download citations for new tools and tools with a changed number of citations
+    citation_start_time = datetime.now()
+    limiter = HostRateLimiter(default_rate=pubmetric.data.EUROPEPMC_REQUESTS_PER_SECOND)
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
+        citation_counts = await pubmetric.data.fetch_citation_counts(
+                                            sorted(new_pmids & old_pmids), session,
+                                            limiter=limiter)
+        updated_tools = {pmid for pmid, count in citation_counts.items()
+                         if count != len(old_tool_citations.get(pmid, []))}
+        downloaded_citations = await pubmetric.data.fetch_citations_batch(
+                                            sorted(updated_tools | added_tools), session,
+                                            limiter=limiter)
+    failed_tools = (updated_tools | added_tools) - downloaded_citations.keys()
+    if failed_tools:
+        raise DownloadError(f"The citations of {len(failed_tools)} tools could not be downloaded.")
+    pubmetric.log.log_with_timestamp(
+        f"{len(added_tools)} new, {len(removed_tools)} removed and {len(updated_tools)} "
+        f"updated tools.")
+    pubmetric.log.step_timer(citation_start_time, "Downloading changed citations")
+
+    tool_citations = {pmid: downloaded_citations.get(pmid, old_tool_citations.get(pmid, []))
+                      for pmid in new_pmids}
+    for tool in metadata_file['tools']:
+        tool['nr_citations'] = len(tool_citations.get(tool['pmid'], []))
+
+    # Apply the changes to the co-citation weights
+    graph_start_time = datetime.now()
+    edge_weights = apply_citation_deltas(edge_weights=edge_weights,
+                                         old_metadata_file=old_metadata_file,
+                                         old_tool_citations=old_tool_citations,
+                                         new_metadata_file=metadata_file,
+                                         new_tool_citations=tool_citations,
+                                         changed_tools=added_tools | removed_tools | updated_tools,
+                                         threshold=threshold)
+    graph = graph_from_edge_weights(edge_weights)
+    graph = add_graph_attributes(graph=graph, metadata_file=metadata_file)
+    pubmetric.log.step_timer(graph_start_time, "Updating co-citation graph")
+
+    if verify:
+        verify_network(graph=graph, metadata_file=metadata_file, tool_citations=tool_citations,
+                       threshold=threshold)
+
+    if save_files:
+        # saved under the name it was read from, so the next update finds it again
+        with open(os.path.join(outpath, os.path.basename(metadata_path)), 'w',
+                  encoding='utf-8') as f:
+            json.dump(metadata_file, f)
+        with open(os.path.join(outpath, CITATIONS_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump(tool_citations, f)
+        write_graph(graph, outpath)
+        if save_distances:
+            write_distance_index(graph, outpath)
+
+    pubmetric.log.step_timer(start_time, "Complete graph update")
+
+    graph["creation_date"] = datetime.now()
+    graph["topic"] = topic_id
+    graph["tool_selection"] = bool(tool_selection)
+    graph["graph_creation_time"] = datetime.now() - start_time
+
+    return graph
+
+async def _create_network_streaming(outpath: str,
+                                    test_size: Optional[int],
+                                    topic_id: Optional[str],
+                                    save_files: bool,
+                                    tool_selection: Union[list, set, None],
+                                    cocitation_method: str,
+                                    cache: Optional[ResponseCache],
+                                    num_processes: Optional[int] = None,
+                                    num_chunks: Optional[int] = None) -> igraph.Graph:
+    """
+    Downloads the data of create_network with pubmetric.data.stream_tool_data and creates the
+    graph. With the "auto" cocitation_method the co-citations are counted as the citation
+    lists arrive, otherwise the graph is built by build_cocitation_graph after the download.
+    """
+    pubmetric.log.log_with_timestamp("Downloading tool metadata and citations.")
+    download_start_time = datetime.now()
+    counter = CocitationCounter() if cocitation_method == "auto" else None
+    try:
+        metadata_file, tool_citations = await pubmetric.data.stream_tool_data(
+                                            outpath=outpath,
+                                            topic_id=topic_id,
+                                            test_size=test_size,
+                                            tool_filter=((lambda tool: tool['name'] in tool_selection)
+                                                         if tool_selection else None),
+                                            on_citations=counter.add_tool if counter else None,
+                                            cache=cache)
+    finally:
+        if cache:
+            cache.close()
+    if tool_selection: # logs the selection, and raises if no tools are selected
+        metadata_file['tools'] = select_tools(tools=metadata_file['tools'],
+                                              tool_selection=tool_selection)
+    pubmetric.log.step_timer(download_start_time, "Downloading metadata and citations")
+
+    metadata_file_name = metadata_filename(test_size)
+    metadata_file_path = os.path.join(outpath, metadata_file_name)
+    pubmetric.log.log_with_timestamp(f"Saving metadata file to {metadata_file_path}.")
+    with open(metadata_file_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata_file, f)
+
+    graph_creation_start_time = datetime.now()
+    if counter: # the co-citations were counted during the download
+        graph = counter.graph()
+    else:
+        paper_citations = pubmetric.data.build_paper_citations(metadata_file=metadata_file,
+                                                               tool_citations=tool_citations)
+        graph = build_cocitation_graph(paper_citations, method=cocitation_method,
+                                       num_processes=num_processes, num_chunks=num_chunks)
+    graph = add_graph_attributes(graph=graph, metadata_file=metadata_file)
+    pubmetric.log.step_timer(graph_creation_start_time, "Creating co-citation graph")
+
+    if save_files:
+        with open(os.path.join(outpath, CITATIONS_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump(tool_citations, f)
+        write_graph(graph, outpath)
+    pubmetric.log.log_with_timestamp(f"Graph creation complete. Graph contains"
+                                     f"{len(graph.vs)} vertices and {len(graph.es)} edges.")
+    return graph
 
 async def create_network(outpath: Optional[str] = None,
                         test_size: Optional[int] = None,
@@ -173,7 +1027,14 @@ async def create_network(outpath: Optional[str] = None,
                         load_graph: bool = False,
                         inpath: str = '',
                         save_files: bool = True,
-                        tool_selection: Union[list, str, None]=None) -> igraph.Graph:
+                        tool_selection: Union[list, str, None]=None,
+                        cocitation_method: str = "auto",
+                        cache_path: Optional[str] = None,
+                        offline: bool = False,
+                        streaming: bool = False,
+                        num_processes: Optional[int] = None,
+                        num_chunks: Optional[int] = None,
+                        save_distances: bool = False) -> igraph.Graph:
     """
     Creates a citation network given a topic and returns a graph and the tools 
     included in the graph.
@@ -181,8 +1042,9 @@ async def create_network(outpath: Optional[str] = None,
     :param topic_id: The ID to which the downloaded tools belong,
         e.g., "Proteomics" or "DNA" as defined by EDAM ontology.
     :param test_size: Determines the minimum number of tools downloaded.
-    :param random_seed: Specifies the seed used to randomly pick tools in a test run.
-        Default is 42.
+    :param random_seed: Specifies the seed used to randomly pick test_size tools from the
+        metadata file loaded from inpath. Downloads are not sampled, they stop after test_size
+        tools. Default is 42.
     :param load_graph: Determines if an already generated graph is loaded or if it
         is recreated.
     :param inpath: Path to an existing folder containing the metadata file and graph.
@@ -191,9 +1053,34 @@ async def create_network(outpath: Optional[str] = None,
         will be saved. If not provided, a timestamped directory will be created in
         the current working directory.
     :param save_files: Determines if the newly generated graph is saved.
+    :param cocitation_method: The co-citation graph builder to use, one of "auto", "small",
+        "mapreduce" or "sparse". See build_cocitation_graph. Default is "auto".
+    :param cache_path: Optional path to a ResponseCache database. The bio.tools, NCBI and
+        EuropePMC downloads are served from it when possible and stored in it otherwise.
+    :param offline: If True, the graph is rebuilt from the cache only, without network.
+        Requires cache_path.
+    :param streaming: If True, the tools are passed from the bio.tools crawl through DOI
+        resolution, publication dates and citations as they arrive, and the co-citations are
+        counted as the citation lists arrive, see pubmetric.data.stream_tool_data and
+        CocitationCounter. With a cocitation_method other than "auto", the graph is built
+        by that method once the citations are downloaded. If False, every step is completed
+        for all tools before the next one starts. Streaming is not possible when the metadata
+        is loaded from inpath, or when the tools are selected by domain annotations ("full"
+        or "workflomics"), which needs the complete tool list. Default is False.
+    :param num_processes: Number of worker processes of the "mapreduce" co-citation builder,
+        see create_cocitation_graph. Defaults to the number of CPUs.
+    :param num_chunks: Number of chunks of the "mapreduce" co-citation builder. Defaults to
+        four per process.
+    :param save_distances: If True, the shortest path lengths between all tools are saved
+        next to the graph, so that they can be memory-mapped by read_distance_index instead
+        of being computed per request. See write_distance_index. Requires save_files.
+        Default is False.
 
     :raises FileNotFoundError: If no inpath is given despite asking to load.
     :raises FileNotFoundError: If input directory is not found
+    :raises ValueError: If offline is requested without a cache_path.
+    :raises ValueError: If streaming is True for an inpath or a tool selection by domain
+        annotations.
 
     :return: The citation network graph created using igraph.
     """
@@ -206,14 +1093,7 @@ async def create_network(outpath: Optional[str] = None,
         if not inpath:
             raise FileNotFoundError('In-path required for loading graph.')
 
-        graph_path = os.path.join(inpath, 'graph.pkl')
-        if os.path.isfile(graph_path):
-            pubmetric.log.log_with_timestamp(f"Loading graph from {graph_path}.")
-            with open(graph_path, 'rb') as f:
-                graph = pickle.load(f)
-            pubmetric.log.log_with_timestamp(f"Graph loaded from {graph_path}.")
-        else:
-            raise FileNotFoundError(f"File not found: {graph_path}.")
+        graph = read_graph(inpath)
 
     else:
         # Create output directory
@@ -222,85 +1102,82 @@ async def create_network(outpath: Optional[str] = None,
 
         os.makedirs(outpath, exist_ok=True)
         pubmetric.log.log_with_timestamp(f"Output directory created at {outpath}.")
-        pubmetric.log.log_with_timestamp("Downloading tool metadata from bio.tools")
-        metadata_start_time = datetime.now()
-        metadata_file = await pubmetric.data.get_tool_metadata(outpath=outpath, 
-                                                               inpath=inpath, 
-                                                               topic_id=topic_id, 
-                                                               test_size=test_size, 
-                                                               random_seed=random_seed)
-        if tool_selection:
-            if tool_selection == "full":
-                selected_tools = pubmetric.data.download_domain_annotations(
-                                                                annotations="full", 
-                                                                tools=metadata_file["tools"])
-                if not selected_tools:
-                    raise ValueError("No tools were downloaded; please check the download source.")
-            elif tool_selection == "workflomics":
-                selected_tools = pubmetric.data.download_domain_annotations(
-                                                                annotations="workflomics",
-                                                                tools=metadata_file["tools"])
-                if not selected_tools:
-                    raise ValueError("No tools were downloaded; please check the download source.")
-            elif isinstance(tool_selection, (list, set)):
-                selected_tools = [tool
-                                  for tool in metadata_file['tools']
-                                  if tool['name'] in tool_selection]
-                if not selected_tools:
-                    raise ValueError(
-                        "No matching tools found; check the tool names in tool_selection.")
-            else:
-                raise TypeError(
-                    "Invalid type for tool_selection. Expected str, list, or set.")
-
-            pubmetric.log.log_with_timestamp("Selecting specified subsection of tools")
-            pubmetric.log.log_with_timestamp(f"Number of selected tools: {len(selected_tools)}")
-            metadata_file['tools'] = selected_tools
-            tool_selection = True
-
-        metadata_file_name = (
-            f'tool_metadata_test{test_size}.json'
-            if test_size
-            else 'tool_metadata.json'
-        )
-        metadata_file_path = os.path.join(outpath, metadata_file_name)
-        pubmetric.log.log_with_timestamp(f"Saving metadata file to {metadata_file_path}.")
-        with open(metadata_file_path, 'w', encoding='utf-8') as f:
-            json.dump(metadata_file, f)
-        pubmetric.log.step_timer(metadata_start_time, "Fetching and saving metadata")
-
-        # Download paper citations
-        pubmetric.log.log_with_timestamp("Downloading citations.")
-        citation_start_time = datetime.now()
-        paper_citations = await pubmetric.data.process_citation_data(metadata_file=metadata_file, 
-                                                                     inpath=inpath, outpath=outpath)
-        pubmetric.log.step_timer(citation_start_time, "Downloading citations")
-        # Create co-citation graph
-        pubmetric.log.log_with_timestamp("Creating co-citation graph.")
-        graph_creation_start_time = datetime.now()
-
-        if len(paper_citations)>20_000:
-            graph = create_cocitation_graph(paper_citations)
+
+        if offline and not cache_path:
+            raise ValueError("A cache_path is required to create the graph offline.")
+        if streaming and (inpath or isinstance(tool_selection, str)):
+            raise ValueError("The data can not be streamed when loading the metadata from "
+                             "inpath or selecting tools by domain annotations.")
+        cache = ResponseCache(cache_path, offline=offline) if cache_path else None
+
+        if streaming:
+            graph = await _create_network_streaming(outpath=outpath,
+                                                    test_size=test_size,
+                                                    topic_id=topic_id,
+                                                    save_files=save_files,
+                                                    tool_selection=tool_selection,
+                                                    cocitation_method=cocitation_method,
+                                                    cache=cache,
+                                                    num_processes=num_processes,
+                                                    num_chunks=num_chunks)
+            if tool_selection:
+                tool_selection = True
         else:
-            graph = create_small_cocitation_graph(paper_citations)
+            pubmetric.log.log_with_timestamp("Downloading tool metadata from bio.tools")
+            metadata_start_time = datetime.now()
+            metadata_file = await pubmetric.data.get_tool_metadata(outpath=outpath, 
+                                                                   inpath=inpath, 
+                                                                   topic_id=topic_id, 
+                                                                   test_size=test_size, 
+                                                                   random_seed=random_seed,
+                                                                   cache=cache)
+            if tool_selection:
+                metadata_file['tools'] = select_tools(tools=metadata_file['tools'],
+                                                      tool_selection=tool_selection)
+                tool_selection = True
+
+            metadata_file_name = metadata_filename(test_size)
+            metadata_file_path = os.path.join(outpath, metadata_file_name)
+            pubmetric.log.log_with_timestamp(f"Saving metadata file to {metadata_file_path}.")
+            with open(metadata_file_path, 'w', encoding='utf-8') as f:
+                json.dump(metadata_file, f)
+            pubmetric.log.step_timer(metadata_start_time, "Fetching and saving metadata")
+
+            # Download paper citations
+            pubmetric.log.log_with_timestamp("Downloading citations.")
+            citation_start_time = datetime.now()
+            paper_citations = await pubmetric.data.process_citation_data(
+                                                metadata_file=metadata_file,
+                                                inpath=inpath, outpath=outpath,
+                                                cache=cache,
+                                                citations_filename=CITATIONS_FILENAME if save_files else None)
+            if cache:
+                cache.close()
+            pubmetric.log.step_timer(citation_start_time, "Downloading citations")
+            # Create co-citation graph
+            pubmetric.log.log_with_timestamp("Creating co-citation graph.")
+            graph_creation_start_time = datetime.now()
+
+            graph = build_cocitation_graph(paper_citations, method=cocitation_method,
+                                           num_processes=num_processes, num_chunks=num_chunks)
+
+            pubmetric.log.step_timer(graph_creation_start_time, "Creating co-citation graph")
 
-        pubmetric.log.step_timer(graph_creation_start_time, "Creating co-citation graph")
+            # Add graph attributes
+            pubmetric.log.log_with_timestamp("Adding graph attributes.")
+            attribute_start_time = datetime.now()
+            graph = add_graph_attributes(graph=graph, metadata_file=metadata_file)
 
-        # Add graph attributes
-        pubmetric.log.log_with_timestamp("Adding graph attributes.")
-        attribute_start_time = datetime.now()
-        graph = add_graph_attributes(graph=graph, metadata_file=metadata_file)
+            pubmetric.log.step_timer(attribute_start_time, "Adding graph attributes")
 
-        pubmetric.log.step_timer(attribute_start_time, "Adding graph attributes")
+            # Save graph
+            if save_files:
+                write_graph(graph, outpath)
+            pubmetric.log.log_with_timestamp(f"Graph creation complete. Graph contains"
+                                             f"{len(graph.vs)} vertices and {len(graph.es)} edges.")
 
-        # Save graph
-        if save_files:
-            pubmetric.log.log_with_timestamp("Saving graph.")
-            graph_path = os.path.join(outpath, 'graph.pkl')
-            with open(graph_path, 'wb') as f:
-                pickle.dump(graph, f)
-        pubmetric.log.log_with_timestamp(f"Graph creation complete. Graph contains"
-                                         f"{len(graph.vs)} vertices and {len(graph.es)} edges.")
+        if save_files and save_distances:
+            write_distance_index(graph, outpath)
 
     pubmetric.log.step_timer(start_time, "Complete data download and graph creation")
 
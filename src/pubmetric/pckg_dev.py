@@ -5,8 +5,6 @@ import os
 import sys
 import json
 import random
-import copy
-import ast
 from typing import Optional
 
 import numpy as np
@@ -18,6 +16,8 @@ import igraph
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.getcwd(), 'src')))
 import pubmetric.data
+import pubmetric.metrics
+import pubmetric.workflow
 
 
 
@@ -28,9 +28,12 @@ def parse_tuple_workflow(graph: igraph.Graph, pmid_edges: list): # for reading r
 
     :param pmid_workflow: List of tuples of pmids 
 
+    :raises KeyError: If a PMID is not in the graph.
+
     :return: Dictionary of tuples representing the edges in the workflow.
 
     """
+    pmid_names = pubmetric.workflow.get_tool_index(graph).pmid_names
     steps = {}
     edges = []
 
@@ -38,8 +41,8 @@ def parse_tuple_workflow(graph: igraph.Graph, pmid_edges: list): # for reading r
         source_pmid = edge[0]
         target_pmid = edge[1]
 
-        source = next(vs['name'] for vs in graph.vs if vs['pmid']== source_pmid) # transfering numbering to random steps
-        target = next(vs['name'] for vs in graph.vs if vs['pmid']== target_pmid)
+        source = pmid_names[source_pmid] # transfering numbering to random steps
+        target = pmid_names[target_pmid]
 
         edges.append( (source, target ) )
 
@@ -68,86 +71,179 @@ def get_percentile_bin(degree, percentiles):
             return f'{i*5+5}th'
     return '100th'
 
-## tag : next step 
-# TODO: if not retain degree then tyou need to give a tool_lsit
-# random seed? how pass it so it does not just use the same oens all the time?
-def generate_random_workflow(graph: igraph.Graph, workflow: dict, tool_list: Optional[list] = None, retain_degree: bool = True) -> list:  # TODO: must be updated to work with the new workflow format
+class RandomWorkflowSampler:
     """
-    Generates a workflow of the same structure as the given workflow, but where each tool is replaced with a randomly picked one from the given set.
-
-    :param tool_list: Optional if the user wants to specify the list of tools to pick from (only works if retain degree is set to False). Generally this should be all tools in the domain.
-    :param workflow: Dictionary representing the workflow.
-
-    :return: List of tuples representing a workflow where each tool has been replaced by another, random, one.  
+    Draws random workflows with the same structure as a given workflow, for null-model
+    comparisons of the metrics. The degree bins and the PMID to tool name lookup of the
+    graph are computed once, so many workflows can be drawn at low cost.
     """
-
-    steps = workflow['steps']
-    edges = workflow['edges']
-
-    # I want it to have the same structure and the same degree. 
-
-    random_steps = {}
-    random_edges = []
-    random_pmid_edges = []
-
-
-    if retain_degree:
-        degrees = [vs.degree() for vs in graph.vs]
-        percentiles = np.percentile(degrees, np.arange(5, 100, 5)) 
-        tools_by_percentile = {f'{i*5+5}th': [] for i in range(20)}  # Creating bins for every 5 percentiles
-        for vs in graph.vs:
-            degree = vs.degree()
-            bin_percentile = get_percentile_bin(degree, percentiles)
-            tools_by_percentile[bin_percentile].append(vs['pmid'])
-
-
-    pmid_mapping = {None:None} # None will always map back to none
-    for step in list(steps.items()):
-        pmid = step[1]
-        if pmid in pmid_mapping.keys():
-            continue
-        if retain_degree:
-            degree = next(vs.degree() for vs in graph.vs if vs['pmid'] == pmid)
-            bin_percentile = get_percentile_bin(degree, percentiles)
-            tool_list = tools_by_percentile[bin_percentile]
-   
-        random_pmid = np.random.choice(tool_list)
-        pmid_mapping[pmid] = random_pmid
-
-    for edge in edges:
-        source_name = edge[0]
-        target_name = edge[1]
-
-        if not steps[source_name]:
-            random_source_name = "MISSINGTOOL" + f'_{source_name.split("_")[1]}'
-            random_source_pmid = None
-            random_steps[random_source_name] = random_source_pmid # there is some repetition here
+    def __init__(self,
+                 graph: igraph.Graph,
+                 tool_list: Optional[list] = None,
+                 retain_degree: bool = True,
+                 rng: Optional[np.random.Generator] = None):
+        """
+        :param graph: igraph.Graph object representing a co-citation graph.
+        :param tool_list: Optional list of PMIDs to pick the random tools from (only used if
+            retain_degree is False). Defaults to all tools in the graph.
+        :param retain_degree: If True, every tool is replaced by one from the same 5-percentile
+            degree bin. Default is True.
+        :param rng: Optional numpy.random.Generator, or a seed, used for the draws.
+
+        :raises KeyError: If a PMID in the tool_list is not in the graph.
+        """
+        self.retain_degree = retain_degree
+        self.rng = np.random.default_rng(rng)
+        self.pmids = graph.vs['pmid'] if graph.vcount() else []
+        self.pmid_names = pubmetric.workflow.get_tool_index(graph).pmid_names
+        self.pmid_vertices = {}
+        for vertex, pmid in enumerate(self.pmids):
+            self.pmid_vertices.setdefault(pmid, vertex)
+
+        degrees = np.array(graph.degree(), dtype=np.int64)
+        if len(degrees):
+            self.percentiles = np.percentile(degrees, np.arange(5, 100, 5))
         else:
-            random_source_pmid = pmid_mapping[steps[source_name]]
-            random_source_name = next(vs['name'] for vs in graph.vs if vs['pmid']== random_source_pmid) + f'_{source_name.split("_")[1]}' # transfering numbering to random steps
-
-        if not steps[target_name]:
-            random_target_name = "MISSINGTOOL" + f'_{target_name.split("_")[1]}' 
-            random_target_pmid = None
-            random_steps[random_target_name] = random_target_pmid
+            self.percentiles = np.zeros(19)
+        # index of the first percentile the degree is less than or equal to, as get_percentile_bin
+        self.vertex_bins = np.searchsorted(self.percentiles, degrees, side='left')
+        order = np.argsort(self.vertex_bins, kind='stable')
+        bounds = np.searchsorted(self.vertex_bins[order], np.arange(21))
+        self.bins = [order[bounds[i]:bounds[i + 1]] for i in range(20)]
+
+        if tool_list is None:
+            self.tool_vertices = np.arange(len(self.pmids))
         else:
-            random_target_pmid = pmid_mapping[steps[target_name]]
-            random_target_name = next(vs['name'] for vs in graph.vs if vs['pmid']== random_target_pmid) + f'_{target_name.split("_")[1]}'
+            self.tool_vertices = np.array([self.vertex(pmid) for pmid in tool_list], dtype=np.int64)
 
-        random_edges.append( (random_source_name, random_target_name ) )
-        random_pmid_edges.append( (random_source_pmid, random_target_pmid) )
+    def vertex(self, pmid: str) -> int:
+        """
+        Returns the index of the first vertex with the given PMID.
 
-        random_steps[random_source_name] = random_source_pmid # there is some repetition here but 
-        random_steps[random_target_name] = random_target_pmid
+        :raises KeyError: If the PMID is not in the graph.
+        """
+        try:
+            return self.pmid_vertices[pmid]
+        except KeyError:
+            raise KeyError(f"PMID {pmid} is not in the graph.") from None
+
+    def candidates(self, pmid: str) -> np.ndarray:
+        """
+        Returns the vertex indices a tool can be replaced with.
+
+        :param pmid: PMID of the tool.
+
+        :return: Array of vertex indices, the tools in the same degree bin if the degree is
+            retained and the tool list otherwise.
+        """
+        if self.retain_degree:
+            return self.bins[self.vertex_bins[self.vertex(pmid)]]
+        return self.tool_vertices
+
+    def sample(self, workflow: dict, size: int = 1, rng: Optional[np.random.Generator] = None) -> list:
+        """
+        Draws random workflows with the same structure as the given workflow. Every tool is
+        replaced by a random one, the same one wherever it occurs in the workflow, and steps
+        without a PMID are kept as MISSINGTOOL steps.
+
+        :param workflow: Dictionary representing the workflow, as returned by parse_cwl.
+        :param size: Number of random workflows. Default is 1.
+        :param rng: Optional numpy.random.Generator overriding the one of the sampler.
+
+        :raises KeyError: If a tool of the workflow is not in the graph.
+
+        :return: List of dictionaries with the edges, steps and pmid_edges of the random workflows.
+        """
+        rng = self.rng if rng is None else rng
+        steps = workflow['steps']
+        tools = [pmid for pmid in dict.fromkeys(steps.values()) if pmid is not None]
+        columns = {pmid: column for column, pmid in enumerate(tools)}
+
+        draws = np.empty((size, len(tools)), dtype=np.int64)
+        for column, pmid in enumerate(tools):
+            pool = self.candidates(pmid)
+            draws[:, column] = pool[rng.integers(len(pool), size=size)]
+
+        # every edge end is either a fixed missing step, or a draw column with the step number
+        ends = []
+        for edge in workflow['edges']:
+            for name in edge[:2]:
+                number = name.split("_")[1]
+                if steps[name]:
+                    ends.append((columns[steps[name]], f'_{number}'))
+                else:
+                    ends.append((None, "MISSINGTOOL" + f'_{number}'))
+
+        random_workflows = []
+        for row in draws.tolist():
+            random_pmids = [self.pmids[vertex] for vertex in row]
+            random_names = [self.pmid_names[pmid] for pmid in random_pmids]
+            random_steps = {}
+            random_edges = []
+            random_pmid_edges = []
+            for i in range(0, len(ends), 2):
+                edge_names = []
+                edge_pmids = []
+                for column, suffix in ends[i:i + 2]:
+                    if column is None:
+                        edge_names.append(suffix)
+                        edge_pmids.append(None)
+                        random_steps[suffix] = None
+                    else:
+                        edge_names.append(random_names[column] + suffix)
+                        edge_pmids.append(random_pmids[column])
+                random_edges.append(tuple(edge_names))
+                random_pmid_edges.append(tuple(edge_pmids))
+                random_steps[edge_names[0]] = edge_pmids[0]
+                random_steps[edge_names[1]] = edge_pmids[1]
+
+            random_workflows.append({
+                'edges': random_edges,
+                'steps': random_steps,
+                'pmid_edges': random_pmid_edges
+            })
+        return random_workflows
+
+def get_random_workflow_sampler(graph: igraph.Graph) -> RandomWorkflowSampler:
+    """
+    Returns a degree retaining RandomWorkflowSampler of a graph, building it on first use
+    and rebuilding it if the number of vertices or edges changed.
 
+    :param graph: igraph.Graph object representing a co-citation graph.
 
-    random_workflow = {
-        'edges': random_edges,
-        'steps': random_steps,
-        'pmid_edges': random_pmid_edges
-    }
+    :return: The RandomWorkflowSampler of the graph.
+    """
+    cache = pubmetric.metrics.graph_cache(graph)
+    sampler, counts = cache.get('random_workflow_sampler', (None, None))
+    if sampler is None or counts != (graph.vcount(), graph.ecount()):
+        sampler = RandomWorkflowSampler(graph)
+        cache['random_workflow_sampler'] = (sampler, (graph.vcount(), graph.ecount()))
+    return sampler
+
+def generate_random_workflow(graph: igraph.Graph,
+                             workflow: dict,
+                             tool_list: Optional[list] = None,
+                             retain_degree: bool = True,
+                             rng: Optional[np.random.Generator] = None) -> dict:
+    """
+    Generates a workflow of the same structure as the given workflow, but where each tool is replaced with a randomly picked one from the given set.
+    Use a RandomWorkflowSampler directly to draw many workflows.
 
-    return random_workflow
+    :param graph: igraph.Graph object representing a co-citation graph.
+    :param workflow: Dictionary representing the workflow.
+    :param tool_list: Optional if the user wants to specify the list of tools to pick from (only works if retain degree is set to False). Generally this should be all tools in the domain.
+    :param retain_degree: If True, every tool is replaced by one of similar degree. Default is True.
+    :param rng: Optional numpy.random.Generator. Defaults to one seeded from the global numpy random state, so np.random.seed still applies.
+
+    :return: Dictionary with the edges, steps and pmid_edges of the random workflow.
+    """
+    if rng is None:
+        rng = np.random.default_rng(np.random.randint(2**32, dtype=np.uint64))
+    if retain_degree:
+        sampler = get_random_workflow_sampler(graph)
+    else:
+        sampler = RandomWorkflowSampler(graph, tool_list=tool_list, retain_degree=False)
+    return sampler.sample(workflow, rng=rng)[0]
 
 
 def break_workflow(workflow: list, replacing_tools: list) -> list:
@@ -198,6 +294,326 @@ def reconnect_edges(missing_node, workflow):
         for target in targets:
             reconnected_edges.append((source, target))
     return reconnected_edges
+
+
+PERTURBATIONS = ('replace', 'rewire', 'delete')
+
+class WorkflowCorpus:
+    """
+    Array encoding of a list of workflows given as PMID edges, e.g. the pmid_workflow
+    entries of the rated dataset. The PMIDs are encoded as integer codes into the tools
+    list (-1 for None), and the edges of all workflows are concatenated, the edges of
+    workflow i being sources[offsets[i]:offsets[i+1]] and targets[offsets[i]:offsets[i+1]].
+    """
+    def __init__(self, workflows: list, ids: Optional[list] = None, tools: Optional[list] = None):
+        """
+        :param workflows: List of workflows, each a list of (source, target) PMID tuples or lists.
+        :param ids: Optional list of identifiers of the workflows. Defaults to their positions.
+        :param tools: Optional list of PMIDs to include in the tool codes, such as the tools
+            used for replacements.
+        """
+        self.ids = list(ids) if ids is not None else list(range(len(workflows)))
+        if len(self.ids) != len(workflows):
+            raise ValueError("The number of ids does not match the number of workflows.")
+        codes = {None: -1}
+        self.tools = []
+        for pmid in (tools or []):
+            if pmid not in codes:
+                codes[pmid] = len(self.tools)
+                self.tools.append(pmid)
+        lengths = [len(workflow) for workflow in workflows]
+        self.offsets = np.zeros(len(workflows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        ends = np.empty(2 * self.offsets[-1], dtype=np.int32)
+        i = 0
+        for workflow in workflows:
+            for edge in workflow:
+                for pmid in edge[:2]:
+                    code = codes.get(pmid)
+                    if code is None:
+                        code = codes[pmid] = len(self.tools)
+                        self.tools.append(pmid)
+                    ends[i] = code
+                    i += 1
+        self.sources = ends[0::2]
+        self.targets = ends[1::2]
+        self.codes = codes
+        self._vocabulary = np.array(self.tools + [None], dtype=object) # code -1 is None
+
+        # the distinct tools of every workflow, sorted by code, ignoring None
+        tool_owners = np.repeat(np.arange(len(workflows)), 2 * np.diff(self.offsets))
+        pairs = np.unique(np.stack([tool_owners, np.stack([self.sources, self.targets], axis=1).ravel()]),
+                          axis=1) if len(ends) else np.empty((2, 0), dtype=np.int64)
+        pairs = pairs[:, pairs[1] >= 0]
+        self.workflow_tools = pairs[1]
+        self.tool_offsets = np.searchsorted(pairs[0], np.arange(len(workflows) + 1))
+        # sorted (workflow, tool) keys, to search the tools of many workflows at once
+        self._workflow_tool_keys = pairs[0] * len(self.tools) + pairs[1]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def encode(self, pmids: list) -> np.ndarray:
+        """
+        Returns the codes of the given PMIDs.
+
+        :raises KeyError: If a PMID is not in the corpus.
+        """
+        return np.array([self.codes[pmid] for pmid in pmids], dtype=np.int32)
+
+    def decode(self, codes: np.ndarray) -> list:
+        """Returns the PMIDs of the given codes, None for -1."""
+        return self._vocabulary[codes].tolist()
+
+    def workflow(self, i: int) -> list:
+        """Returns workflow i as a list of (source, target) PMID tuples."""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return list(zip(self.decode(self.sources[start:end]), self.decode(self.targets[start:end])))
+
+def _expand_variants(corpus: WorkflowCorpus, workflows: np.ndarray, nr_variants: int) -> tuple:
+    """
+    Repeats the edges of every workflow once per variant.
+
+    :return: Tuple of the workflow of every variant, the variant of every edge, the start
+        of the edges of every variant, and the sources and targets of the edges.
+    """
+    variant_workflows = np.repeat(workflows, nr_variants)
+    lengths = corpus.offsets[variant_workflows + 1] - corpus.offsets[variant_workflows]
+    variant_starts = np.zeros(len(variant_workflows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=variant_starts[1:])
+    edge_variants = np.repeat(np.arange(len(variant_workflows)), lengths)
+    edges = (corpus.offsets[variant_workflows][edge_variants]
+             + np.arange(variant_starts[-1]) - variant_starts[edge_variants])
+    return (variant_workflows, edge_variants, variant_starts,
+            corpus.sources[edges], corpus.targets[edges])
+
+def _random_tools(corpus: WorkflowCorpus, variant_workflows: np.ndarray, rng: np.random.Generator,
+                  exclude: tuple = ()) -> np.ndarray:
+    """
+    Picks a random tool of the workflow of every variant, avoiding the excluded tools of the
+    variant. Variants whose workflow has no other tool get -1.
+
+    :param exclude: Tuple of arrays with a tool code (or -1 for none) per variant.
+    """
+    starts = corpus.tool_offsets[variant_workflows]
+    nr_tools = corpus.tool_offsets[variant_workflows + 1] - starts
+    if not exclude:
+        return corpus.workflow_tools[starts + rng.integers(nr_tools)]
+    # positions of the excluded tools among the tools of the workflow, which are sorted
+    positions = []
+    for i, tools in enumerate(exclude):
+        position = np.searchsorted(corpus._workflow_tool_keys,
+                                   variant_workflows * len(corpus.tools) + np.maximum(tools, 0))
+        found = position < starts + nr_tools
+        position = np.minimum(position, len(corpus.workflow_tools) - 1)
+        excluded = (tools >= 0) & found & (corpus.workflow_tools[position] == tools)
+        for previous in exclude[:i]: # a tool excluded twice is only skipped once
+            excluded &= tools != previous
+        positions.append(np.where(excluded, position, np.iinfo(np.int64).max))
+    positions = np.sort(np.stack(positions), axis=0)
+    nr_candidates = nr_tools - (positions < np.iinfo(np.int64).max).sum(axis=0)
+    picks = starts + rng.integers(np.maximum(nr_candidates, 1))
+    for position in positions: # in ascending order, so the picks skip every excluded tool
+        picks += picks >= position
+    return np.where(nr_candidates > 0,
+                    corpus.workflow_tools[np.minimum(picks, len(corpus.workflow_tools) - 1)], -1)
+
+def _perturb_chunk(corpus: WorkflowCorpus,
+                   workflows: np.ndarray,
+                   perturbation: str,
+                   nr_variants: int,
+                   replacing_tools: np.ndarray,
+                   rng: np.random.Generator) -> tuple:
+    """
+    Perturbs every workflow of a chunk nr_variants times.
+
+    :return: Tuple of the workflow of every variant, the replaced tool and its replacement
+        of every variant, the start of the edges of every variant, and the sources and
+        targets of the perturbed edges. Variants that can not be rewired have -1 as
+        replacement.
+    """
+    variant_workflows, edge_variants, variant_starts, sources, targets = _expand_variants(
+        corpus, workflows, nr_variants)
+    nr_perturbed = len(variant_workflows)
+
+    if perturbation == 'replace': # as break_workflow
+        tools = _random_tools(corpus, variant_workflows, rng)
+        replacements = replacing_tools[rng.integers(len(replacing_tools), size=nr_perturbed)]
+        edge_tools = tools[edge_variants]
+        replaced_sources = sources == edge_tools
+        replaced_targets = (targets == edge_tools) & ~replaced_sources
+        sources = np.where(replaced_sources, replacements[edge_variants], sources)
+        targets = np.where(replaced_targets, replacements[edge_variants], targets)
+
+    elif perturbation == 'rewire': # one edge gets another target from the workflow
+        lengths = np.diff(variant_starts)
+        rewired = variant_starts[:-1] + rng.integers(lengths)
+        tools = targets[rewired]
+        # neither its old target nor its own source, -1 if there is no other tool
+        replacements = _random_tools(corpus, variant_workflows, rng,
+                                     exclude=(tools, sources[rewired]))
+        targets = targets.copy()
+        targets[rewired] = replacements
+
+    elif perturbation == 'delete': # a tool is removed and its edges reconnected, as reconnect_edges
+        tools = _random_tools(corpus, variant_workflows, rng)
+        replacements = np.full(nr_perturbed, -1, dtype=np.int32)
+        edge_tools = tools[edge_variants]
+        incoming = targets == edge_tools
+        outgoing = sources == edge_tools
+        kept = ~(incoming | outgoing)
+
+        # every source of an incoming edge is connected to every target of an outgoing edge
+        nr_outgoing = np.bincount(edge_variants[outgoing], minlength=nr_perturbed)
+        outgoing_starts = np.zeros(nr_perturbed + 1, dtype=np.int64)
+        np.cumsum(nr_outgoing, out=outgoing_starts[1:])
+        outgoing_targets = targets[outgoing]
+        incoming_variants = edge_variants[incoming]
+        repeats = nr_outgoing[incoming_variants]
+        pair_variants = np.repeat(incoming_variants, repeats)
+        pair_sources = np.repeat(sources[incoming], repeats)
+        block_starts = np.repeat(np.cumsum(repeats) - repeats, repeats)
+        pair_targets = outgoing_targets[outgoing_starts[pair_variants]
+                                        + np.arange(len(pair_variants)) - block_starts]
+
+        edge_variants = np.concatenate([edge_variants[kept], pair_variants])
+        order = np.argsort(edge_variants, kind='stable') # kept edges first, then the new ones
+        edge_variants = edge_variants[order]
+        sources = np.concatenate([sources[kept], pair_sources])[order]
+        targets = np.concatenate([targets[kept], pair_targets])[order]
+        variant_starts = np.searchsorted(edge_variants, np.arange(nr_perturbed + 1))
+
+    else:
+        raise ValueError(f"Unknown perturbation {perturbation}, use one of {PERTURBATIONS}.")
+
+    return variant_workflows, tools, replacements, variant_starts, sources, targets
+
+def perturb_workflows(corpus: WorkflowCorpus,
+                      replacing_tools: Optional[list] = None,
+                      nr_variants: int = 1,
+                      perturbations: tuple = ('replace',),
+                      rng: Optional[np.random.Generator] = None,
+                      chunk_size: int = 1024):
+    """
+    Generates perturbed (broken) variants of all workflows of a corpus, chunk by chunk, so
+    large evaluation datasets never have to be held in memory. Perturbations are:
+        'replace': a random tool is replaced by one of the replacing tools, as break_workflow.
+        'rewire': the target of a random edge is changed to another tool of the workflow,
+            other than its source. Variants of workflows without such a tool are skipped.
+        'delete': a random tool is removed and its neighbours reconnected, as reconnect_edges.
+    Workflows without any tool with a PMID are skipped.
+
+    :param corpus: WorkflowCorpus of the workflows.
+    :param replacing_tools: List of PMIDs to draw replacements from, needed for 'replace'.
+    :param nr_variants: Number of variants of every workflow for every perturbation. Default is 1.
+    :param perturbations: Tuple of the perturbations to apply. Default is ('replace',).
+    :param rng: Optional numpy.random.Generator, or a seed, used for the draws.
+    :param chunk_size: Number of workflows perturbed at once. Default is 1024.
+
+    :raises ValueError: If a perturbation is unknown, or 'replace' is asked without replacing tools.
+
+    :return: Generator of dictionaries with the workflow id, variant number, perturbation,
+        the replaced (or rewired, or deleted) tool, its replacement and the perturbed pmid_workflow.
+    """
+    rng = np.random.default_rng(rng)
+    unknown = set(perturbations) - set(PERTURBATIONS)
+    if unknown:
+        raise ValueError(f"Unknown perturbations {unknown}, use one of {PERTURBATIONS}.")
+    if 'replace' in perturbations and not replacing_tools:
+        raise ValueError("The replace perturbation needs a list of replacing tools.")
+    replacing_codes = np.array([corpus.codes.get(str(pmid), -2) for pmid in replacing_tools or []],
+                               dtype=np.int32)
+    if (replacing_codes == -2).any():
+        corpus = WorkflowCorpus([corpus.workflow(i) for i in range(len(corpus))], ids=corpus.ids,
+                                tools=corpus.tools + [str(pmid) for pmid in replacing_tools])
+        replacing_codes = corpus.encode([str(pmid) for pmid in replacing_tools])
+
+    nr_tools = np.diff(corpus.tool_offsets)
+    workflows = np.flatnonzero(nr_tools > 0)
+    for chunk_start in range(0, len(workflows), chunk_size):
+        chunk = workflows[chunk_start:chunk_start + chunk_size]
+        for perturbation in perturbations:
+            variant_workflows, tools, replacements, variant_starts, sources, targets = _perturb_chunk(
+                corpus, chunk, perturbation, nr_variants, replacing_codes, rng)
+            tools = corpus.decode(tools)
+            replacements = corpus.decode(replacements)
+            edges = corpus.decode(np.stack([sources, targets], axis=1))
+            for i, workflow in enumerate(variant_workflows.tolist()):
+                if perturbation == 'rewire' and replacements[i] is None:
+                    continue # no other tool to rewire the edge to
+                yield {
+                    'id': corpus.ids[workflow],
+                    'variant': i % nr_variants,
+                    'perturbation': perturbation,
+                    'tool': tools[i],
+                    'replacement': replacements[i],
+                    'pmid_workflow': edges[variant_starts[i]:variant_starts[i + 1]]
+                }
+
+def write_perturbed_workflows(corpus: WorkflowCorpus,
+                              outpath: str,
+                              replacing_tools: Optional[list] = None,
+                              nr_variants: int = 1,
+                              perturbations: tuple = ('replace',),
+                              rng: Optional[np.random.Generator] = None,
+                              chunk_size: int = 1024,
+                              file_format: Optional[str] = None) -> int:
+    """
+    Writes perturbed variants of all workflows of a corpus to a JSON lines or Parquet file,
+    as they are generated. See perturb_workflows for the perturbations.
+
+    :param corpus: WorkflowCorpus of the workflows.
+    :param outpath: Path of the output file.
+    :param replacing_tools: List of PMIDs to draw replacements from, needed for 'replace'.
+    :param nr_variants: Number of variants of every workflow for every perturbation. Default is 1.
+    :param perturbations: Tuple of the perturbations to apply. Default is ('replace',).
+    :param rng: Optional numpy.random.Generator, or a seed, used for the draws.
+    :param chunk_size: Number of workflows perturbed, and rows written, at once. Default is 1024.
+    :param file_format: 'jsonl' or 'parquet'. Defaults to the extension of the outpath.
+        Parquet needs the pyarrow package.
+
+    :raises ValueError: If the file format is unknown.
+    :raises ImportError: If Parquet is asked and pyarrow is not installed.
+
+    :return: Number of rows written.
+    """
+    file_format = file_format or os.path.splitext(outpath)[1].lstrip('.').lower()
+    if file_format not in ('jsonl', 'parquet'):
+        raise ValueError(f"Unknown file format {file_format}, use 'jsonl' or 'parquet'.")
+    if os.path.dirname(outpath):
+        os.makedirs(os.path.dirname(outpath), exist_ok=True)
+
+    rows = perturb_workflows(corpus, replacing_tools=replacing_tools, nr_variants=nr_variants,
+                             perturbations=perturbations, rng=rng, chunk_size=chunk_size)
+    nr_rows = 0
+    if file_format == 'jsonl':
+        with open(outpath, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row) + '\n')
+                nr_rows += 1
+        return nr_rows
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Writing Parquet files needs pyarrow, install it with pip install pyarrow.") from e
+    schema = pyarrow.schema([('id', pyarrow.string()), ('variant', pyarrow.int32()),
+                             ('perturbation', pyarrow.string()), ('tool', pyarrow.string()),
+                             ('replacement', pyarrow.string()),
+                             ('pmid_workflow', pyarrow.list_(pyarrow.list_(pyarrow.string())))])
+    with pyarrow.parquet.ParquetWriter(outpath, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append({**row, 'id': str(row['id'])})
+            if len(batch) == chunk_size:
+                writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+                nr_rows += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+            nr_rows += len(batch)
+    return nr_rows
    
 
 
@@ -263,10 +679,63 @@ def stratified_split_usecases(usecases, test_size=0.2, randomseed=42):
 
 
 
-def parse_xml(file_paths, metadata_filename):
+class MetadataIndex:
+    """
+    Lookup of the PMID of every tool name in a metadata file, and of the tool names of
+    every PMID. If several tools share a name, the first one is used.
+    """
+    def __init__(self, metadata_filename: str):
+        """
+        :param metadata_filename: Path to the metadata JSON file, as created by get_tool_metadata.
+        """
+        self.path = os.path.abspath(metadata_filename)
+        self.mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, "r") as f:
+            self.tools = json.load(f)['tools']
+        self.name_pmids = {}
+        self.pmid_names = {}
+        for tool in self.tools:
+            self.name_pmids.setdefault(tool['name'], tool['pmid'])
+            self.pmid_names.setdefault(tool['pmid'], []).append(tool['name'])
+
+    def is_current(self) -> bool:
+        """Returns True if the metadata file has not been changed since it was loaded."""
+        try:
+            return os.stat(self.path).st_mtime_ns == self.mtime
+        except FileNotFoundError:
+            return False
+
+    def pmid(self, name: str) -> Optional[str]:
+        """Returns the PMID of a tool name, or None if it is not in the metadata."""
+        return self.name_pmids.get(name)
+
+    def names(self, pmid: str) -> list:
+        """Returns the names of the tools with the given PMID."""
+        return self.pmid_names.get(pmid, [])
+
+_metadata_indexes = {}
+
+def get_metadata_index(metadata_filename: str) -> MetadataIndex:
+    """
+    Returns the MetadataIndex of a metadata file, loading it on first use and reloading it
+    if the file was modified.
+
+    :param metadata_filename: Path to the metadata JSON file.
+
+    :return: The MetadataIndex of the file.
+    """
+    path = os.path.abspath(metadata_filename)
+    index = _metadata_indexes.get(path)
+    if index is None or not index.is_current():
+        index = _metadata_indexes[path] = MetadataIndex(path)
+    return index
+
+def parse_xml(file_paths, metadata_filename: Optional[str] = None, metadata_index: Optional[MetadataIndex] = None):
     """ Function to parse the xml files from the APE in the wild paper. 
     Saving each workflow as a list of tuples instead, along with other meta data in a dictionary """
-    
+    if metadata_index is None:
+        metadata_index = get_metadata_index(metadata_filename)
+
     usecases = []
     id_ = 1
 
@@ -281,7 +750,7 @@ def parse_xml(file_paths, metadata_filename):
                 workflow_steps = row[3].split(' -> ')
                 workflow_tuples = [(workflow_steps[j], workflow_steps[j+1]) for j in range(len(workflow_steps) - 1)]
                 
-                pmid_workflow_tuples = convert_workflow_to_pmid_tuples([workflow_tuples], metadata_filename)[0] # expects and outputs list
+                pmid_workflow_tuples = convert_workflow_to_pmid_tuples([workflow_tuples], metadata_index=metadata_index)[0] # expects and outputs list
                 
                 usecase_data = {
                     'ratingAvg': float(row[0]),
@@ -335,97 +804,111 @@ def parse_xml_unseparated_usecases(file_paths):
     return data
 
 
-def pmid_name_converter(id_, metadata_filename): # TODO change to json 
+def pmid_name_converter(id_, metadata_filename: Optional[str] = None, metadata_index: Optional[MetadataIndex] = None): # TODO change to json 
     """ 
-    Retrieves a list of all of the pmids for the primary publications in the data file 
+    Converts a tool name to its PMID, or a PMID given as an int to the names of its tools.
     
     Parameters
     ----------
-    id : str or int [needs to be int to count as pmid]
-        the id (pmid or name) you want to switch to the other type (name or pmid)
-    filename : str
+    id_ : str or int [needs to be int to count as pmid]
+        the id (pmid or name) you want to switch to the other type (name or pmid).
+        A PMID given as a str is looked up as a name.
+    metadata_filename : str, optional
         the name of the json file from which the script retrieves the pmids
+    metadata_index : MetadataIndex, optional
+        the loaded metadata, used instead of the file
+
+    Returns
+    -------
+    list or str or None
+        for an int PMID, the list of names of the tools with that PMID (empty if there are
+        none); for a name, the PMID of the tool as a str, or None if it has no PMID.
     """
-    with open(metadata_filename, "r") as f:
-        metadata_file = json.load(f)
+    if metadata_index is None:
+        metadata_index = get_metadata_index(metadata_filename)
 
-    tools = metadata_file['tools']
-    
-    if type(id) == int: # pmid
-        try:
-            name = [tool['name'] for tool in tools if tool['pmid'] == id_]
-            return name
-        except:
-            return None
-    else:
-        try: 
-            pmid = [tool['pmid'] for tool in tools if tool['name'] == id_]
-            return pmid[0]
-        except:
-            print(f"No available pmid for {id_}")
-            return None
-        
+    if isinstance(id_, int): # pmid
+        return metadata_index.names(str(id_))
 
+    pmid = metadata_index.pmid(id_)
+    if pmid is None:
+        print(f"No available pmid for {id_}")
+    return pmid
 
-def convert_workflow_to_pmid_tuples(workflows, metadata_filename):
-    """ given a workflow represented as a list of tuples (edges) where the source and targets are tool names, this function converts them to tuples of PmIDs"""
+
+def convert_workflow_to_pmid_tuples(workflows, metadata_filename: Optional[str] = None, metadata_index: Optional[MetadataIndex] = None):
+    """ given a workflow represented as a list of tuples (edges) where the source and targets are tool names, this function converts them to tuples of PmIDs.
+    The metadata is read from the metadata_index if given, and otherwise from the (cached) metadata file."""
+    if metadata_index is None:
+        metadata_index = get_metadata_index(metadata_filename)
 
     pmid_workflows = []
     for workflow in workflows:
         pmid_edges = []
         for edge in workflow:
-            pmid_edges.append( ( pmid_name_converter(edge[0], metadata_filename), pmid_name_converter(edge[1], metadata_filename) ) )
+            pmid_edges.append( ( pmid_name_converter(edge[0], metadata_index=metadata_index), pmid_name_converter(edge[1], metadata_index=metadata_index) ) )
         pmid_workflows.append(pmid_edges)
 
     return pmid_workflows
 
-def avg_rating(repeated_workflows, workflow_json, metadata_filename =''):
-    """calculates the average rating for workflows that are repeated within the dataset""" #TODO: Look at how much these vary for each expert  
-    repeated_workflow_ratings = {
-        workflow: [ next(item['ratingAvg'] for item in workflow_json if item['id'] == id_) for id_ in ids]
-        for workflow, ids in repeated_workflows.items()
-    }
+def workflow_key(workflow: list) -> tuple:
+    """
+    Returns a canonical, hashable key of a workflow given as a list of edges, which is the
+    same for workflows with the same edges in any order.
 
-    new_workflow_json = copy.deepcopy(workflow_json)
-    for workflow, ids in repeated_workflows.items():
-        for id_ in ids:
-            for item in workflow_json:
-                if item['id'] == id_:
-                    new_workflow_json.remove(item)
-    
-    new_workflow_json_repeated = []
-    for workflow, ids in repeated_workflows.items():
-        new_workflow_json_repeated.append({'ratingAvg': float(np.mean(repeated_workflow_ratings[workflow])), 
-                                  'workflow': ast.literal_eval(workflow),
-                                  'pmid_workflow': convert_workflow_to_pmid_tuples([ast.literal_eval(workflow)], metadata_filename)[0]})
+    :param workflow: List of (source, target) tuples or lists.
+
+    :return: Sorted tuple of the edges as tuples.
+    """
+    return tuple(sorted(tuple(edge) for edge in workflow))
 
+def avg_rating(repeated_workflows, workflow_json, metadata_filename ='', metadata_index: Optional[MetadataIndex] = None):
+    """
+    Calculates the average rating for workflows that are repeated within the dataset.
+
+    :param repeated_workflows: Dictionary mapping workflow keys to the ids of the records of that workflow.
+    :param workflow_json: List of the rated workflow records, with a unique 'id'.
+    :param metadata_filename: Path to the metadata file, used to convert the repeated workflows to PMIDs.
+    :param metadata_index: Optional MetadataIndex used instead of the metadata file.
+
+    :return: List of the records that are not repeated, the averaged records of the repeated
+        workflows, and both together. The records are not copied.
+    """ #TODO: Look at how much these vary for each expert  
+    records = {item['id']: item for item in workflow_json}
+    repeated_ids = {id_ for ids in repeated_workflows.values() for id_ in ids}
+    new_workflow_json = [item for item in workflow_json if item['id'] not in repeated_ids]
+
+    # one grouped pass over the ratings of all repeated workflows
+    ratings = pd.DataFrame({
+        'workflow': [i for i, ids in enumerate(repeated_workflows.values()) for _ in ids],
+        'ratingAvg': [records[id_]['ratingAvg'] for ids in repeated_workflows.values() for id_ in ids]
+    })
+    mean_ratings = ratings.groupby('workflow', sort=True)['ratingAvg'].mean().tolist()
+
+    new_workflow_json_repeated = []
+    for mean_rating, ids in zip(mean_ratings, repeated_workflows.values()):
+        workflow = sorted(records[ids[0]]['workflow'])
+        new_workflow_json_repeated.append({'ratingAvg': float(mean_rating),
+                                  'workflow': workflow,
+                                  'pmid_workflow': convert_workflow_to_pmid_tuples([workflow], metadata_filename, metadata_index)[0]})
 
     return [new_workflow_json, new_workflow_json_repeated, new_workflow_json + new_workflow_json_repeated]
 
-def unique_workflows(workflow_json, metadata_filename):
+def unique_workflows(workflow_json, metadata_filename: Optional[str] = None, metadata_index: Optional[MetadataIndex] = None):
     """ 
     Takes all workflows in the APE in the wild dataset and returns only the unique ones, where repeated workflows are given the average rating of all ratings they recieved. 
+    Workflows are the same if they have the same edges, in any order.
     """
-    all_workflows = {workflow['id']: str(sorted(workflow['workflow'])) for workflow in workflow_json} # making them sorted lists, so they arte hashable
-    unique_workflows = {}
-    repeated_workflows = {}
+    workflow_ids = {}
+    for workflow in workflow_json:
+        workflow_ids.setdefault(workflow_key(workflow['workflow']), []).append(workflow['id'])
 
-    for id_, workflow in all_workflows.items():
-        if workflow not in unique_workflows.values() and  workflow not in repeated_workflows.values()  :
-            unique_workflows[id_] = workflow
-        else:
-            if workflow in repeated_workflows.values(): # add new instance to 
-                repeated_workflows[workflow].append(id_)
-            else:
-                repeated_workflows[workflow] = [id_]
-
-            # Remove original form unique_workflows and move it to repeated
-            original_id = next(key for key, value in unique_workflows.items() if value == workflow)
-            del unique_workflows[original_id]
-            repeated_workflows[workflow].append(original_id)
-            
+    # ordered by the second occurrence, as the workflows are found to be repeated
+    repeated_workflows = {key: ids for key, ids in workflow_ids.items() if len(ids) > 1}
+    second_positions = {id_: position for position, id_ in enumerate(item['id'] for item in workflow_json)}
+    repeated_workflows = dict(sorted(repeated_workflows.items(), key=lambda item: second_positions[item[1][1]]))
 
-    return avg_rating(repeated_workflows, workflow_json, metadata_filename)
+    return avg_rating(repeated_workflows, workflow_json, metadata_filename, metadata_index)
 
 
 
@@ -0,0 +1,240 @@
+"""
+Rate limited, retrying requests and request statistics for the asynchronous downloads
+"""
+import time
+import asyncio
+import statistics
+from typing import Optional
+from urllib.parse import urlparse
+
+import aiohttp
+
+from .cache import ResponseCache
+from .exceptions import CacheMissError
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the number of requests per second. Tokens are refilled
+    continuously at the given rate, up to the capacity of the bucket.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        :param rate: Maximum sustained number of requests per second.
+        :param capacity: Maximum number of requests that can be made in a burst.
+            Defaults to the rate (at least 1).
+        """
+        self.rate = rate
+        self.max_rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.blocked_until = 0.0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Waits until a token is available and consumes it."""
+        async with self._lock: # requests are served in order of arrival
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostRateLimiter:
+    """
+    Keeps one token bucket per host and adapts its rate to the responses; the rate is
+    halved when a server answers with 429 or 5xx and slowly restored after successes.
+    """
+    def __init__(self,
+                 default_rate: float = 10.0,
+                 host_rates: Optional[dict] = None,
+                 min_rate: float = 0.5,
+                 recovery: float = 0.1):
+        """
+        :param default_rate: Requests per second for hosts without a configured rate.
+        :param host_rates: Dictionary mapping host names (e.g. 'www.ebi.ac.uk') to their
+            maximum number of requests per second.
+        :param min_rate: The lowest rate the adaptive backoff can reduce a host to.
+        :param recovery: Fraction of the configured rate that is restored after every
+            successful request.
+        """
+        self.default_rate = default_rate
+        self.host_rates = host_rates or {}
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.buckets = {}
+
+    def bucket(self, url: str) -> TokenBucket:
+        """Returns the token bucket of the host of the url, creating it if needed."""
+        host = urlparse(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.host_rates.get(host, self.default_rate))
+        return self.buckets[host]
+
+    async def acquire(self, url: str):
+        """Waits until a request to the host of the url is allowed."""
+        await self.bucket(url).acquire()
+
+    def penalise(self, url: str, retry_after: Optional[float] = None):
+        """
+        Halves the rate of the host of the url, and pauses it if the server asked
+        for it with a Retry-After header.
+
+        :param url: The url of the throttled or failed request.
+        :param retry_after: Seconds to wait before the next request to the host.
+        """
+        bucket = self.bucket(url)
+        bucket.rate = max(self.min_rate, bucket.rate / 2)
+        bucket.tokens = min(bucket.tokens, 0.0)
+        if retry_after:
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+
+    def reward(self, url: str):
+        """Increases the rate of the host of the url towards its configured rate."""
+        bucket = self.bucket(url)
+        bucket.rate = min(bucket.max_rate, bucket.rate + self.recovery * bucket.max_rate)
+
+
+class RequestStats:
+    """
+    Collects throughput and latency statistics of the requests made during a download.
+    """
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.latencies = []
+        self.failures = 0
+        self.retries = 0
+        self.throttled = 0
+
+    def record(self, latency: float):
+        """Records a successful request and its latency in seconds."""
+        self.latencies.append(latency)
+
+    def record_retry(self, status: Optional[int] = None):
+        """Records a failed attempt that will be retried."""
+        self.retries += 1
+        if status == 429:
+            self.throttled += 1
+
+    def record_failure(self):
+        """Records a request that failed after all retries."""
+        self.failures += 1
+
+    def summary(self) -> dict:
+        """
+        Summarises the recorded requests.
+
+        :return: Dictionary with the number of successful, retried, throttled and failed
+            requests, the throughput in requests per second and the mean, median and
+            95th percentile latency in seconds.
+        """
+        elapsed = time.monotonic() - self.start_time
+        latencies = sorted(self.latencies)
+        return {
+            'requests': len(latencies),
+            'retries': self.retries,
+            'throttled': self.throttled,
+            'failures': self.failures,
+            'requests_per_second': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            'latency_mean': round(statistics.mean(latencies), 3) if latencies else None,
+            'latency_p50': round(latencies[len(latencies) // 2], 3) if latencies else None,
+            'latency_p95': round(latencies[int(len(latencies) * 0.95)], 3) if latencies else None
+        }
+
+
+async def request_json(session: aiohttp.ClientSession,
+                       url: str,
+                       data: Optional[dict] = None,
+                       limiter: Optional[HostRateLimiter] = None,
+                       stats: Optional[RequestStats] = None,
+                       retries: int = 3,
+                       backoff: float = 2.0,
+                       cache: Optional[ResponseCache] = None,
+                       cache_ttl: Optional[float] = None) -> dict:
+    """
+    Makes a GET request (or a POST request if data is given) and returns the JSON response.
+    Connection errors, 429 and 5xx responses are retried with exponential backoff, honouring
+    the Retry-After header of the server. If a cache is given the response is served from
+    it when possible, and stored in it otherwise.
+
+    :param session: aiohttp.ClientSession object used for making the request.
+    :param url: URL for the request.
+    :param data: Optional form data, sent in a POST request.
+    :param limiter: Optional HostRateLimiter which is waited for before every attempt, and
+        which is slowed down on 429 and 5xx responses.
+    :param stats: Optional RequestStats object in which the request is recorded.
+    :param retries: Maximum number of attempts. Default is 3.
+    :param backoff: Base of the exponential wait time between attempts. Default is 2.0.
+    :param cache: Optional ResponseCache.
+    :param cache_ttl: Optional time to live in seconds of the cached response, overriding
+        the default of the cache.
+
+    :raises aiohttp.ClientResponseError: If the server answers with a client error other than 429.
+    :raises CacheMissError: If the cache is offline and the response is not cached.
+    :raises Exception: If the request still fails after all attempts.
+
+    :return: JSON response from the request.
+    """
+    if cache:
+        cache_key = cache.key(url, data)
+        cached_result = cache.get(cache_key, ttl=cache_ttl)
+        if cached_result is not None:
+            return cached_result
+        if cache.offline:
+            raise CacheMissError(f"{url} is not in the response cache.")
+
+    attempt = 0
+    while attempt < retries:
+        if limiter:
+            await limiter.acquire(url)
+        start_time = time.monotonic()
+        retry_after = None
+        status = None
+        try:
+            method = 'POST' if data is not None else 'GET'
+            async with session.request(method, url, data=data) as response:
+                status = response.status
+                if status == 429 or status >= 500:
+                    retry_after = response.headers.get('Retry-After')
+                    retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+                    if limiter:
+                        limiter.penalise(url, retry_after)
+                response.raise_for_status()
+                result = await response.json(content_type=None)
+        except aiohttp.ClientResponseError as e:
+            if e.status != 429 and e.status < 500:
+                if stats:
+                    stats.record_failure()
+                raise
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        else:
+            if limiter:
+                limiter.reward(url)
+            if stats:
+                stats.record(time.monotonic() - start_time)
+            if cache:
+                cache.set(cache_key, result, url=url)
+            return result
+
+        attempt += 1
+        if attempt < retries:
+            if stats:
+                stats.record_retry(status)
+            await asyncio.sleep(max(backoff ** attempt, retry_after or 0))
+
+    if stats:
+        stats.record_failure()
+    raise Exception(f"Failed to fetch data from {url} after {retries} attempts.")
@@ -1,36 +1,102 @@
 """Workflow parsing module"""
+import os
+import glob
+import hashlib
+from collections import OrderedDict
+from multiprocessing import Pool
+from typing import Callable, Iterator, Optional, Tuple
+
+import pandas as pd
+
 import igraph
 
 from cwl_utils.parser import load_document_by_uri
 
+import pubmetric.metrics
+
+PARSE_CACHE_SIZE = 4096 # number of parsed files kept in memory
 
 
-def parse_cwl(graph: igraph.Graph, cwl_filename: str) -> list:
+class ToolIndex:
     """
-    Function that turns a CWL representation of a workflow into a list of node tuples 
-        (edges), where source and target is represented by the pmid of their repecitve 
-        primary publication. 
+    Lookup of the PMID of every tool name in a graph, and of the tool name of every PMID.
+    If several vertices share a name or PMID, the first one is used.
+    """
+    def __init__(self, graph: igraph.Graph):
+        """
+        :param graph: igraph.Graph object representing a co-citation graph.
+        """
+        self.vcount = graph.vcount()
+        self.name_pmids = {}
+        self.pmid_names = {}
+        if self.vcount:
+            for name, pmid in zip(graph.vs['name'], graph.vs['pmid']):
+                self.name_pmids.setdefault(name, pmid)
+                self.pmid_names.setdefault(pmid, name)
+
+    def step_pmid(self, step_id: str) -> Optional[str]:
+        """Returns the PMID of the tool of a step, e.g. XTandem_01, or None if it is not in the graph."""
+        return self.name_pmids.get(step_id.split('_')[0])
+
+def get_tool_index(graph: igraph.Graph) -> ToolIndex:
+    """
+    Returns the ToolIndex of a graph, building it on first use and rebuilding it if the
+    number of vertices changed.
 
     :param graph: igraph.Graph object representing a co-citation graph.
-    :param cwl_filename: String representing the path to the CWL file
-
-    :return: List of tuples representing the edges in the workflow.
 
+    :return: The ToolIndex of the graph.
+    """
+    cache = pubmetric.metrics.graph_cache(graph)
+    index = cache.get('tool_index')
+    if index is None or index.vcount != graph.vcount():
+        index = cache['tool_index'] = ToolIndex(graph)
+    return index
+
+_parse_cache = OrderedDict()
+_worker_cached_keys = frozenset() # parse cache keys known to a worker, see iter_cwl_directory
+
+def clear_parse_cache():
+    """Empties the cache of parsed workflow files."""
+    _parse_cache.clear()
+
+def _parse_cache_key(cwl_filename: str, parser: Callable[[str], list]) -> tuple:
+    """Returns the parse cache key of a file: the parser name and the hash of the file content."""
+    with open(cwl_filename, 'rb') as f:
+        return parser.__name__, hashlib.sha256(f.read()).hexdigest()
+
+def _add_to_parse_cache(key: tuple, parsed: tuple):
+    """Adds the step ids and edges of a file to the parse cache, evicting the least recently used."""
+    _parse_cache[key] = parsed
+    if len(_parse_cache) > PARSE_CACHE_SIZE:
+        _parse_cache.popitem(last=False)
+
+def _cached_parse(cwl_filename: str, parser: Callable[[str], list], use_cache: bool = True) -> list:
     """
+    Parses a file with the given parser, which returns the step ids and edges of the workflow.
+    The results are cached by the hash of the file content, so identical files are only
+    parsed once.
+    """
+    if not use_cache:
+        return parser(cwl_filename)
+    key = _parse_cache_key(cwl_filename, parser)
+    if key in _parse_cache:
+        _parse_cache.move_to_end(key)
+    else:
+        _add_to_parse_cache(key, parser(cwl_filename))
+    step_ids, edges = _parse_cache[key]
+    return list(step_ids), list(edges)
+
+def _load_cwl_steps(cwl_filename: str) -> tuple:
+    """Loads the step ids and the edges between the steps of a CWL file with cwl_utils."""
     cwl_obj = load_document_by_uri(cwl_filename)
 
+    step_ids = []
     edges = []
-    workflow_steps = {}
     # Extracting edges from the CWL
     for step in cwl_obj.steps:
         step_id = step.id.split("#")[-1]
-
-        # Collecting all step names, and their corresponding pmids
-        tool_name = step_id.split('_')[0]
-        workflow_steps[step_id] = next((tool['pmid']
-                                        for tool in graph.vs
-                                        if tool['name'] == tool_name),
-                                        None)
+        step_ids.append(step_id)
         for input_param in step.in_:
             if input_param.source:
                 source_step_id = input_param.source.split("#")[-1].split('/')[0]
@@ -38,21 +104,41 @@ def parse_cwl(graph: igraph.Graph, cwl_filename: str) -> list:
                 if "input_" not in source_step_id: # skips the edges between input and tools
 
                     edges.append((source_step_id, step_id))
+    return step_ids, edges
+
+
+
+def parse_cwl(graph: igraph.Graph,
+              cwl_filename: str,
+              use_cache: bool = True,
+              tool_index: Optional[ToolIndex] = None) -> list:
+    """
+    Function that turns a CWL representation of a workflow into a list of node tuples 
+        (edges), where source and target is represented by the pmid of their repecitve 
+        primary publication. 
+
+    :param graph: igraph.Graph object representing a co-citation graph.
+    :param cwl_filename: String representing the path to the CWL file
+    :param use_cache: If True, files with the same content are only parsed once.
+    :param tool_index: Optional ToolIndex of the graph. By default the cached index of the
+        graph is used, see get_tool_index.
+
+    :return: List of tuples representing the edges in the workflow.
+
+    """
+    step_ids, edges = _cached_parse(cwl_filename, _load_cwl_steps, use_cache=use_cache)
+    return _cwl_workflow(tool_index or get_tool_index(graph), step_ids, edges)
+
+def _cwl_workflow(tool_index: ToolIndex, step_ids: list, edges: list) -> dict:
+    """Creates the workflow dictionary of parse_cwl from the parsed step ids and edges."""
+    # Collecting all step names, and their corresponding pmids
+    workflow_steps = {step_id: tool_index.step_pmid(step_id) for step_id in step_ids}
 
     # Saving the edges in pmid format.
     # OBS that this does not maintain the structure of the workflow if a
         # tool is used more than once since both inctances link to the same pmid
-    pmid_edges = []
-    for edge in edges:
-        source_pmid = next((tool['pmid']
-                            for tool in graph.vs
-                            if tool['name'] == edge[0].split('_')[0]),
-                            None)
-        target_pmid = next((tool['pmid']
-                            for tool in graph.vs
-                            if tool['name'] == edge[1].split('_')[0]),
-                            None)
-        pmid_edges.append((str(source_pmid), str(target_pmid)))
+    pmid_edges = [(str(tool_index.step_pmid(source)), str(tool_index.step_pmid(target)))
+                  for source, target in edges]
 
     workflow = {"edges": edges,
                 "steps": dict(sorted(workflow_steps.items(), key=lambda item: item[0][-2:])),   # steps and correspoding pmids, now ordered 
@@ -62,18 +148,105 @@ def parse_cwl(graph: igraph.Graph, cwl_filename: str) -> list:
 
 
 
+def parse_cwl_lines(graph: igraph.Graph,
+                    cwl_filename: str,
+                    use_cache: bool = True,
+                    tool_index: Optional[ToolIndex] = None) -> dict:
+    """
+    Lightweight alternative to parse_cwl, which reads the steps and the sources of their
+    inputs in a single pass over the lines of the file instead of loading the full CWL
+    object model. Supports the block style YAML of APE generated workflows, and gives the
+    same workflow dictionary as parse_cwl for them.
+
+    :param graph: igraph.Graph object representing a co-citation graph.
+    :param cwl_filename: String representing the path to the CWL file
+    :param use_cache: If True, files with the same content are only parsed once.
+    :param tool_index: Optional ToolIndex of the graph. By default the cached index of the
+        graph is used, see get_tool_index.
+
+    :return: Dictionary representing a workflow, with the 'edges' between steps, the
+        'steps' and their PMIDs, and the 'pmid_edges'.
+    """
+    step_ids, edges = _cached_parse(cwl_filename, _scan_cwl_steps, use_cache=use_cache)
+    return _cwl_workflow(tool_index or get_tool_index(graph), step_ids, edges)
+
+def _scan_cwl_steps(cwl_filename: str) -> tuple:
+    """
+    Extracts the step ids and the edges between the steps of a CWL file with a line based
+    state machine. The indentation of the step names, the step fields and the input entries
+    is taken from the first line at each level.
+    """
+    step_ids = []
+    edges = []
+    in_steps = in_inputs = False
+    step_indent = field_indent = input_indent = None
+    input_name = None
+
+    def add_sources(value: str):
+        for source in value.strip('[]').split(','):
+            source_step_id = source.strip().strip('\'"').split('#')[-1].split('/')[0]
+            if source_step_id and "input_" not in source_step_id: # skips the edges between input and tools
+                edges.append((source_step_id, step_ids[-1]))
+
+    with open(cwl_filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            content = line.split(' #')[0].rstrip()
+            stripped = content.lstrip()
+            if not stripped or stripped.startswith('#'):
+                continue
+            indent = len(content) - len(stripped)
+            key, _, value = stripped.partition(':')
+            value = value.strip()
+
+            if indent == 0:
+                in_steps = key == 'steps'
+                in_inputs = False
+                continue
+            if not in_steps:
+                continue
+
+            step_indent = step_indent if step_indent is not None else indent
+            if indent == step_indent: # a new step
+                step_ids.append(key.strip('\'"'))
+                in_inputs = False
+                continue
+            field_indent = field_indent if field_indent is not None else indent
+            if indent == field_indent: # a field of the step, e.g. run, in or out
+                in_inputs = key == 'in'
+                input_indent = None
+                continue
+            if not in_inputs:
+                continue
+
+            input_indent = input_indent if input_indent is not None else indent
+            if indent == input_indent: # an input, with its source given inline or below
+                input_name = key
+                if value and not value.startswith('{'):
+                    add_sources(value)
+                elif value.startswith('{') and 'source:' in value:
+                    add_sources(value.split('source:')[1].split(',')[0].strip(' }'))
+            elif key.strip('- ') == 'source' and input_name:
+                add_sources(value)
+
+    return step_ids, edges
+
+
+
 ### The following are just for APE parsing, should not be icluded in the final package? they are just string parsing so very ustable probably
 
-def parse_tuple_workflow(graph: igraph.Graph, pmid_edges: list):
+def parse_tuple_workflow(graph: igraph.Graph, pmid_edges: list, tool_index: Optional[ToolIndex] = None):
     """"
     Takes a list of tuples of pmids and turns it into the format produced by the parse_cwl function. 
     Note that this representation does not take into account if a workflow has tool repetitions. 
 
     :param pmid_workflow: List of tuples of pmids 
+    :param tool_index: Optional ToolIndex of the graph. By default the cached index of the
+        graph is used, see get_tool_index.
 
     :return: Dictionary of tuples representing the edges in the workflow.
 
     """
+    tool_index = tool_index or get_tool_index(graph)
     steps = {}
     edges = []
 
@@ -81,8 +254,8 @@ def parse_tuple_workflow(graph: igraph.Graph, pmid_edges: list):
         source_pmid = edge[0]
         target_pmid = edge[1]
 
-        source = next((vs['name'] for vs in graph.vs if vs['pmid'] == source_pmid), None) # Transfering id to new tool 
-        target = next((vs['name'] for vs in graph.vs if vs['pmid'] == target_pmid), None)
+        source = tool_index.pmid_names.get(source_pmid) # Transfering id to new tool 
+        target = tool_index.pmid_names.get(target_pmid)
 
         edges.append( (source, target ) )
 
@@ -97,17 +270,47 @@ def parse_tuple_workflow(graph: igraph.Graph, pmid_edges: list):
 
     return workflow   
 
-def parse_undocumented_workflows(graph: igraph.Graph, cwl_filename: str) -> list: #TODO: OBS! this has the old pmid list structure. Change! 
+def parse_undocumented_workflows(graph: igraph.Graph,
+                                 cwl_filename: str,
+                                 use_cache: bool = True,
+                                 tool_index: Optional[ToolIndex] = None) -> list: #TODO: OBS! this has the old pmid list structure. Change! 
     """
     Pipeline for processing CWL files by reading them line by line. 
     Requires certain naming conventions for input/output/tools (e.g. XTandem_out_1 ).. 
     
     :param graph: Cocitation graph
     :param cwl_filename: The path to the CWL file
+    :param use_cache: If True, files with the same content are only parsed once.
+    :param tool_index: Optional ToolIndex of the graph. By default the cached index of the
+        graph is used, see get_tool_index.
 
     :return: Dictionary representing a workflow, where the sources and targets are PmIDs.
 
     """
+    _, edges = _cached_parse(cwl_filename, _split_cwl_steps, use_cache=use_cache)
+    return _undocumented_workflow(tool_index or get_tool_index(graph), edges)
+
+def _undocumented_workflow(tool_index: ToolIndex, edges: list) -> dict:
+    """Creates the workflow dictionary of parse_undocumented_workflows from the parsed edges."""
+    pmid_edges = []
+    step_dict = {}
+    for edge in edges:
+        source_pmid = tool_index.step_pmid(edge[0])
+        target_pmid = tool_index.step_pmid(edge[1])
+
+        pmid_edges.append((str(source_pmid), str(target_pmid)))
+
+        step_dict[edge[0]] = source_pmid 
+        step_dict[edge[1]] = target_pmid 
+
+    workflow = {"edges": edges,
+                "steps": step_dict, # steps and correspoding pmids
+                "pmid_edges": pmid_edges # Dont know if this si necessary, but it is extracted often
+    }
+    return workflow 
+
+def _split_cwl_steps(cwl_filename: str) -> tuple:
+    """Extracts the step ids and the edges between the steps of a CWL file by string splitting."""
     with open(cwl_filename, "r") as f:
         cwl_string = f.read()  
 
@@ -118,7 +321,6 @@ def parse_undocumented_workflows(graph: igraph.Graph, cwl_filename: str) -> list
 
 
     edges = []
-    step_dict = {}
 
     for i in range(len(steps)):
         if i == len(steps) -1: # for the last one, split with outputs
@@ -133,22 +335,7 @@ def parse_undocumented_workflows(graph: igraph.Graph, cwl_filename: str) -> list
         
         edges += step_edges 
 
-
-    pmid_edges = []
-    for edge in edges:
-        source_pmid = next((tool['pmid'] for tool in graph.vs if tool['name'] == edge[0].split('_')[0]), None)
-        target_pmid = next((tool['pmid'] for tool in graph.vs if tool['name'] == edge[1].split('_')[0]), None)
-
-        pmid_edges.append((str(source_pmid), str(target_pmid)))
-
-        step_dict[edge[0]] = source_pmid 
-        step_dict[edge[1]] = target_pmid 
-
-    workflow = {"edges": edges,
-                "steps": step_dict, # steps and correspoding pmids
-                "pmid_edges": pmid_edges # Dont know if this si necessary, but it is extracted often
-    }
-    return workflow 
+    return [step.strip(':') for step in steps], edges
 
 
 def load_undoc_tool(cwl_filename: str) -> list:
@@ -197,5 +384,178 @@ def load_undoc_tool(cwl_filename: str) -> list:
     return edge_list
 
 
+# Bulk parsing of workflow directories
+
+# name: (function extracting the step ids and edges of a file, function creating the workflow)
+PARSERS = {
+    'cwl': (_load_cwl_steps, _cwl_workflow),
+    'lines': (_scan_cwl_steps, _cwl_workflow),
+    'undocumented': (_split_cwl_steps,
+                     lambda tool_index, step_ids, edges: _undocumented_workflow(tool_index, edges))
+}
+
+def _set_worker_cached_keys(cached_keys: frozenset):
+    """Pool initializer handing the keys of the parse cache of the main process to a worker."""
+    global _worker_cached_keys # pylint: disable=global-statement
+    _worker_cached_keys = cached_keys
 
+def _parse_file(task: Tuple[str, str, bool], cached_keys: Optional[frozenset] = None) -> tuple:
+    """
+    Hashes and parses one file in a worker process, returning the error message instead of
+    raising. Files whose key is in cached_keys (by default the keys handed to the worker, see
+    _set_worker_cached_keys) are not parsed, their step ids and edges are returned as None.
+
+    :return: Tuple of the filename, the parse cache key (None without use_cache), the step
+        ids, the edges and the error message.
+    """
+    filename, parser, use_cache = task
+    cached_keys = _worker_cached_keys if cached_keys is None else cached_keys
+    key = None
+    try:
+        if use_cache:
+            key = _parse_cache_key(filename, PARSERS[parser][0])
+            if key in cached_keys:
+                return filename, key, None, None, None
+        step_ids, edges = PARSERS[parser][0](filename)
+    except Exception as e: # pylint: disable=broad-except
+        return filename, key, None, None, f"{type(e).__name__}: {e}"
+    return filename, key, step_ids, edges, None
+
+def iter_cwl_directory(graph: igraph.Graph,
+                       directory: str,
+                       pattern: str = '*.cwl',
+                       parser: str = 'cwl',
+                       processes: Optional[int] = None,
+                       use_cache: bool = True) -> Iterator[dict]:
+    """
+    Parses all workflow files in a directory across a process pool, and yields the
+    workflows as soon as they are parsed. The graph stays in the main process; the workers
+    only hash the files and extract the steps and edges, which are then resolved to PMIDs
+    with the ToolIndex. The keys of the parse cache are handed to the workers once, so
+    that they skip the files that were parsed before.
 
+    :param graph: igraph.Graph object representing a co-citation graph.
+    :param directory: Path to the directory of the workflow files.
+    :param pattern: Glob pattern of the workflow files in the directory. Default is '*.cwl'.
+    :param parser: "cwl" to parse the files like parse_cwl, "lines" to parse them like
+        parse_cwl_lines, or "undocumented" to parse them like parse_undocumented_workflows.
+        Default is "cwl".
+    :param processes: Number of worker processes. Default is the number of CPUs; with 1 the
+        files are parsed in the current process.
+    :param use_cache: If True, files that were parsed before (with the same content) are
+        taken from the parse cache, and newly parsed files are added to it.
+
+    :raises ValueError: If the parser is unknown.
+
+    :return: Iterator over dictionaries with the 'filename', the parsed 'workflow' (None if
+        parsing failed) and the 'error' message (None if parsing succeeded) of every file,
+        in the order in which they are parsed.
+    """
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown parser: {parser}. Options are {sorted(PARSERS)}.")
+    extract_steps, create_workflow = PARSERS[parser]
+    tool_index = get_tool_index(graph)
+
+    # entries of this parser, kept here as they may be evicted while the files are parsed
+    cached = ({key: parsed for key, parsed in _parse_cache.items()
+               if key[0] == extract_steps.__name__}
+              if use_cache else {})
+    cached_keys = frozenset(cached)
+
+    def collect(results):
+        for filename, key, step_ids, edges, error in results:
+            if error:
+                yield {'filename': filename, 'workflow': None, 'error': error}
+                continue
+            if step_ids is None: # parsed before
+                step_ids, edges = cached[key]
+                if key in _parse_cache:
+                    _parse_cache.move_to_end(key)
+                else:
+                    _add_to_parse_cache(key, (step_ids, edges))
+            elif use_cache:
+                _add_to_parse_cache(key, (step_ids, edges))
+            yield {'filename': filename,
+                   'workflow': create_workflow(tool_index, list(step_ids), list(edges)),
+                   'error': None}
+
+    tasks = [(filename, parser, use_cache)
+             for filename in sorted(glob.glob(os.path.join(directory, pattern)))]
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(tasks) < 2:
+        yield from collect(_parse_file(task, cached_keys) for task in tasks)
+    else:
+        with Pool(processes=min(processes, len(tasks)), initializer=_set_worker_cached_keys,
+                  initargs=(cached_keys,)) as pool:
+            yield from collect(pool.imap_unordered(_parse_file, tasks, chunksize=8))
+
+def parse_cwl_directory(graph: igraph.Graph, directory: str, **kwargs) -> Tuple[dict, dict]:
+    """
+    Parses all workflow files in a directory, see iter_cwl_directory.
+
+    :param graph: igraph.Graph object representing a co-citation graph.
+    :param directory: Path to the directory of the workflow files.
+    :param kwargs: Keyword arguments of iter_cwl_directory.
+
+    :return: Dictionary mapping the filenames to their workflows, and dictionary mapping the
+        filenames of the files that could not be parsed to their error messages.
+    """
+    workflows, errors = {}, {}
+    for result in iter_cwl_directory(graph, directory, **kwargs):
+        if result['error']:
+            errors[result['filename']] = result['error']
+        else:
+            workflows[result['filename']] = result['workflow']
+    return workflows, errors
+
+def score_cwl_directory(graph: igraph.Graph,
+                        directory: str,
+                        batch_size: int = 512,
+                        pattern: str = '*.cwl',
+                        parser: str = 'cwl',
+                        processes: Optional[int] = None,
+                        use_cache: bool = True,
+                        **metric_options) -> pd.DataFrame:
+    """
+    Parses and scores all workflow files in a directory. The workflows are scored with
+    pubmetric.metrics.score_workflows_batch in batches as they are parsed, so only one batch
+    of parsed workflows is kept in memory.
+
+    :param graph: igraph.Graph object representing a co-citation graph.
+    :param directory: Path to the directory of the workflow files.
+    :param batch_size: Number of workflows scored at once. Default is 512.
+    :param pattern: Glob pattern of the workflow files in the directory. Default is '*.cwl'.
+    :param parser: The parser of the files, see iter_cwl_directory. Default is "cwl".
+    :param processes: Number of worker processes, see iter_cwl_directory.
+    :param use_cache: Whether the parse cache is used, see iter_cwl_directory. Default is True.
+    :param metric_options: Keyword arguments of pubmetric.metrics.score_workflows_batch, e.g.
+        metrics or transform.
+
+    :return: DataFrame indexed by filename, with one column per metric and an 'error' column
+        with the error message of the files that could not be parsed (whose scores are empty).
+    """
+    index = pubmetric.metrics.get_graph_index(graph)
+    scores = []
+    errors = {}
+    batch = {}
+
+    def score_batch():
+        scores.append(pubmetric.metrics.score_workflows_batch(graph, batch, index=index,
+                                                              **metric_options))
+        batch.clear()
+
+    for result in iter_cwl_directory(graph, directory, pattern=pattern, parser=parser,
+                                     processes=processes, use_cache=use_cache):
+        if result['error']:
+            errors[result['filename']] = result['error']
+            continue
+        batch[result['filename']] = result['workflow']
+        if len(batch) >= batch_size:
+            score_batch()
+    if batch or not scores:
+        score_batch()
+
+    scores = pd.concat(scores) if len(scores) > 1 else scores[0]
+    scores = scores.reindex(sorted(set(scores.index) | set(errors)))
+    scores['error'] = pd.Series(errors, dtype=object)
+    return scores
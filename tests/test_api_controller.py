@@ -0,0 +1,86 @@
+import os
+import json
+import asyncio
+import threading
+import pytest
+from pubmetric import api_controller
+from pubmetric import network
+import pubmetric.metrics
+import example_graph as ex_graph
+
+@pytest.fixture
+def graph_paths(tmp_path, monkeypatch):
+    """Two saved graphs, with the API serving none yet"""
+    paths = []
+    for name, paper_citations in (("old", ex_graph.paper_citations),
+                                  ("new", {**ex_graph.paper_citations, 'CX': {'TA', 'TE'}})):
+        graph = network.add_graph_attributes(network.create_cocitation_graph(paper_citations),
+                                             metadata_file=ex_graph.tool_metadata)
+        network.write_graph(graph, os.path.join(tmp_path, name))
+        paths.append(os.path.join(tmp_path, name))
+    monkeypatch.setattr(api_controller, "latest_output_path", paths[0])
+    monkeypatch.setattr(api_controller, "current_snapshot", None)
+    monkeypatch.setattr(api_controller, "snapshot_lock", None)
+    return paths
+
+
+def test_snapshot_loaded_once_in_thread(graph_paths, monkeypatch):
+    """The first snapshot is loaded once by concurrent requests, with its indexes built
+    outside of the event loop thread"""
+    index_threads = []
+    graph_index = pubmetric.metrics.GraphIndex
+    def recording_graph_index(graph):
+        index_threads.append(threading.current_thread())
+        return graph_index(graph)
+    monkeypatch.setattr(pubmetric.metrics, "GraphIndex", recording_graph_index)
+
+    async def concurrent_requests():
+        return await asyncio.gather(*(api_controller.get_snapshot() for _ in range(3)))
+    snapshots = asyncio.run(concurrent_requests())
+    assert all(snapshot is snapshots[0] for snapshot in snapshots)
+    assert snapshots[0].path == graph_paths[0]
+    assert index_threads and threading.main_thread() not in index_threads
+    assert snapshots[0].pmid_ages == dict(zip(snapshots[0].graph.vs['pmid'], snapshots[0].graph.vs['age']))
+
+
+def test_swap_snapshot(graph_paths):
+    """A swapped in graph is served to new requests, while the old snapshot is unchanged,
+    and a graph that cannot be loaded is not swapped in"""
+    old_snapshot = asyncio.run(api_controller.get_snapshot())
+    old_edges = old_snapshot.graph.ecount()
+    asyncio.run(api_controller.swap_snapshot(graph_paths[1]))
+    new_snapshot = asyncio.run(api_controller.get_snapshot())
+    assert new_snapshot is not old_snapshot
+    assert api_controller.latest_output_path == graph_paths[1]
+    assert old_snapshot.graph.ecount() == old_edges
+    assert old_snapshot.path == graph_paths[0]
+
+    with pytest.raises(Exception):
+        asyncio.run(api_controller.swap_snapshot(os.path.join(graph_paths[1], "missing")))
+    assert api_controller.current_snapshot is new_snapshot
+    assert api_controller.latest_output_path == graph_paths[1]
+
+
+def test_periodic_graph_generation_settings(graph_paths, monkeypatch):
+    """The previous graph is only updated if it was created with the same topic and test
+    size as the periodic job, otherwise the graph is created from scratch"""
+    with open(os.path.join(graph_paths[0], network.metadata_filename(20)), 'w', encoding='utf-8') as f:
+        json.dump({'topic': 'topic_3172', 'tools': ex_graph.tool_metadata['tools']}, f)
+    with open(os.path.join(graph_paths[0], network.CITATIONS_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump({}, f)
+    assert network.read_metadata_settings(graph_paths[0]) == ('topic_3172', 20)
+    calls = []
+    async def update_network(**kwargs):
+        calls.append(('update', kwargs['topic_id'], kwargs['test_size']))
+    async def create_network(**kwargs):
+        calls.append(('create', kwargs['topic_id'], kwargs['test_size']))
+    monkeypatch.setattr(network, "update_network", update_network)
+    monkeypatch.setattr(network, "create_network", create_network)
+    monkeypatch.setattr(api_controller, "graph_topic_id", 'topic_0121')
+    monkeypatch.setattr(api_controller, "graph_test_size", None)
+
+    asyncio.run(api_controller.periodic_graph_generation())
+    monkeypatch.setattr(api_controller, "graph_topic_id", 'topic_3172')
+    monkeypatch.setattr(api_controller, "graph_test_size", 20)
+    asyncio.run(api_controller.periodic_graph_generation())
+    assert calls == [('create', 'topic_0121', None), ('update', 'topic_3172', 20)]
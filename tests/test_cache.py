@@ -0,0 +1,75 @@
+import os
+import time
+import asyncio
+import pytest
+from pubmetric.cache import ResponseCache, DAY
+from pubmetric.exceptions import CacheMissError
+from pubmetric.ratelimit import request_json
+
+def test_cache_roundtrip(tmp_path):
+    """Tests storing and loading a response, also after reopening the database"""
+    path = os.path.join(tmp_path, "responses.sqlite")
+    cache = ResponseCache(path)
+    key = cache.key("https://bio.tools/api/t?page=1")
+    assert cache.get(key) is None
+    cache.set(key, {"list": [{"name": "XTandem"}]})
+    cache.close()
+    assert ResponseCache(path).get(key) == {"list": [{"name": "XTandem"}]}
+
+def test_cache_key_includes_post_data():
+    url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
+    assert ResponseCache.key(url, {"id": "1,2"}) != ResponseCache.key(url, {"id": "1,3"})
+    assert ResponseCache.key(url, {"id": "1", "db": "pubmed"}) == ResponseCache.key(url, {"db": "pubmed", "id": "1"})
+
+def test_cache_ttl_and_offline(tmp_path):
+    """Tests that expired entries are only returned when working offline"""
+    cache = ResponseCache(os.path.join(tmp_path, "responses.sqlite"), ttl=0.01)
+    cache.set("key", {"hitCount": 1})
+    time.sleep(0.05)
+    assert cache.get("key") is None
+    assert cache.get("key", ttl=60) == {"hitCount": 1}
+    cache.offline = True
+    assert cache.get("key") == {"hitCount": 1}
+
+def test_cache_eviction(tmp_path):
+    """Tests that the least recently used entries are evicted when the cache is full"""
+    cache = ResponseCache(os.path.join(tmp_path, "responses.sqlite"), max_size=2000)
+    for i in range(20):
+        cache.set(f"key{i}", {"citations": [str(i * 1000 + j) for j in range(50)]})
+        time.sleep(0.001)
+    assert cache.size <= 2000
+    assert len(cache) < 20
+    assert cache.get("key19") is not None
+    assert cache.get("key0") is None
+
+def test_request_json_from_cache(tmp_path):
+    """Tests that cached responses are returned without a request, and that offline
+    requests missing from the cache fail"""
+    cache = ResponseCache(os.path.join(tmp_path, "responses.sqlite"), offline=True)
+    url = "https://www.ebi.ac.uk/europepmc/webservices/rest/MED/14632076/citations"
+    cache.set(cache.key(url), {"hitCount": 0})
+    assert asyncio.run(request_json(None, url, cache=cache)) == {"hitCount": 0}
+    with pytest.raises(CacheMissError):
+        asyncio.run(request_json(None, url + "?page=2", cache=cache))
+
+
+def test_cache_endpoint_ttl_and_background_writes(tmp_path):
+    """Tests that bio.tools and E-utilities responses outlive the default time to live,
+    and that stored responses are served before and after they are written"""
+    path = os.path.join(tmp_path, "responses.sqlite")
+    cache = ResponseCache(path, ttl=0.01)
+    biotools_url = "https://bio.tools/api/t?topicID=%22topic_0121%22&format=json&page=1"
+    europepmc_url = "https://www.ebi.ac.uk/europepmc/webservices/rest/MED/14632076/citations"
+    cache.set(cache.key(biotools_url), {"list": []}, url=biotools_url)
+    cache.set(cache.key(europepmc_url), {"hitCount": 1}, url=europepmc_url)
+    assert cache.get(cache.key(biotools_url)) == {"list": []}
+    assert cache.entry_ttl(biotools_url) > cache.entry_ttl(europepmc_url) == 0.01
+    assert cache.entry_ttl(biotools_url) < 30 * DAY # expired by the next monthly update
+    cache.flush()
+    time.sleep(0.05)
+    reopened_cache = ResponseCache(path)
+    assert reopened_cache.get(cache.key(biotools_url)) == {"list": []}
+    reopened_cache.close()
+    assert cache.get(cache.key(biotools_url)) == {"list": []}
+    assert cache.get(cache.key(europepmc_url)) is None
+    cache.close()
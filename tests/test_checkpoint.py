@@ -0,0 +1,33 @@
+import os
+from pubmetric.checkpoint import CheckpointLog
+
+def test_checkpoint_roundtrip(tmp_path):
+    """Tests that appended records are replayed when the log is opened again"""
+    path = os.path.join(tmp_path, "citations.jsonl")
+    with CheckpointLog(path) as checkpoint:
+        checkpoint.append("14632076", ["1", "2"])
+        checkpoint.update({"23051804": [], "14632076": ["1", "2", "3"]})
+    assert CheckpointLog(path).records == {"14632076": ["1", "2", "3"], "23051804": []}
+
+def test_checkpoint_torn_write(tmp_path):
+    """Tests that a line cut off by a crash is dropped and later records are kept"""
+    path = os.path.join(tmp_path, "citations.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('["14632076", ["1"]]\n["23051804", ["2", "3"')
+    checkpoint = CheckpointLog(path)
+    assert checkpoint.records == {"14632076": ["1"]}
+    checkpoint.append("23051804", ["2", "3"])
+    checkpoint.close()
+    assert CheckpointLog.replay(path) == ({"14632076": ["1"], "23051804": ["2", "3"]}, 2)
+
+def test_checkpoint_compaction(tmp_path):
+    """Tests that a log of mostly overwritten records is compacted when opened"""
+    path = os.path.join(tmp_path, "citations.jsonl")
+    with CheckpointLog(path) as checkpoint:
+        for i in range(10):
+            checkpoint.append("14632076", [str(i)])
+    assert CheckpointLog.replay(path)[1] == 10
+    checkpoint = CheckpointLog(path)
+    checkpoint.close(remove=True)
+    assert checkpoint.records == {"14632076": ["9"]}
+    assert not os.path.exists(path)
@@ -1,8 +1,12 @@
 import os
+import json
 import pytest
 import asyncio
 import aiohttp
 import pubmetric.data as data
+from pubmetric.cache import ResponseCache
+from pubmetric.exceptions import CacheMissError, DownloadError
+from pubmetric.checkpoint import CheckpointLog
 from schemas import metafile_schema_validation
 
 def test_get_tool_metadata_from_file(shared_datadir):
@@ -71,12 +75,111 @@ def test_get_pmids():
     assert type(pmid_tools[0]['all_publications']) == list
 
 
+def test_biotools_crawler(tmp_path):
+    """Tests crawling cached bio.tools pages concurrently, in page order"""
+    cache = ResponseCache(os.path.join(tmp_path, "responses.sqlite"), offline=True)
+    crawler = data.BiotoolsCrawler("topic_test", max_concurrency=2, cache=cache)
+    tools = [{"name": f"Tool{i}",
+              "publication": [{"type": ["Primary"], "pmid": str(i) if i % 3 else None,
+                               "doi": f"10.1000/{i}", "metadata": {"date": "2020-01-01"}}]}
+             for i in range(9)] + [{"name": "Unpublished", "publication": []}]
+    for page in range(1, 5):
+        cache.set(cache.key(crawler.base_url + str(page)),
+                  {"count": len(tools), "list": tools[3 * (page - 1):3 * page],
+                   "next": f"?page={page + 1}" if page < 4 else None})
+
+    pmid_tools, doi_tools, total_nr_tools = asyncio.run(
+        data.get_pmids(topic_id="topic_test", test_size=None, cache=cache, max_concurrency=2))
+    assert total_nr_tools == 10
+    assert [tool['name'] for tool in pmid_tools] == ['Tool1', 'Tool2', 'Tool4', 'Tool5', 'Tool7', 'Tool8']
+    assert [tool['doi'] for tool in doi_tools] == ['10.1000/0', '10.1000/3', '10.1000/6']
+    assert pmid_tools[0]['publication_date'] == 2020
+
+    pmid_tools, doi_tools, _ = asyncio.run(
+        data.get_pmids(topic_id="topic_test", test_size=4, cache=cache))
+    assert len(pmid_tools) + len(doi_tools) == 6 # whole pages are kept
+
+    # a page missing from the offline cache ends the crawl with an error, not a shorter list
+    missing_page_crawler = data.BiotoolsCrawler("topic_missing", cache=cache)
+    for page in (1, 2, 4):
+        cache.set(cache.key(missing_page_crawler.base_url + str(page)),
+                  {"count": len(tools), "list": tools[3 * (page - 1):3 * page], "next": "?page=2"})
+    with pytest.raises(CacheMissError):
+        asyncio.run(data.get_pmids(topic_id="topic_missing", test_size=None, cache=cache))
+    cache.set(cache.key(missing_page_crawler.base_url + "3"), {"detail": "Not found."})
+    with pytest.raises(DownloadError):
+        asyncio.run(data.get_pmids(topic_id="topic_missing", test_size=None, cache=cache))
+
 def test_process_citation_data():
     """Tests downloading the citations for one tool"""
     citation_test_tools = {'tools':[{'pmid':'14632076'}]} # Protein prophet, in mock metadata file structure 
     _ = asyncio.run(data.process_citation_data(metadata_file=citation_test_tools))
     assert citation_test_tools['tools'][0]['nr_citations'] >= 2900 # it has 2965 citations currently (August 2024)
 
+def test_process_citation_data_resume(tmp_path):
+    """Tests resuming from the checkpoint log of an interrupted run, without downloads"""
+    with CheckpointLog(os.path.join(tmp_path, data.CITATIONS_CHECKPOINT_FILENAME)) as checkpoint:
+        checkpoint.update({'1': ['10', '11'], '2': ['10', '11', '12'], '3': ['12']})
+    metadata_file = {'tools': [{'pmid': '1'}, {'pmid': '2'}, {'pmid': '3'}]}
+    with pytest.warns(DeprecationWarning): # batch_size is ignored
+        paper_citations = asyncio.run(data.process_citation_data(metadata_file=metadata_file,
+                                                                 inpath=tmp_path, outpath=tmp_path,
+                                                                 batch_size=1000))
+    assert paper_citations == {'10': {'1', '2'}, '11': {'1', '2'}, '12': {'2', '3'}}
+    assert [tool['nr_citations'] for tool in metadata_file['tools']] == [2, 3, 1]
+    assert not os.listdir(tmp_path)
+
+
+def test_process_citation_data_failed_page(tmp_path):
+    """Tests that a tool with a citation page that cannot be downloaded is not checkpointed
+    as complete, and is downloaded again when resuming"""
+    cache_path = os.path.join(tmp_path, "responses.sqlite")
+    outpath = os.path.join(tmp_path, "out")
+    def citations_url(pmid, page):
+        return (f'https://www.ebi.ac.uk/europepmc/webservices/rest/MED/{pmid}'
+                f'/citations?page={page}&pageSize=1000&format=json')
+    cache = ResponseCache(cache_path)
+    cache.set(cache.key(citations_url('1', 1)),
+              {'hitCount': 2, 'citationList': {'citation': [{'id': '10'}, {'id': '11'}]}})
+    cache.set(cache.key(citations_url('2', 1)), # the second page is missing
+              {'hitCount': 1001, 'citationList': {'citation': [{'id': '10'}]}})
+    cache.close()
+    metadata_file = {'tools': [{'pmid': '1'}, {'pmid': '2'}]}
+    cache = ResponseCache(cache_path, offline=True)
+    with pytest.raises(DownloadError):
+        asyncio.run(data.process_citation_data(metadata_file=metadata_file, outpath=outpath,
+                                               cache=cache))
+    cache.close()
+    assert data.read_citation_checkpoint(outpath) == {'1': ['10', '11']}
+
+    cache = ResponseCache(cache_path)
+    cache.set(cache.key(citations_url('2', 2)),
+              {'hitCount': 1001, 'citationList': {'citation': [{'id': '11'}]}})
+    cache.offline = True
+    paper_citations = asyncio.run(data.process_citation_data(metadata_file=metadata_file,
+                                                             inpath=outpath, outpath=outpath,
+                                                             cache=cache))
+    cache.close()
+    assert paper_citations == {'10': {'1', '2'}, '11': {'1', '2'}}
+    assert [tool['nr_citations'] for tool in metadata_file['tools']] == [2, 2]
+
+def test_process_citation_data_rejected_pmid(tmp_path, monkeypatch):
+    """Tests that a PMID rejected by EuropePMC with a client error is saved without
+    citations instead of failing the download"""
+    async def mocked_request_json(session, url, **kwargs):
+        if '/MED/404/' in url:
+            raise aiohttp.ClientResponseError(None, (), status=404, message='Not Found')
+        return {'hitCount': 2, 'citationList': {'citation': [{'id': '10'}, {'id': '11'}]}}
+    monkeypatch.setattr(data, "request_json", mocked_request_json)
+    metadata_file = {'tools': [{'pmid': '1'}, {'pmid': '404'}, {'pmid': '2'}]}
+    paper_citations = asyncio.run(data.process_citation_data(metadata_file=metadata_file,
+                                                             outpath=tmp_path,
+                                                             citations_filename='tool_citations.json'))
+    assert paper_citations == {'10': {'1', '2'}, '11': {'1', '2'}}
+    assert [tool['nr_citations'] for tool in metadata_file['tools']] == [2, 0, 2]
+    with open(os.path.join(tmp_path, 'tool_citations.json'), 'r', encoding='utf-8') as f:
+        assert json.load(f)['404'] == []
+
 def test_get_ages():
      tool_metadata = [
             {"name": "PeptideProphet",
@@ -90,4 +193,48 @@ def test_get_ages():
         },
      ]
      tool_metadata_inc_ages = asyncio.run(data.process_publication_dates(tool_metadata))
-     assert tool_metadata_inc_ages[0]['publication_date'] == 2002
\ No newline at end of file
+     assert tool_metadata_inc_ages[0]['publication_date'] == 2002
+
+def test_get_pmid_from_doi_save_interval(tmp_path):
+    """Tests that the ignored save_interval is deprecated"""
+    doi_list = [{"name": "ProteoWizard", "doi": "10.1038/nbt.2377"}]
+    with open(os.path.join(tmp_path, 'doi_pmid_library.json'), 'w', encoding='utf-8') as f:
+        json.dump({"10.1038/nbt.2377": "23051804"}, f)
+    with pytest.warns(DeprecationWarning):
+        pmid_list = asyncio.run(data.get_pmid_from_doi(doi_list, outpath=tmp_path, inpath=tmp_path,
+                                                       save_interval=10))
+    assert pmid_list[0]["pmid"] == "23051804"
+
+
+def test_stream_tool_data_failed_stage(tmp_path, monkeypatch):
+    """Tests that the other stages are stopped before the logs are closed when a stage fails"""
+    cache = ResponseCache(os.path.join(tmp_path, "responses.sqlite"), offline=True)
+    crawler = data.BiotoolsCrawler("topic_test", cache=cache)
+    tools = [{"name": f"Tool{i}",
+              "publication": [{"type": ["Primary"], "pmid": str(i), "doi": f"10.1000/{i}",
+                               "metadata": {"date": "2020-01-01"}}]}
+             for i in range(1, 7)]
+    cache.set(cache.key(crawler.base_url + "1"), {"count": len(tools), "list": tools, "next": None})
+
+    async def slow_fetch_citations(pmid, session, **kwargs):
+        await asyncio.sleep(0.01 * int(pmid))
+        return [f"c{pmid}"]
+    def failing_on_citations(tool, citations):
+        raise ValueError("Counting failed")
+    appended_after_close = []
+    append = CheckpointLog.append
+    def checked_append(self, key, value):
+        if self._file.closed:
+            appended_after_close.append(key)
+        append(self, key, value)
+    monkeypatch.setattr(data, "fetch_citations", slow_fetch_citations)
+    monkeypatch.setattr(CheckpointLog, "append", checked_append)
+
+    async def stream_and_wait():
+        with pytest.raises(ValueError):
+            await data.stream_tool_data(outpath=os.path.join(tmp_path, "out"), topic_id="topic_test",
+                                        on_citations=failing_on_citations, cache=cache)
+        await asyncio.sleep(0.2) # the slower downloads would have finished by now
+    asyncio.run(stream_and_wait())
+    cache.close()
+    assert not appended_after_close
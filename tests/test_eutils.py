@@ -0,0 +1,68 @@
+import os
+import asyncio
+import aiohttp
+import pytest
+from pubmetric.eutils import EutilsClient, EUTILS_URL
+from pubmetric.cache import ResponseCache
+from pubmetric.exceptions import CacheMissError
+
+def seed_esummary(cache, pmids, summaries):
+    """Stores the esummary response of a batch of PMIDs in the cache"""
+    cache.set(cache.key(EUTILS_URL + 'esummary.fcgi',
+                        {'db': 'pubmed', 'id': ','.join(pmids), 'retmode': 'json', 'tool': 'pubmetric'}),
+              {'result': {'uids': list(summaries), **summaries}})
+
+def seed_esearch(cache, dois, pmids):
+    """Stores the esearch response of a batch of DOIs in the cache"""
+    cache.set(cache.key(EUTILS_URL + 'esearch.fcgi',
+                        {'db': 'pubmed', 'term': ' OR '.join(f'"{doi}"[doi]' for doi in dois),
+                         'retmax': 2 * len(dois), 'retmode': 'json', 'tool': 'pubmetric'}),
+              {'esearchresult': {'idlist': pmids}})
+
+def run_client(client, method, ids, on_batch=None):
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            return await getattr(client, method)(session, ids, on_batch=on_batch)
+    return asyncio.run(run())
+
+
+def test_esummary_batches(tmp_path):
+    """Tests that summaries are requested in batches, and that PMIDs missing from a response
+    are requested again"""
+    cache = ResponseCache(os.path.join(tmp_path, "responses.sqlite"), offline=True)
+    seed_esummary(cache, ['1', '2'], {'1': {'pubdate': '2001'}})
+    seed_esummary(cache, ['2'], {'2': {'pubdate': '2002'}})
+    seed_esummary(cache, ['3'], {'3': {'pubdate': '2003'}})
+    client = EutilsClient(batch_size=2, cache=cache)
+    batches = []
+    summaries = run_client(client, 'esummary', ['1', '2', '3'], on_batch=batches.append)
+    assert summaries == {'1': {'pubdate': '2001'}, '2': {'pubdate': '2002'}, '3': {'pubdate': '2003'}}
+    assert sorted(map(sorted, batches)) == [['1', '2'], ['3']]
+    cache.close()
+
+
+def test_dois_to_pmids(tmp_path):
+    """Tests that the DOIs are matched to the PMIDs found by the search through the DOIs
+    in the summaries, not the order of the search results"""
+    cache = ResponseCache(os.path.join(tmp_path, "responses.sqlite"), offline=True)
+    dois = ['10.1000/A', '10.1000/b', '10.1000/missing']
+    seed_esearch(cache, dois, ['20', '10'])
+    seed_esummary(cache, ['20', '10'],
+                  {'20': {'articleids': [{'idtype': 'pubmed', 'value': '20'},
+                                         {'idtype': 'doi', 'value': '10.1000/b'}]},
+                   '10': {'articleids': [{'idtype': 'doi', 'value': '10.1000/a'}]}})
+    client = EutilsClient(cache=cache)
+    assert run_client(client, 'dois_to_pmids', dois) == {'10.1000/A': '10', '10.1000/b': '20'}
+    cache.close()
+
+
+def test_eutils_errors_propagate(tmp_path):
+    """Tests that a batch which cannot be downloaded raises instead of being left out"""
+    cache = ResponseCache(os.path.join(tmp_path, "responses.sqlite"), offline=True)
+    seed_esummary(cache, ['1'], {'1': {'pubdate': '2001'}})
+    client = EutilsClient(batch_size=1, cache=cache)
+    with pytest.raises(CacheMissError):
+        run_client(client, 'esummary', ['1', '2'])
+    with pytest.raises(CacheMissError):
+        run_client(client, 'dois_to_pmids', ['10.1000/a'])
+    cache.close()
@@ -1,5 +1,7 @@
 
 import pickle
+import igraph
+import pytest
 import os
 import math
 from datetime import datetime
@@ -8,6 +10,7 @@ import statistics
 import example_graph as ex_graph
 
 import pubmetric.metrics as met
+from pubmetric.adjustments import Adjustment, Pipeline, Log, AgeAdjust, DegreeAdjust, CitationAdjust
 from pubmetric.workflow import parse_cwl
 from pubmetric.network import create_network
 
@@ -25,11 +28,14 @@ def test_tool_level_average_sum(shared_datadir):
 
 # The rest of the tests are based on the example graph
 def test_get_graph_edge_weight():
-    id_dict = met.get_node_ids(ex_graph.cocitation_graph)
     print(ex_graph.cocitation_graph.vs['name'])
     for edge, expected_weight in ex_graph.expected_edge_weights.items():
-        weight = met.get_graph_edge_weight(graph=ex_graph.cocitation_graph, edge=edge, id_dict=id_dict)
+        weight = met.get_graph_edge_weight(graph=ex_graph.cocitation_graph, edge=edge)
         assert weight == expected_weight
+    id_dict = met.get_node_ids(ex_graph.cocitation_graph)
+    with pytest.warns(DeprecationWarning): # id_dict is ignored
+        assert met.get_graph_edge_weight(graph=ex_graph.cocitation_graph, edge=edge,
+                                         id_dict=id_dict) == expected_weight
 
 def test_workflow_average_base():
     # obs see the problem here where this metrics prefers single edged nw with good connection (msConvert to Comet for ex will always be best then)
@@ -74,4 +80,90 @@ def test_complete_average_age():
 
 def test_citations():
     score = met.median_citations(ex_graph.cocitation_graph, workflow= ex_graph.dictionary_workflow)
-    assert score == statistics.median([1, 1, 3, 4]) # TA is counted twice. Cant argue what is more or less reasonable as it is not a reasonable metric
\ No newline at end of file
+    assert score == statistics.median([1, 1, 3, 4]) # TA is counted twice. Cant argue what is more or less reasonable as it is not a reasonable metric
+
+
+def test_graph_index():
+    index = met.get_graph_index(ex_graph.cocitation_graph)
+    assert index is met.get_graph_index(ex_graph.cocitation_graph) # cached per graph
+    for edge, expected_weight in ex_graph.expected_edge_weights.items():
+        assert index.edge_weight(*edge) == expected_weight
+        assert index.edge_weight(*edge[::-1]) == expected_weight
+    assert index.edge_weight('TA', 'not_in_graph') is None
+    assert index.degree('TA') == ex_graph.cocitation_graph.vs.find(pmid='TA').degree()
+
+def test_distance_index(shared_datadir):
+    graph_path = os.path.join(shared_datadir, "graph.pkl")
+    with open(graph_path, 'rb') as f:
+        graph = pickle.load(f)
+    sources = [1, 17, 300, 1000]
+    for weighted in [True, False]:
+        dense = met.get_distance_index(graph, weighted=weighted, dense=True)
+        lazy = met.DistanceIndex(graph, weighted=weighted, dense=False, max_rows=2)
+        weights = graph.es["inverted_weight"] if weighted else None
+        for source in sources:
+            expected = [len(path) for path in graph.get_shortest_paths(source, to=sources[::-1], weights=weights, output="epath")]
+            assert [dense.path_length(source, target) for target in sources[::-1]] == expected
+            assert [lazy.path_length(source, target) for target in sources[::-1]] == expected
+        assert len(lazy._rows) == 2
+        row_bytes = graph.vcount() * lazy.dtype(0).itemsize
+        assert met.DistanceIndex(graph, weighted=weighted, max_bytes=3 * row_bytes + 1).max_rows == 3
+    workflow = [(graph.vs[1]['pmid'], graph.vs[17]['pmid']), (graph.vs[300]['pmid'], 'not_in_graph')]
+    expected = 1 / ((len(graph.get_shortest_paths(1, to=17, weights=graph.es["inverted_weight"], output="epath")[0]) + 10) / 2)
+    assert met.shortest_path(graph, workflow) == expected
+
+def test_tool_average_sum_per_step():
+    workflow = ex_graph.dictionary_workflow
+    for options in [{}, {'transform': 'log', 'degree_adjustment': True}]:
+        tool_scores = met.tool_average_sum(ex_graph.cocitation_graph, workflow, **options)
+        desirability = met.calculate_desirability(met.workflow_average(ex_graph.cocitation_graph, workflow), thresholds=[0, 400])
+        for step, pmid in workflow['steps'].items():
+            weights = [met.get_graph_edge_weight(ex_graph.cocitation_graph, (workflow['steps'][source], workflow['steps'][target]), **options) or 0.0
+                       for source, target in workflow['edges'] if step in (source, target)]
+            assert tool_scores[step] == round(sum(weights) / len(weights) * desirability, 2)
+    assert met.tool_average_sum(ex_graph.cocitation_graph, workflow, aggregation_method="product") == 0.0
+
+def test_hop_distances():
+    step_names = [f"T{i}_{i:02d}" for i in range(12)]
+    edges = [(step_names[i // 2], step_names[i]) for i in range(1, 10)] + [(step_names[9], step_names[3])]
+    workflow_graph = igraph.Graph.TupleList(edges, directed=False)
+    expected = [[len(path) for path in workflow_graph.get_shortest_paths(workflow_graph.vs.find(name=source).index,
+                                                                         to=[workflow_graph.vs.find(name=target).index for target in step_names[:10]],
+                                                                         output="epath")]
+                for source in step_names[:10]]
+    distances = met._hop_distances(step_names, edges)
+    assert distances[:10, :10].tolist() == expected
+    assert not distances[10:].any() and not distances[:, 10:].any() # steps without edges
+
+def test_score_workflows_batch():
+    workflows = [ex_graph.dictionary_workflow, ex_graph.dictionary_workflow]
+    for options in [{}, {'transform': 'log', 'age_adjustment': True, 'degree_adjustment': True}]:
+        scores = met.score_workflows_batch(ex_graph.cocitation_graph, workflows, **options)
+        assert list(scores['workflow_average']) == [
+            met.workflow_average(ex_graph.cocitation_graph, workflow, **options) for workflow in workflows]
+        assert list(scores['complete_average']) == [
+            met.complete_average(ex_graph.cocitation_graph, workflow, **options) for workflow in workflows]
+        assert list(scores['tool_average_sum']) == [
+            met.tool_average_sum(ex_graph.cocitation_graph, workflow, **options) for workflow in workflows]
+
+def test_adjustment_pipeline():
+    graph = ex_graph.cocitation_graph
+    workflow = ex_graph.dictionary_workflow
+    options = {'transform': 'log', 'age_adjustment': True, 'degree_adjustment': True}
+    pipeline = Pipeline([Log(), AgeAdjust(), DegreeAdjust()])
+    for metric in (met.workflow_average, met.complete_average, met.tool_average_sum):
+        assert metric(graph, workflow, adjustments=pipeline) == metric(graph, workflow, **options)
+    assert met.score_workflows_batch(graph, [workflow], adjustments=pipeline).equals(
+        met.score_workflows_batch(graph, [workflow], **options))
+
+    edge = workflow['pmid_edges'][0]
+    weight = met.get_graph_edge_weight(graph, edge)
+    assert met.get_graph_edge_weight(graph, edge, adjustments=Pipeline([CitationAdjust()])) == \
+        met.citation_adjusted_weight(edge, weight, graph)
+    with pytest.raises(ValueError):
+        met.workflow_average(graph, workflow, transform='log', adjustments=pipeline)
+
+    class MissingCall(Adjustment):
+        pass
+    with pytest.raises(TypeError): # an Adjustment has to implement __call__
+        MissingCall()
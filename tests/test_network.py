@@ -1,6 +1,12 @@
+import os
+import json
 from collections import defaultdict
 import asyncio
+import pytest
+import numpy as np
 from pubmetric import network 
+from pubmetric import data
+from pubmetric.cache import ResponseCache
 import example_graph as ex_graph
 
 def test_citation_network_testsize(shared_datadir):
@@ -36,6 +42,10 @@ def test_create_cocitation_graph_sizes():
     assert sorted(ex_graph.cocitation_expected_nodes) == sorted(big_graph.vs['name'])
     assert sorted(ex_graph.cocitation_expected_nodes) == sorted(small_graph.vs['name'])
     assert big_graph.isomorphic(small_graph)
+    for num_processes, num_chunks in [(1, 1), (3, None), (None, 50)]:
+        graph = network.build_cocitation_graph(ex_graph.paper_citations, method="mapreduce",
+                                               num_processes=num_processes, num_chunks=num_chunks)
+        assert network.graph_edge_weights(graph, key='name') == network.graph_edge_weights(small_graph, key='name')
 
 
 def test_combine_counts():
@@ -46,6 +56,18 @@ def test_combine_counts():
     expected = defaultdict(int, {('A', 'B'): 4, ('B', 'C'): 2, ('D', 'E'): 4})
     assert network.combine_counts(counts_list) == expected
 
+
+def test_merge_pair_counts():
+    """Tests that the counts of pairs in several sorted partial counts are summed"""
+    partial_counts = [(np.array([1, 5, 9]), np.array([1, 2, 3])),
+                      (np.array([], dtype=np.int64), np.array([], dtype=np.int64)),
+                      (np.array([2, 5, 2 ** 40]), np.array([4, 5, 6]))]
+    keys, counts = network.merge_pair_counts(partial_counts)
+    assert keys.tolist() == [1, 2, 5, 9, 2 ** 40]
+    assert counts.tolist() == [1, 4, 7, 3, 6]
+    assert [len(array) for array in network.merge_pair_counts([])] == [0, 0]
+
+
 def test_add_attributes():
     """Tests the attribute addition after the cocitation graph is created"""
     no_attribute_graph = network.create_cocitation_graph(ex_graph.paper_citations)
@@ -56,4 +78,224 @@ def test_add_attributes():
     assert 'age' in attribute_graph.vs.attributes()
     assert 'pmid' in attribute_graph.vs.attributes()
     assert 'nr_citations' in attribute_graph.vs.attributes()
-    assert 'degree' in attribute_graph.vs.attributes()
\ No newline at end of file
+    assert 'degree' in attribute_graph.vs.attributes()
+
+
+def test_create_sparse_cocitation_graph():
+    """Tests that the sparse matrix builder gives the same graph and weights as
+    the pairwise counting"""
+    sparse_graph = network.create_sparse_cocitation_graph(paper_citations=ex_graph.paper_citations)
+    small_graph = network.create_small_cocitation_graph(paper_citations=ex_graph.paper_citations)
+    assert sorted(ex_graph.cocitation_expected_nodes) == sorted(sparse_graph.vs['name'])
+    sparse_weights = {tuple(sorted((sparse_graph.vs[e.source]['name'], sparse_graph.vs[e.target]['name']))): e['weight']
+                      for e in sparse_graph.es}
+    small_weights = {tuple(sorted((small_graph.vs[e.source]['name'], small_graph.vs[e.target]['name']))): e['weight']
+                     for e in small_graph.es}
+    assert sparse_weights == small_weights
+
+def test_apply_citation_deltas():
+    """Tests that updating the edge weights for changed citation lists gives the same
+    weights as rebuilding the graph from the updated citation lists"""
+    old_metadata = {'tools': [{'pmid': pmid} for pmid in ['1', '2', '3', '4']]}
+    old_citations = {'1': ['a', 'b', 'c'], '2': ['a', 'b'], '3': ['b', 'c', 'c'], '4': ['d']}
+    new_metadata = {'tools': [{'pmid': pmid} for pmid in ['1', '2', '3', '5']]}
+    new_citations = {'1': ['a', 'b', 'c', 'd'], '2': ['a', 'b'], '3': ['b', 'c', 'c'],
+                     '5': ['a', 'd']}
+
+    def rebuilt_weights(metadata, citations):
+        paper_citations = network.pubmetric.data.build_paper_citations(metadata, citations,
+                                                                       threshold=3)
+        graph = network.create_sparse_cocitation_graph(paper_citations)
+        return network.graph_edge_weights(graph, key='name')
+
+    edge_weights = network.apply_citation_deltas(rebuilt_weights(old_metadata, old_citations),
+                                                 old_metadata, old_citations,
+                                                 new_metadata, new_citations,
+                                                 changed_tools={'1', '4', '5'},
+                                                 threshold=3)
+    assert edge_weights == rebuilt_weights(new_metadata, new_citations)
+    graph = network.graph_from_edge_weights(edge_weights)
+    assert network.graph_edge_weights(graph, key='name') == edge_weights
+
+def test_write_read_graph(tmp_path):
+    """Tests that a graph is unchanged after saving and loading it"""
+    graph = network.add_graph_attributes(network.create_cocitation_graph(ex_graph.paper_citations),
+                                         metadata_file=ex_graph.tool_metadata)
+    graph["topic"] = "topic_0121"
+    network.write_graph(graph, tmp_path)
+    assert network.graph_exists(tmp_path)
+    loaded_graph = network.read_graph(tmp_path)
+    assert loaded_graph.get_edgelist() == graph.get_edgelist()
+    assert loaded_graph["topic"] == "topic_0121"
+    for attribute in graph.vs.attributes():
+        assert loaded_graph.vs[attribute] == graph.vs[attribute]
+    for attribute in graph.es.attributes():
+        assert loaded_graph.es[attribute] == graph.es[attribute]
+
+
+def test_write_graph_interrupted_overwrite(tmp_path, monkeypatch):
+    """Tests that a graph whose overwrite was interrupted is not loaded as a mix of the
+    old and the new graph"""
+    graph = network.add_graph_attributes(network.create_cocitation_graph(ex_graph.paper_citations),
+                                         metadata_file=ex_graph.tool_metadata)
+    network.write_graph(graph, tmp_path)
+    new_graph = network.create_cocitation_graph({**ex_graph.paper_citations, 'CX': {'TA', 'TE'}})
+    save = np.save
+    def interrupted_save(filename, array):
+        if os.path.basename(filename) not in ('sources.npy', 'targets.npy'):
+            raise KeyboardInterrupt
+        save(filename, array)
+    monkeypatch.setattr(network.np, "save", interrupted_save)
+    with pytest.raises(KeyboardInterrupt):
+        network.write_graph(new_graph, tmp_path)
+    monkeypatch.undo()
+    assert not network.graph_exists(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        network.read_graph(tmp_path)
+
+def test_update_inputs_exist(tmp_path):
+    """Tests that the metadata file of a test run is found, and that a graph can only be
+    updated if its metadata, citations and graph were all saved"""
+    graph = network.create_cocitation_graph(ex_graph.paper_citations)
+    network.write_graph(graph, tmp_path)
+    assert network.find_metadata_file(tmp_path) is None
+    with open(os.path.join(tmp_path, network.metadata_filename(20)), 'w', encoding='utf-8') as f:
+        json.dump(ex_graph.tool_metadata, f)
+    assert network.find_metadata_file(tmp_path) == os.path.join(tmp_path, 'tool_metadata_test20.json')
+    assert not network.update_inputs_exist(tmp_path)
+    with open(os.path.join(tmp_path, network.CITATIONS_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump({}, f)
+    assert network.update_inputs_exist(tmp_path)
+    assert not network.update_inputs_exist(os.path.join(tmp_path, 'missing'))
+
+
+def test_write_read_distance_index(tmp_path):
+    """Tests that saved shortest path lengths are loaded, and removed when the graph is overwritten"""
+    graph = network.add_graph_attributes(network.create_cocitation_graph(ex_graph.paper_citations),
+                                         metadata_file=ex_graph.tool_metadata)
+    network.write_graph(graph, tmp_path)
+    assert network.read_distance_index(graph, tmp_path) is None
+    distance_index = network.write_distance_index(graph, tmp_path)
+    loaded_index = network.read_distance_index(graph, tmp_path)
+    assert (loaded_index.hops == distance_index.hops).all()
+    network.write_graph(graph, tmp_path)
+    assert network.read_distance_index(graph, tmp_path) is None
+
+def test_add_attributes_lazy():
+    """Tests that the computed attributes are only added when asked for"""
+    graph = network.create_cocitation_graph(ex_graph.paper_citations)
+    graph = network.add_graph_attributes(graph=graph, metadata_file=ex_graph.tool_metadata, lazy=True)
+    assert 'degree' not in graph.vs.attributes()
+    assert 'inverted_weight' not in graph.es.attributes()
+    network.ensure_attributes(graph)
+    assert graph.vs['degree'] == graph.degree()
+    assert sorted(graph.es['inverted_weight']) == sorted([0.5, 1.0, 1.0])
+
+def test_cocitation_counter():
+    """Tests that counting co-citations as citation lists arrive equals a full rebuild"""
+    tools = [{'pmid': str(i)} for i in range(8)] + [{'pmid': '3'}] # a tool sharing a pmid
+    tool_citations = {str(i): [f'c{(i * j) % 7}' for j in range(1, 5)] + ['c_all', str(i)]
+                      for i in range(8)}
+    counter = network.CocitationCounter(threshold=5)
+    for tool in reversed(tools):
+        counter.add_tool(tool, tool_citations[tool['pmid']])
+    paper_citations = data.build_paper_citations({'tools': tools}, tool_citations, threshold=5)
+    rebuilt_weights = network.graph_edge_weights(network.create_small_cocitation_graph(paper_citations),
+                                                 key='name')
+    assert counter.edge_weights() == {tuple(sorted(pair)): weight for pair, weight in rebuilt_weights.items()}
+
+def test_create_network_streaming(tmp_path):
+    """Tests that the streaming pipeline creates the same graph as the staged downloads, offline"""
+    cache = ResponseCache(os.path.join(tmp_path, "responses.sqlite"))
+    biotools_url = 'https://bio.tools/api/t?topicID=%22topic_test%22&format=json&page='
+    tools = [{'name': f'Tool{i}',
+              'publication': [{'type': ['Primary'], 'pmid': str(i), 'doi': f'10.1000/{i}',
+                               'metadata': {'date': f'20{i:02d}-01-01'}}]}
+             for i in range(1, 24)]
+    tools[-1]['publication'][0].update(pmid=None, metadata=None) # resolved by its doi
+    for page in range(1, 7):
+        cache.set(cache.key(biotools_url + str(page)),
+                  {'count': len(tools), 'list': tools[4 * (page - 1):4 * page], 'next': '?page=2'})
+    eutils_url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+    cache.set(cache.key(eutils_url + 'esearch.fcgi',
+                        {'db': 'pubmed', 'term': '"10.1000/23"[doi]', 'retmax': 2,
+                         'retmode': 'json', 'tool': 'pubmetric'}),
+              {'esearchresult': {'idlist': ['23']}})
+    cache.set(cache.key(eutils_url + 'esummary.fcgi',
+                        {'db': 'pubmed', 'id': '23', 'retmode': 'json', 'tool': 'pubmetric'}),
+              {'result': {'uids': ['23'], '23': {'pubdate': '2023 Jan',
+                                                 'articleids': [{'idtype': 'doi', 'value': '10.1000/23'}]}}})
+    for i in range(1, 24): # c_all cites all tools, more than the threshold
+        citations = [{'id': f'c{(i * j) % 11}'} for j in range(1, 4)] + [{'id': f'c{i % 3}'}, {'id': 'c_all'}]
+        cache.set(cache.key(f'https://www.ebi.ac.uk/europepmc/webservices/rest/MED/{i}'
+                            f'/citations?page=1&pageSize=1000&format=json'),
+                  {'hitCount': len(citations), 'citationList': {'citation': citations}})
+    cache.close()
+
+    graphs = {streaming: asyncio.run(network.create_network(outpath=os.path.join(tmp_path, str(streaming)),
+                                                            topic_id='topic_test',
+                                                            cache_path=os.path.join(tmp_path, "responses.sqlite"),
+                                                            offline=True,
+                                                            streaming=streaming))
+              for streaming in (False, True)}
+    assert graphs[True].ecount() > 0 and '23' in graphs[True].vs['pmid']
+    assert network.graph_edge_weights(graphs[True]) == network.graph_edge_weights(graphs[False])
+    for attribute in ('age', 'nr_citations'):
+        assert (dict(zip(graphs[True].vs['pmid'], graphs[True].vs[attribute]))
+                == dict(zip(graphs[False].vs['pmid'], graphs[False].vs[attribute])))
+    assert sorted(os.listdir(os.path.join(tmp_path, 'True'))) == sorted(os.listdir(os.path.join(tmp_path, 'False')))
+    sparse_graph = asyncio.run(network.create_network(outpath=os.path.join(tmp_path, 'sparse'),
+                                                      topic_id='topic_test',
+                                                      cache_path=os.path.join(tmp_path, "responses.sqlite"),
+                                                      offline=True,
+                                                      cocitation_method='sparse',
+                                                      streaming=True))
+    assert network.graph_edge_weights(sparse_graph) == network.graph_edge_weights(graphs[False])
+
+def test_update_network_test_size(tmp_path, monkeypatch):
+    """Tests that updating a test-size graph crawls the same number of tools, so the tools
+    beyond the test size are not counted as new"""
+    cache_path = os.path.join(tmp_path, "responses.sqlite")
+    cache = ResponseCache(cache_path)
+    biotools_url = 'https://bio.tools/api/t?topicID=%22topic_test%22&format=json&page='
+    tools = [{'name': f'Tool{i}',
+              'publication': [{'type': ['Primary'], 'pmid': str(i), 'doi': f'10.1000/{i}',
+                               'metadata': {'date': f'20{i:02d}-01-01'}}]}
+             for i in range(1, 13)]
+    for page in range(1, 4):
+        cache.set(cache.key(biotools_url + str(page)),
+                  {'count': len(tools), 'list': tools[4 * (page - 1):4 * page], 'next': '?page=2'})
+    tool_citations = {str(i): [f'c{i % 3}', 'c_all'] for i in range(1, 13)}
+    for pmid, citations in tool_citations.items():
+        cache.set(cache.key(f'https://www.ebi.ac.uk/europepmc/webservices/rest/MED/{pmid}'
+                            f'/citations?page=1&pageSize=1000&format=json'),
+                  {'hitCount': len(citations),
+                   'citationList': {'citation': [{'id': citation} for citation in citations]}})
+    cache.close()
+    graph = asyncio.run(network.create_network(outpath=os.path.join(tmp_path, 'test4'),
+                                               test_size=4,
+                                               topic_id='topic_test',
+                                               cache_path=cache_path,
+                                               offline=True,
+                                               save_distances=True))
+    assert network.read_distance_index(graph, os.path.join(tmp_path, 'test4')) is not None
+
+    async def fetch_citation_counts(article_ids, session, **kwargs):
+        return {pmid: len(tool_citations[pmid]) for pmid in article_ids}
+    downloaded_tools = []
+    async def fetch_citations_batch(article_ids, session, **kwargs):
+        downloaded_tools.extend(article_ids)
+        return {pmid: tool_citations[pmid] for pmid in article_ids}
+    monkeypatch.setattr(data, "fetch_citation_counts", fetch_citation_counts)
+    monkeypatch.setattr(data, "fetch_citations_batch", fetch_citations_batch)
+    updated_graph = asyncio.run(network.update_network(inpath=os.path.join(tmp_path, 'test4'),
+                                                       outpath=os.path.join(tmp_path, 'updated'),
+                                                       topic_id='topic_test',
+                                                       test_size=4,
+                                                       cache_path=cache_path,
+                                                       save_distances=True))
+    assert not downloaded_tools
+    assert sorted(updated_graph.vs['pmid']) == sorted(graph.vs['pmid'])
+    assert network.graph_edge_weights(updated_graph) == network.graph_edge_weights(graph)
+    assert network.find_metadata_file(os.path.join(tmp_path, 'updated')).endswith('test4.json')
+    assert network.read_distance_index(updated_graph, os.path.join(tmp_path, 'updated')) is not None
@@ -62,4 +62,137 @@ def test_generate_random_workflow(shared_datadir):
     random_graph = igraph.Graph.TupleList(random_workflow['edges'])
 
     assert len(random_graph.vs) == 4
-    assert og_graph.isomorphic(random_graph) 
\ No newline at end of file
+    assert og_graph.isomorphic(random_graph) 
+
+def test_random_workflow_sampler(shared_datadir):
+    """
+    Random workflows drawn in a batch keep the structure of the workflow, and the tools
+    are drawn from the degree bin of the tool they replace.
+    """
+    graph_path = os.path.join(shared_datadir, "graph.pkl")
+    with open(graph_path, 'rb') as f:
+        graph = pickle.load(f)
+    workflow = {
+        "edges": [["XTandem_01", "ProteinProphet_02"], ["ProteinProphet_02", "StPeter_04"],
+                  ["XTandem_03", "StPeter_04"], ["MISSINGTOOL_05", "StPeter_04"]],
+        "steps": {"ProteinProphet_02": "14632076", "StPeter_04": "29400476",
+                  "XTandem_01": "14976030", "XTandem_03": "14976030", "MISSINGTOOL_05": None}
+    }
+
+    sampler = RandomWorkflowSampler(graph, rng=np.random.default_rng(42))
+    random_workflows = sampler.sample(workflow, size=50)
+    assert len(random_workflows) == 50
+    assert random_workflows == RandomWorkflowSampler(graph, rng=42).sample(workflow, size=50)
+
+    og_graph = igraph.Graph.TupleList(workflow['edges'])
+    for random_workflow in random_workflows:
+        assert og_graph.isomorphic(igraph.Graph.TupleList(random_workflow['edges']))
+        assert random_workflow['pmid_edges'][3][0] is None
+        source, target = random_workflow['pmid_edges'][0]
+        assert sampler.vertex_bins[sampler.vertex(source)] == sampler.vertex_bins[sampler.vertex("14976030")]
+        assert sampler.vertex_bins[sampler.vertex(target)] == sampler.vertex_bins[sampler.vertex("14632076")]
+
+
+def test_perturb_workflows(tmp_path):
+    """
+    The batch perturbations agree with break_workflow and reconnect_edges, and are written
+    to a JSON lines file.
+    """
+    workflows = [[("1", "2"), ("2", "3"), ("4", "3")], [("5", None)], [(None, None)]]
+    corpus = WorkflowCorpus(workflows, ids=["a", "b", "c"])
+    assert corpus.workflow(0) == workflows[0]
+
+    rows = list(perturb_workflows(corpus, replacing_tools=["9"], nr_variants=3,
+                                  perturbations=PERTURBATIONS, rng=0, chunk_size=1))
+    # the workflow without tools is skipped, and b is not rewired as it has no other tool
+    assert len(rows) == 2 * 3 * 3 - 3
+    for row in rows:
+        workflow = workflows[["a", "b"].index(row['id'])]
+        perturbed = [tuple(edge) for edge in row['pmid_workflow']]
+        if row['perturbation'] == 'replace':
+            expected = [tuple(row['replacement'] if pmid == row['tool'] else pmid for pmid in edge)
+                        for edge in workflow]
+            assert perturbed == expected
+        elif row['perturbation'] == 'delete':
+            assert perturbed == ([edge for edge in workflow if row['tool'] not in edge]
+                                 + reconnect_edges(row['tool'], workflow))
+        else:
+            assert len(perturbed) == len(workflow)
+            assert row['replacement'] in {pmid for edge in workflow for pmid in edge}
+
+    outpath = os.path.join(tmp_path, "broken.jsonl")
+    nr_rows = write_perturbed_workflows(corpus, outpath, replacing_tools=["9"], nr_variants=3,
+                                        perturbations=PERTURBATIONS, rng=0, chunk_size=1)
+    with open(outpath, 'r', encoding='utf-8') as f:
+        assert [json.loads(line) for line in f] == rows
+    assert nr_rows == len(rows)
+
+
+def test_perturb_workflows_rewire_chunk():
+    """
+    A rewired edge never gets back the target it had, nor its own source, also when several
+    workflows are perturbed in one chunk. Workflows without another tool are skipped.
+    """
+    workflows = [[("1", "2"), ("2", "3")], [("7", "5"), ("5", "6"), ("6", "4")], [("3", "8"), ("8", "1")],
+                 [("4", "5")]]
+    corpus = WorkflowCorpus(workflows, ids=["a", "b", "c", "d"])
+    rows = list(perturb_workflows(corpus, replacing_tools=["9"], nr_variants=50,
+                                  perturbations=['rewire'], rng=0, chunk_size=4))
+    assert len(rows) == 3 * 50
+    for row in rows:
+        workflow = workflows[["a", "b", "c", "d"].index(row['id'])]
+        assert row['replacement'] != row['tool']
+        assert row['replacement'] in {pmid for edge in workflow for pmid in edge}
+        assert all(source != target for source, target in row['pmid_workflow'])
+        assert [variant['variant'] for variant in rows if variant['id'] == row['id']] == list(range(50))
+
+
+def test_metadata_index(shared_datadir):
+    """
+    The metadata file is loaded once, and reloaded when it is modified.
+    """
+    metadata_filename = os.path.join(shared_datadir, "tool_metadata_test20.json")
+    metadata_index = get_metadata_index(metadata_filename)
+    assert get_metadata_index(metadata_filename) is metadata_index
+    assert pmid_name_converter("xMarkerFinder", metadata_filename) == "38745111"
+    assert pmid_name_converter("NotATool", metadata_index=metadata_index) is None
+    assert convert_workflow_to_pmid_tuples([[("xMarkerFinder", "NotATool")]], metadata_index=metadata_index) == [[("38745111", None)]]
+
+    with open(metadata_filename, 'r') as f:
+        metadata = json.load(f)
+    metadata['tools'][0]['pmid'] = "1"
+    with open(metadata_filename, 'w') as f:
+        json.dump(metadata, f)
+    os.utime(metadata_filename, ns=(metadata_index.mtime + 10**9, metadata_index.mtime + 10**9))
+    assert pmid_name_converter("xMarkerFinder", metadata_filename) == "1"
+
+
+def test_pmid_name_converter_int(shared_datadir):
+    """
+    A PMID given as an int is converted to the names of its tools, a PMID given as a str
+    is looked up as a name.
+    """
+    metadata_index = get_metadata_index(os.path.join(shared_datadir, "tool_metadata_test20.json"))
+    assert pmid_name_converter(38745111, metadata_index=metadata_index) == ["xMarkerFinder"]
+    assert pmid_name_converter(1, metadata_index=metadata_index) == []
+    assert pmid_name_converter("38745111", metadata_index=metadata_index) is None
+
+
+def test_unique_workflows(shared_datadir):
+    """
+    Repeated workflows, with their edges in any order, are merged into one record with the
+    average rating.
+    """
+    metadata_filename = os.path.join(shared_datadir, "tool_metadata_test20.json")
+    workflow_json = [
+        {'id': 1, 'ratingAvg': 1.0, 'workflow': [["A", "B"], ["B", "C"]]},
+        {'id': 2, 'ratingAvg': 2.0, 'workflow': [["A", "C"]]},
+        {'id': 3, 'ratingAvg': 3.0, 'workflow': [["B", "C"], ["A", "B"]]},
+        {'id': 4, 'ratingAvg': 0.0, 'workflow': [["A", "B"], ["B", "C"]]},
+    ]
+    unique, repeated, all_unique = unique_workflows(workflow_json, metadata_filename)
+
+    assert unique == [workflow_json[1]]
+    assert repeated == [{'ratingAvg': 4.0 / 3, 'workflow': [["A", "B"], ["B", "C"]],
+                         'pmid_workflow': [(None, None), (None, None)]}]
+    assert all_unique == unique + repeated
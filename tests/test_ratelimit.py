@@ -0,0 +1,38 @@
+import time
+import asyncio
+from pubmetric.ratelimit import TokenBucket, HostRateLimiter, RequestStats
+
+def test_token_bucket_rate():
+    """Tests that the token bucket does not allow more than its rate after the initial burst"""
+    async def acquire_all(bucket, nr_requests):
+        for _ in range(nr_requests):
+            await bucket.acquire()
+    bucket = TokenBucket(rate=20, capacity=1)
+    start_time = time.monotonic()
+    asyncio.run(acquire_all(bucket, 11))
+    assert time.monotonic() - start_time >= 0.45 # 10 requests after the first at 20 per second
+
+def test_host_rate_limiter_adaptive():
+    """Tests that the rate of a host is halved when penalised and restored by successes"""
+    limiter = HostRateLimiter(default_rate=10, host_rates={'www.ebi.ac.uk': 8}, recovery=0.25)
+    url = 'https://www.ebi.ac.uk/europepmc/webservices/rest/MED/14632076/citations'
+    assert limiter.bucket(url).rate == 8
+    assert limiter.bucket('https://bio.tools/api/t').rate == 10
+    limiter.penalise(url)
+    assert limiter.bucket(url).rate == 4
+    limiter.reward(url)
+    limiter.reward(url)
+    limiter.reward(url)
+    assert limiter.bucket(url).rate == 8
+
+def test_request_stats_summary():
+    stats = RequestStats()
+    for latency in [0.1, 0.2, 0.3, 0.4]:
+        stats.record(latency)
+    stats.record_retry(429)
+    stats.record_failure()
+    summary = stats.summary()
+    assert summary['requests'] == 4
+    assert summary['throttled'] == 1
+    assert summary['failures'] == 1
+    assert summary['latency_p50'] == 0.3
@@ -27,6 +27,72 @@ def test_parse_undocumented_workflows(shared_datadir):
     assert workflow == undoc_workflow
 
 
+def test_parse_cache_and_tool_index(shared_datadir):
+    cwl_filename = os.path.join(shared_datadir, "candidate_workflow_repeated_tool.cwl")
+    with open(os.path.join(shared_datadir, "graph.pkl"), 'rb') as f:
+        graph = pickle.load(f)
+
+    clear_parse_cache()
+    uncached_workflow = parse_undocumented_workflows(graph=graph, cwl_filename=cwl_filename, use_cache=False)
+    workflow = parse_undocumented_workflows(graph=graph, cwl_filename=cwl_filename)
+    cached_workflow = parse_undocumented_workflows(graph=graph, cwl_filename=cwl_filename)
+    assert uncached_workflow == workflow == cached_workflow
+
+    tool_index = get_tool_index(graph)
+    assert tool_index is get_tool_index(graph)
+    xtandem_pmid = next(tool['pmid'] for tool in graph.vs if tool['name'] == 'XTandem')
+    assert tool_index.step_pmid('XTandem_01') == xtandem_pmid
+    assert workflow['steps']['XTandem_01'] == xtandem_pmid
+
+def test_parse_cwl_directory(shared_datadir):
+    with open(os.path.join(shared_datadir, "graph.pkl"), 'rb') as f:
+        graph = pickle.load(f)
+    workflows, errors = parse_cwl_directory(graph, shared_datadir, parser='undocumented', processes=2, use_cache=False)
+    assert not errors
+    for filename, workflow in workflows.items():
+        assert workflow == parse_undocumented_workflows(graph=graph, cwl_filename=filename)
+
+    scores = score_cwl_directory(graph, shared_datadir, parser='undocumented', processes=2, batch_size=2)
+    assert sorted(scores.index) == sorted(workflows)
+    assert scores['error'].isna().all()
+
+def test_parse_cwl_directory_cache(shared_datadir, monkeypatch):
+    """Files hashed and parsed in the workers are cached, and later cache hits are
+    served from the main process and moved to the end of the parse cache"""
+    import pubmetric.workflow
+    with open(os.path.join(shared_datadir, "graph.pkl"), 'rb') as f:
+        graph = pickle.load(f)
+    clear_parse_cache()
+    workflows, errors = parse_cwl_directory(graph, shared_datadir, parser='undocumented', processes=2)
+    assert not errors
+    parse_cache = pubmetric.workflow._parse_cache
+    cached_keys = set(parse_cache)
+    assert cached_keys
+    parse_cache[('other_parser', 'hash')] = ([], [])
+    def failing_split_cwl_steps(cwl_filename):
+        raise AssertionError("A cached file was parsed again.")
+    failing_split_cwl_steps.__name__ = '_split_cwl_steps' # same cache keys
+    monkeypatch.setitem(pubmetric.workflow.PARSERS, 'undocumented',
+                        (failing_split_cwl_steps, pubmetric.workflow.PARSERS['undocumented'][1]))
+    for processes in (2, 1):
+        cached_workflows, errors = parse_cwl_directory(graph, shared_datadir, parser='undocumented',
+                                                       processes=processes)
+        assert not errors
+        assert cached_workflows == workflows
+        assert next(iter(parse_cache)) == ('other_parser', 'hash')
+        assert set(parse_cache) == cached_keys | {('other_parser', 'hash')}
+    clear_parse_cache()
+
+def test_parse_cwl_lines(shared_datadir):
+    cwl_filename = os.path.join(shared_datadir, "candidate_workflow_repeated_tool.cwl")
+    with open(os.path.join(shared_datadir, "graph.pkl"), 'rb') as f:
+        graph = pickle.load(f)
+
+    workflow = parse_cwl_lines(graph=graph, cwl_filename=cwl_filename)
+    assert workflow['edges'] == [('XTandem_01', 'ProteinProphet_02'), ('ProteinProphet_02', 'StPeter_04'), ('XTandem_03', 'StPeter_04')]
+    assert list(workflow['steps']) == ['XTandem_01', 'ProteinProphet_02', 'XTandem_03', 'StPeter_04']
+    assert workflow == parse_undocumented_workflows(graph=graph, cwl_filename=cwl_filename)
+
 
 
 # def test_generate_pmid_edges(shared_datadir): # This is outdated now, dont know If i want to recreate it. TODO